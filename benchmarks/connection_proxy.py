@@ -0,0 +1,82 @@
+"""Micro-benchmark of ``djangoes.connection``.
+
+It compares the cost of calling a method of the default connection through:
+
+* the connection itself (the lower bound),
+* :class:`djangoes.ConnectionProxy`,
+* the previous implementation of the proxy, which got the connection from the
+  handler for each attribute access.
+
+Run it from the root of the repository::
+
+   python benchmarks/connection_proxy.py [--number 1000000]
+
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import djangoes  # noqa: E402
+from djangoes.backends.abstracts import Base  # noqa: E402
+
+
+class NoopBackend(Base):
+    """Backend whose query does nothing, to measure the proxy only."""
+    def configure_client(self):
+        pass
+
+    def search(self, doc_type=None, body=None, **kwargs):
+        return None
+
+
+class LegacyConnectionProxy(object):
+    """Previous implementation of :class:`djangoes.ConnectionProxy`."""
+    def __init__(self, alias):
+        self.__dict__['alias'] = alias
+
+    def __getattr__(self, item):
+        return getattr(djangoes.connections[self.__dict__['alias']], item)
+
+
+def run(number, repeat):
+    djangoes.connections = djangoes.ConnectionHandler({
+        'default': {
+            'ENGINE': '__main__.NoopBackend',
+        }
+    }, {})
+    conn = djangoes.connections['default']
+    candidates = [
+        ('connection object', conn),
+        ('ConnectionProxy', djangoes.ConnectionProxy('default')),
+        ('legacy proxy', LegacyConnectionProxy('default')),
+    ]
+
+    results = {}
+    for name, target in candidates:
+        timer = timeit.Timer('target.search()', globals={'target': target})
+        best = min(timer.repeat(repeat=repeat, number=number))
+        results[name] = best / number * 1e9
+
+    baseline = results['connection object']
+    for name, nanoseconds in results.items():
+        print('%-20s %8.1f ns/call  (+%.1f ns)' % (
+            name, nanoseconds, nanoseconds - baseline))
+
+    print('ConnectionProxy is %.1fx faster than the legacy proxy' % (
+        results['legacy proxy'] / results['ConnectionProxy']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    run(args.number, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,11 @@ There is a shortcut to get the default connection::
 
 It works exactly like getting the ``default`` connection from ``connections``.
 
+By default, each thread gets its own connection objects. When a server is
+configured with the ``SHARED`` option, its connection object is created once
+and shared by all the threads of the process: its backend must then be
+thread-safe, such as :class:`~djangoes.backends.elasticsearch.PooledHttpBackend`.
+
 .. note::
 
     This module is based on the ``django.db`` module, which is quite simple in
@@ -31,13 +36,24 @@ It works exactly like getting the ``default`` connection from ``connections``.
     that make Django a great framework.
 
 """
+import asyncio
+from contextvars import ContextVar
 from importlib import import_module
 import os
-from threading import local
+from threading import current_thread, local, Lock
+from types import MethodType
+from weakref import WeakKeyDictionary, WeakSet
 
 from django.conf import settings
+from django.core.signals import (request_finished, request_started,
+                                  setting_changed)
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .backends.abstracts import Base
+from .backends.instrumentation import registry as stats_registry
+from .config import ServerConfig
 
 
 __version__ = '0.3.1'
@@ -46,6 +62,66 @@ __version__ = '0.3.1'
 #: Name of the default ElasticSearch server connection
 DEFAULT_ES_ALIAS = 'default'
 
+#: Backend used by default for asynchronous connections
+DEFAULT_ASYNC_ENGINE = 'djangoes.backends.aio.AsyncHttpBackend'
+
+
+#: Connections handlers to reset in a child process after a fork.
+_HANDLERS = WeakSet()
+
+#: PID of the current process, updated in a child process after a fork.
+_CURRENT_PID = os.getpid()
+
+
+def get_current_pid():
+    """Return the PID of the current process.
+
+    When ``os.register_at_fork`` is available, the PID is updated in the child
+    process after each fork, so this does not require a system call.
+    """
+    if hasattr(os, 'register_at_fork'):
+        return _CURRENT_PID
+
+    return os.getpid()
+
+
+def _reset_after_fork():
+    """Reset all the connections handlers in a child process."""
+    global _CURRENT_PID  #pylint: disable=global-statement
+    _CURRENT_PID = os.getpid()
+
+    for handler in list(_HANDLERS):
+        handler.reset_connections()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+#: Attributes of each :class:`ConnectionProxy`, by thread, holding the bound
+#: methods of the connections cached by the proxies.
+_PROXY_CACHES = WeakKeyDictionary()
+_PROXY_CACHES_LOCK = Lock()
+
+
+def invalidate_proxies():
+    """Forget the methods cached by the proxies, in all the threads.
+
+    It is called when the connections of a handler are replaced or removed,
+    when a handler is created, when the routers change, and when an instance
+    attribute of a connection hides one of its methods (see
+    :meth:`djangoes.backends.abstracts.Base.__setattr__`).
+    """
+    with _PROXY_CACHES_LOCK:
+        caches = [attributes
+                  for thread_caches in list(_PROXY_CACHES.values())
+                  for attributes in thread_caches]
+
+    for attributes in caches:
+        alias = attributes['alias']
+        attributes.clear()
+        attributes['alias'] = alias
+
 
 def load_backend(backend_class_path):
     """Import the given `backend_class_path` class and return it.
@@ -100,7 +176,16 @@ class ConnectionHandler(object):
         self._servers = servers
         self._indices = indices
         self._connections = local()
-        self._pid = os.getpid()
+        self._shared_connections = {}
+        self._shared_lock = Lock()
+        self._configs = {}
+        self._configs_lock = Lock()
+        self._async_connections = ContextVar('djangoes_async_connections')
+        self._loop_connections = WeakKeyDictionary()
+        self._pid = get_current_pid()
+        _HANDLERS.add(self)
+        # The proxies may have cached the methods of another handler.
+        invalidate_proxies()
 
     # Properties
     # ----------
@@ -255,20 +340,141 @@ class ConnectionHandler(object):
 
         return {alias: self.indices[alias].copy() for alias in indices}
 
+    def get_config(self, alias):
+        """Return the compiled configuration for the given alias.
+
+        The settings of `alias` are prepared, validated and compiled into a
+        :class:`~djangoes.config.ServerConfig` the first time it is requested,
+        then the same configuration is used by all the backends of `alias`,
+        in all threads.
+        """
+        try:
+            return self._configs[alias]
+        except KeyError:
+            pass
+
+        with self._configs_lock:
+            if alias not in self._configs:
+                # Prepares the settings
+                self.ensure_server_defaults(alias)
+                self.prepare_server_test_settings(alias)
+
+                # Gets the settings for `alias`
+                server = self.servers[alias]
+                indices = self.get_server_indices(server)
+
+                # Loads the backend class
+                backend_class = load_backend(server['ENGINE'])
+
+                self._configs[alias] = ServerConfig(
+                    alias, server, indices, backend_class)
+
+            return self._configs[alias]
+
+    def set_config(self, conn):
+        """Compile again the configuration of `conn`'s alias from `conn`.
+
+        This is used when a connection's settings are modified at runtime
+        (for example to use the test settings), so connections created
+        afterward use the same settings.
+        """
+        config = ServerConfig(conn.alias, conn.server, conn.server_indices,
+                              conn.__class__)
+
+        with self._configs_lock:
+            self._configs[conn.alias] = config
+
     def load_backend(self, alias):
         """Prepare and load a backend for the given alias."""
-        # Prepares the settings
-        self.ensure_server_defaults(alias)
-        self.prepare_server_test_settings(alias)
+        config = self.get_config(alias)
+
+        return config.backend_class.from_config(config)
+
+    def is_shared(self, alias):
+        """Tell if the connection for `alias` is shared by all threads.
+
+        A connection is shared when its server is configured with a truthy
+        ``SHARED`` option.
+        """
+        return self.get_config(alias).shared
+
+    def get_shared_connection(self, alias):
+        """Return the connection for `alias` shared by all threads.
 
-        # Gets the settings for `alias`
-        server = self.servers[alias]
-        indices = self.get_server_indices(server)
+        The connection is loaded and configured the first time it is
+        requested, then the same connection object is always returned in the
+        current process.
+        """
+        try:
+            return self._shared_connections[alias]
+        except KeyError:
+            pass
 
-        # Loads the backend
-        backend_class = load_backend(server['ENGINE'])
+        with self._shared_lock:
+            # Another thread may have created it while waiting for the lock.
+            if alias not in self._shared_connections:
+                conn = self.load_backend(alias)
+                conn.configure_client()
+                self._shared_connections[alias] = conn
 
-        return backend_class(alias, server, indices)
+            return self._shared_connections[alias]
+
+    def load_async_backend(self, alias):
+        """Prepare and load an asynchronous backend for the given alias.
+
+        It uses the same settings as :meth:`load_backend`, except for the
+        backend class that is given by the ``ASYNC_ENGINE`` option, by
+        default :data:`DEFAULT_ASYNC_ENGINE`.
+        """
+        config = self.get_config(alias)
+        backend_class = load_backend(
+            config.server.get('ASYNC_ENGINE', DEFAULT_ASYNC_ENGINE))
+
+        return backend_class.from_config(config)
+
+    def get_async(self, alias=DEFAULT_ES_ALIAS):
+        """Return the asynchronous connection for `alias`.
+
+        It must be called from a coroutine: asynchronous connections are
+        bound to the running event loop, and each one is created once per
+        event loop, so all its tasks share the same keep-alive sockets.
+
+        Connections are cached in a context variable instead of a thread
+        local: a task sees the connections of the context it was created in,
+        and :meth:`set_async` only affects the current context.
+        """
+        conns = self._async_connections.get(None) or {}
+
+        try:
+            return conns[alias]
+        except KeyError:
+            pass
+
+        loop = asyncio.get_running_loop()
+        loop_conns = self._loop_connections.setdefault(loop, {})
+
+        if alias not in loop_conns:
+            conn = self.load_async_backend(alias)
+            conn.configure_client()
+            loop_conns[alias] = conn
+
+        # The dict may be shared with the contexts copied from this one, such
+        # as the contexts of other tasks or event loops: it is never modified.
+        conns = dict(conns)
+        conns[alias] = loop_conns[alias]
+        self._async_connections.set(conns)
+
+        return conns[alias]
+
+    def set_async(self, alias, conn):
+        """Use `conn` as the asynchronous connection for `alias`.
+
+        The connection is used in the current context only, ie. the current
+        task and the tasks it creates afterward.
+        """
+        conns = dict(self._async_connections.get(None) or {})
+        conns[alias] = conn
+        self._async_connections.set(conns)
 
     def check_for_multiprocess(self):
         """
@@ -282,13 +488,162 @@ class ConnectionHandler(object):
         fork until it is modified. The read-only mode will "share" connections
         and that's not what we want.
 
+        Connections are already reset in the child process right after a fork
+        when ``os.register_at_fork`` is available: this check then only
+        compares the PID with a cached value, without system call.
         """
-        current_pid = os.getpid()
-
-        if current_pid != self._pid:
+        if get_current_pid() != self._pid:
             # PID is different, we need to reset all the previous connections.
-            self._pid = current_pid
-            self._connections = local()
+            self.reset_connections()
+
+    def reset_connections(self):
+        """Forget all the connections, in all threads.
+
+        Connections are not closed: in a child process after a fork, their
+        sockets are still used by the parent process. The backends never close
+        the sockets opened by another process, even when they are garbage
+        collected or closed in the child process.
+        """
+        self._pid = get_current_pid()
+        self._connections = local()
+        self._shared_connections = {}
+        self._shared_lock = Lock()
+        self._async_connections = ContextVar('djangoes_async_connections')
+        self._loop_connections = WeakKeyDictionary()
+        invalidate_proxies()
+
+    def for_read(self, alias=DEFAULT_ES_ALIAS, **hints):
+        """Return the connection to read from `alias`, given by the router.
+
+        See :meth:`ConnectionRouter.for_read`.
+        """
+        return self[router.for_read(alias, **hints)]
+
+    def for_write(self, alias=DEFAULT_ES_ALIAS, **hints):
+        """Return the connection to write to `alias`, given by the router.
+
+        See :meth:`ConnectionRouter.for_write`.
+        """
+        return self[router.for_write(alias, **hints)]
+
+    def stats(self, alias=None):
+        """Return the stats of the queries performed in the current process.
+
+        The stats are a dict ``{alias: {method: stats}}``, or only
+        ``{method: stats}`` for the given `alias`, where each ``stats`` dict
+        gives the number of ``calls`` and ``errors``, the number of bytes
+        ``sent`` and ``received``, and the latency in milliseconds (total,
+        mean, max, estimated percentiles and ``histogram``).
+
+        See :mod:`djangoes.backends.instrumentation`.
+        """
+        return stats_registry.snapshot(alias)
+
+    def reset_stats(self):
+        """Forget the stats of the queries performed until now."""
+        stats_registry.reset()
+
+    def get_queries(self):
+        """Return the queries logged by the connections of the current thread.
+
+        Only the connections already used by the current thread are
+        considered. See :attr:`djangoes.backends.abstracts.Base.queries`.
+        """
+        return [query
+                for conn in list(self._connections.__dict__.values())
+                for query in conn.queries]
+
+    def reset_queries(self):
+        """Forget the queries logged by the connections of the current thread.
+        """
+        for conn in list(self._connections.__dict__.values()):
+            conn.reset_queries()
+
+    def flush_writes(self):
+        """Send the writes buffered by the connections of the current thread.
+
+        Only the connections already used by the current thread are
+        considered. See :mod:`djangoes.backends.buffering`.
+        """
+        for conn in list(self._connections.__dict__.values()):
+            conn.flush_writes()
+
+    def discard(self, alias):
+        """Remove the connection of `alias` from the current thread.
+
+        A connection used only by the current thread is closed. A shared
+        connection is not closed, as other threads may use it: it is only
+        removed from the handler, so the next threads get a new one, and it is
+        closed once it is not used anymore.
+        """
+        conn = self._connections.__dict__.pop(alias)
+
+        try:
+            shared = self.is_shared(alias)
+        except ConnectionDoesNotExist:
+            shared = False
+
+        if shared:
+            with self._shared_lock:
+                if self._shared_connections.get(alias) is conn:
+                    del self._shared_connections[alias]
+        else:
+            conn.close()
+
+        invalidate_proxies()
+
+    def close_all(self):
+        """Close all the connections of the current thread.
+
+        Shared connections are not closed, only discarded: see
+        :meth:`discard`.
+        """
+        for alias in list(self._connections.__dict__):
+            self.discard(alias)
+
+    def close_obsolete(self):
+        """Close the connections of the current thread which are too old.
+
+        A connection is too old when it has been created more than
+        ``CONN_MAX_AGE`` seconds ago (see
+        :meth:`~djangoes.backends.abstracts.Base.is_obsolete`).
+        """
+        for alias, conn in list(self._connections.__dict__.items()):
+            if conn.is_obsolete():
+                self.discard(alias)
+
+    def warm_up(self, aliases=None, sockets=1, sniff=False):
+        """Validate the settings and open connections before they are needed.
+
+        First, all the servers and indices settings are validated, and all
+        the backend classes are imported: an error is raised now instead of
+        during the first query.
+
+        Then, for each alias in `aliases` (by default all of them), the
+        connection is created and its backend opens `sockets` keep-alive
+        sockets per host, after sniffing the nodes of the cluster if `sniff`
+        is ``True``.
+
+        As connections are created for the current thread, warming up is
+        mostly useful for connections shared by all threads (see the
+        ``SHARED`` option).
+        """
+        for alias in self.indices:
+            self.ensure_index_defaults(alias)
+            self.prepare_index_test_settings(alias)
+
+        for alias in self.servers:
+            self.ensure_server_defaults(alias)
+            self.prepare_server_test_settings(alias)
+            server = self.servers[alias]
+            self.get_server_indices(server)
+            load_backend(server['ENGINE'])
+
+        if aliases is None:
+            aliases = list(self.servers)
+
+        for alias in aliases:
+            self[alias].warm_up(sockets=sockets, sniff=sniff)
 
     # Magic methods
     # -------------
@@ -300,19 +655,29 @@ class ConnectionHandler(object):
             # Returns cached instance
             return getattr(self._connections, alias)
 
-        # Loads and caches the backend
-        conn = self.load_backend(alias)
-        conn.configure_client()
+        if self.is_shared(alias):
+            conn = self.get_shared_connection(alias)
+        else:
+            # Loads and caches the backend
+            conn = self.load_backend(alias)
+            conn.configure_client()
 
         setattr(self._connections, alias, conn)
+        proxy_attributes(dir(conn))
 
         return conn
 
     def __setitem__(self, key, value):
         setattr(self._connections, key, value)
+        proxy_attributes(dir(value))
+        invalidate_proxies()
 
     def __delitem__(self, key):
         delattr(self._connections, key)
+        self._shared_connections.pop(key, None)
+        # Settings may have changed: compile them again next time.
+        self._configs.pop(key, None)
+        invalidate_proxies()
 
     def __iter__(self):
         return iter(self.servers)
@@ -332,29 +697,253 @@ class ConnectionHandler(object):
 connections = ConnectionHandler()  #pylint: disable=invalid-name
 
 
-class ConnectionProxy(object):
+class ProxiedAttribute(object):
+    """Attribute of the connections given by :class:`ConnectionProxy`.
+
+    It is only used until the attribute is cached for the current thread, in
+    the attributes of the proxy, that take precedence over it.
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, proxy, owner=None):
+        if proxy is None:
+            return self
+        return proxy._get_attribute(self.name)
+
+
+class ConnectionProxy(local):
     """Proxy for the default ``ConnectionWrapper``'s attributes.
 
     This class is based on ``django.db.DefaultConnectionProxy`` used for the
     default database.
+
+    The proxy is a thread local: the bound methods of the connection of the
+    current thread are cached in the attributes of the proxy for this thread,
+    so getting a cached method through the proxy is one lookup in a dict,
+    without any Python code. The methods cached in all the threads are
+    forgotten when the connections change (see :func:`invalidate_proxies`).
+
+    The other attributes are given by a :class:`ProxiedAttribute` of the
+    class, added for each attribute of the connections (see
+    :func:`proxy_attributes`). When routers are configured, the methods of
+    :data:`READ_METHODS` and :data:`WRITE_METHODS` are taken from the
+    connection given by the router at each call, and they are not cached.
     """
     def __init__(self, alias):
-        self.__dict__['alias'] = alias or DEFAULT_ES_ALIAS
+        # Called in each thread using the proxy, with the same alias.
+        attributes = self.__dict__
+        attributes['alias'] = alias or DEFAULT_ES_ALIAS
+
+        with _PROXY_CACHES_LOCK:
+            _PROXY_CACHES.setdefault(current_thread(), []).append(attributes)
+
+    def _get_attribute(self, item):
+        """Get `item` from the connection, and cache it if it is a method."""
+        if router.routers and (item in READ_METHODS or item in WRITE_METHODS):
+            alias = router.for_method(self.alias, item)
+            return getattr(connections[alias], item)
+
+        conn = connections[self.alias]
+        value = getattr(conn, item)
 
-    def __getattr__(self, item):
-        return getattr(connections[self.__dict__['alias']], item)
+        if (isinstance(value, MethodType) and
+                value.__self__ is conn and
+                item not in conn.__dict__):
+            self.__dict__[item] = value
+
+        return value
 
     def __setattr__(self, name, value):
-        return setattr(connections[self.__dict__['alias']], name, value)
+        proxy_attributes([name])
+        invalidate_proxies()
+        return setattr(connections[self.alias], name, value)
 
     def __delattr__(self, name):
-        return delattr(connections[self.__dict__['alias']], name)
+        invalidate_proxies()
+        return delattr(connections[self.alias], name)
 
     def __eq__(self, other):
-        return connections[self.__dict__['alias']] == other
+        return connections[self.alias] == other
 
     def __ne__(self, other):
-        return connections[self.__dict__['alias']] != other
+        return connections[self.alias] != other
+
+
+def proxy_attributes(names):
+    """Give access to the attributes `names` of the connections through
+    :class:`ConnectionProxy`.
+
+    It is called with the attributes of each connection of a handler, and
+    with each instance attribute set on a backend (see
+    :meth:`djangoes.backends.abstracts.Base.__setattr__`).
+    """
+    for name in names:
+        if not name.startswith('__') and not hasattr(ConnectionProxy, name):
+            setattr(ConnectionProxy, name, ProxiedAttribute(name))
+
+
+def get_backend_classes(cls=Base):
+    """Return `cls` and all its subclasses, recursively."""
+    classes = [cls]
+    for subclass in cls.__subclasses__():
+        classes.extend(get_backend_classes(subclass))
+    return classes
+
+
+proxy_attributes({name
+                  for backend_class in get_backend_classes()
+                  for name in dir(backend_class)})
+
+
+def close_old_connections(**kwargs):
+    """Close the connections of the current thread older than their max age.
+
+    It is connected to the ``request_started`` and ``request_finished``
+    signals of Django, the same way database connections are handled.
+    """
+    connections.close_obsolete()
+
+
+request_started.connect(close_old_connections)
+request_finished.connect(close_old_connections)
+
+
+def reset_queries(**kwargs):
+    """Forget the queries logged by the connections of the current thread.
+
+    It is connected to the ``request_started`` signal of Django, so the query
+    logs only contain the queries of the current request.
+    """
+    connections.reset_queries()
+
+
+request_started.connect(reset_queries)
+
+
+def flush_writes(**kwargs):
+    """Send the writes buffered by the connections of the current thread.
+
+    It is connected to the ``request_finished`` signal of Django, so the
+    writes of a request are not delayed after its end.
+    """
+    connections.flush_writes()
+
+
+request_finished.connect(flush_writes)
+
+
+#: Methods of a connection routed with :meth:`ConnectionRouter.for_read`.
+READ_METHODS = frozenset([
+    'mget', 'msearch', 'mpercolate', 'scroll', 'clear_scroll', 'exists',
+    'get', 'get_source', 'search', 'search_shards', 'search_template',
+    'explain', 'count', 'suggest', 'percolate', 'count_percolate', 'mlt',
+    'termvector', 'mtermvectors',
+])
+
+#: Methods of a connection routed with :meth:`ConnectionRouter.for_write`.
+WRITE_METHODS = frozenset([
+    'bulk', 'create', 'index', 'update', 'delete', 'delete_by_query',
+])
+
+
+class ConnectionRouter(object):
+    """Route queries from one connection alias to another.
+
+    Based on ``django.db.utils.ConnectionRouter``, it uses the routers of the
+    ``ES_ROUTERS`` setting (or the given `routers`): each router is either an
+    object or the dotted path of a class to instantiate, that may implement
+    any of these methods:
+
+    * ``es_for_read(alias, **hints)``: the alias of the connection to use to
+      read from `alias` (search, count, get, etc.),
+    * ``es_for_write(alias, **hints)``: the alias of the connection to use to
+      write to `alias` (index, bulk, update, delete, etc.).
+
+    The first router to return an alias wins; when none does (or when they
+    all return ``None``), `alias` itself is used. The ``method`` hint is the
+    name of the connection's method to call.
+    """
+    def __init__(self, routers=None):
+        self._routers = routers
+        self._loaded = None
+
+    @property
+    def routers(self):
+        """List of router objects, loaded once.
+
+        Without the `routers` argument, they are given by the ``ES_ROUTERS``
+        setting: as long as Django's settings are not configured, there is no
+        router, and they are loaded once the settings are configured.
+        """
+        if self._loaded is not None:
+            return self._loaded
+
+        routers = self._routers
+        if routers is None:
+            if not settings.configured:
+                return []
+            routers = getattr(settings, 'ES_ROUTERS', [])
+
+        loaded = []
+        for router in routers:
+            if isinstance(router, str):
+                router = import_string(router)()
+            loaded.append(router)
+
+        self._loaded = loaded
+        return loaded
+
+    def _router_func(action):
+        def _route_alias(self, alias, **hints):
+            for router in self.routers:
+                try:
+                    method = getattr(router, action)
+                except AttributeError:
+                    # If the router doesn't have a method, skip to the next
+                    # one.
+                    continue
+
+                chosen_alias = method(alias, **hints)
+                if chosen_alias:
+                    return chosen_alias
+
+            return alias
+
+        return _route_alias
+
+    for_read = _router_func('es_for_read')
+    for_write = _router_func('es_for_write')
+
+    def for_method(self, alias, method, **hints):
+        """Return the alias to use to call `method` of `alias`.
+
+        Methods not in :data:`READ_METHODS` nor in :data:`WRITE_METHODS` are
+        not routed.
+        """
+        if method in READ_METHODS:
+            return self.for_read(alias, method=method, **hints)
+        if method in WRITE_METHODS:
+            return self.for_write(alias, method=method, **hints)
+        return alias
+
+
+#: Global router for ``djangoes``, configured by the ``ES_ROUTERS`` setting.
+router = ConnectionRouter()  #pylint: disable=invalid-name
+
+
+def reset_router(setting, **kwargs):
+    """Reset the routers when the ``ES_ROUTERS`` setting changes."""
+    if setting == 'ES_ROUTERS':
+        router._routers = None
+        router._loaded = None
+        # Methods cached by ConnectionProxy may not be routed the same way.
+        invalidate_proxies()
+
+
+setting_changed.connect(reset_router)
 
 
 #: Default connection to ElasticSearch.
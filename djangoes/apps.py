@@ -0,0 +1,41 @@
+"""Django application configuration for ``djangoes``.
+
+Adding ``djangoes`` to ``INSTALLED_APPS`` is not required. When it is, the
+connections can be warmed up when Django starts, with the ``ES_WARM_UP``
+setting::
+
+    ES_WARM_UP = True
+
+It can also be a dict, with the arguments of
+:meth:`djangoes.ConnectionHandler.warm_up` as uppercase keys::
+
+    ES_WARM_UP = {
+        'ALIASES': ['default'],
+        'SOCKETS': 4,
+        'SNIFF': True,
+    }
+
+"""
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class DjangoesConfig(AppConfig):
+    """Application configuration warming up connections when ready."""
+    name = 'djangoes'
+    verbose_name = 'Djangoes'
+
+    def ready(self):
+        warm_up = getattr(settings, 'ES_WARM_UP', False)
+
+        if not warm_up:
+            return
+
+        if warm_up is True:
+            warm_up = {}
+
+        from djangoes import connections
+
+        connections.warm_up(aliases=warm_up.get('ALIASES'),
+                            sockets=warm_up.get('SOCKETS', 1),
+                            sniff=warm_up.get('SNIFF', False))
@@ -3,6 +3,10 @@
 All backends are expecting to subclass these abstract classes and to implement
 their behaviors.
 """
+import sys
+import time
+from types import FunctionType
+
 from django.utils.functional import cached_property
 
 
@@ -10,8 +14,41 @@ ATTR_ERROR_TEMPLATE = ('\'%s\' object has no attribute \'%s\', '
                        'is it implemented?')
 
 
+def proxy_attributes(names):
+    """Give access to the attributes `names` of a backend through
+    :class:`djangoes.ConnectionProxy`, once djangoes is imported: then it
+    gives access to the attributes of the backend classes already defined.
+    """
+    djangoes = sys.modules.get('djangoes')
+    proxy_names = getattr(djangoes, 'proxy_attributes', None)
+    if proxy_names is not None:
+        proxy_names(names)
+
+
+def attribute_changed(backend, name):
+    """Tell the instance attribute `name` of `backend` is set or deleted.
+
+    It is given by :class:`djangoes.ConnectionProxy`, and when it hides a
+    method of the backend, or stops hiding it (such as when a method of a
+    connection is patched), the methods cached by the proxies are forgotten.
+    """
+    proxy_attributes([name])
+    if isinstance(getattr(type(backend), name, None), FunctionType):
+        sys.modules['djangoes'].invalidate_proxies()
+
+
 class Base(object):
     """ElasticSearch backend wrapper base."""
+    #: Interceptors of the queries, set when the client is configured (see
+    #: :mod:`djangoes.backends.interceptors`).
+    interceptors = ()
+    #: Log of the last queries, when enabled (see
+    #: :mod:`djangoes.backends.querylog`).
+    query_log = None
+    #: Buffer of the write operations, when enabled (see
+    #: :mod:`djangoes.backends.buffering`).
+    write_buffer = None
+
     def __init__(self, alias, server, indices):
         """Instantiate a connection wrapper."""
         self.alias = alias
@@ -19,10 +56,87 @@ class Base(object):
         self.server_indices = indices
         self.client = None
 
+        # Connection lifetime, in seconds, before it must be closed.
+        max_age = server.get('CONN_MAX_AGE', None)
+        self.close_at = None
+        if max_age is not None:
+            self.close_at = time.monotonic() + max_age
+
+    def __init_subclass__(cls, **kwargs):
+        super(Base, cls).__init_subclass__(**kwargs)
+        proxy_attributes(dir(cls))
+
+    def __setattr__(self, name, value):
+        super(Base, self).__setattr__(name, value)
+        attribute_changed(self, name)
+
+    def __delattr__(self, name):
+        super(Base, self).__delattr__(name)
+        attribute_changed(self, name)
+
+    @classmethod
+    def from_config(cls, config):
+        """Instantiate a backend from a compiled configuration.
+
+        The `config` is a :class:`~djangoes.config.ServerConfig`, whose index
+        lists are already computed: the backend does not need to compute them
+        again, it only gets its own copy of them.
+        """
+        backend = cls(config.alias, config.server, config.server_indices)
+        backend.indices = list(config.indices)
+        backend.index_names = list(config.index_names)
+        backend.alias_names = list(config.alias_names)
+        backend.indices_param = config.indices_param
+
+        return backend
+
     def configure_client(self):
         """Configure the ElasticSearch client."""
         raise NotImplementedError
 
+    def close(self):
+        """Close the client's sockets, once the write buffer is flushed.
+
+        The connection must not be used after being closed. Backends that do
+        not keep any socket can keep this default implementation, which only
+        flushes the write buffer.
+        """
+        self.flush_writes()
+
+    @property
+    def queries(self):
+        """List of the last queries logged for the current thread.
+
+        It is always empty when the query log of the connection is disabled.
+        """
+        if self.query_log is None:
+            return []
+        return list(self.query_log)
+
+    def reset_queries(self):
+        """Forget the queries logged for the current thread."""
+        if self.query_log is not None:
+            self.query_log.clear()
+
+    def flush_writes(self):
+        """Send the write operations waiting in the write buffer, if any.
+
+        The error of the request is logged, not raised.
+        """
+        if self.write_buffer is not None:
+            self.write_buffer.flush_later()
+
+    def is_obsolete(self):
+        """Tell if the connection has exceeded its ``CONN_MAX_AGE``."""
+        return self.close_at is not None and time.monotonic() >= self.close_at
+
+    def warm_up(self, sockets=1, sniff=False):
+        """Open connections to ElasticSearch before they are needed.
+
+        By default, there is nothing to warm up.
+        """
+        pass
+
     def get_indices(self):
         """Build the list of indices or aliases used to query ElasticSearch.
 
@@ -99,3 +213,18 @@ class Base(object):
     def alias_names(self):
         """Cached property upon :meth:`get_alias_names`."""
         return self.get_alias_names()
+
+    @cached_property
+    def indices_param(self):
+        """Comma-joined string of :attr:`indices`, as sent by the client."""
+        return ','.join(self.indices)
+
+    def refresh_indices(self):
+        """Compute again the cached properties based on indices settings.
+
+        It must be called each time ``server_indices`` is modified.
+        """
+        self.indices = self.get_indices()
+        self.index_names = self.get_index_names()
+        self.alias_names = self.get_alias_names()
+        self.indices_param = ','.join(self.indices)
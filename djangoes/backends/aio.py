@@ -0,0 +1,423 @@
+"""Asynchronous connection backends, to be used with ``asyncio``.
+
+This module provides a backend whose methods are coroutines, so a single event
+loop (an ASGI server, for example) can perform many concurrent queries without
+a thread per query::
+
+    >>> from djangoes import connections
+    >>> conn = connections.get_async('default')
+    >>> result = await conn.search(body=query)
+
+It relies on the client of the ElasticSearch official library, with an
+asynchronous transport class: the client builds URLs and parameters the same
+way it does for the synchronous backends, and the transport returns a
+coroutine instead of a response.
+
+The HTTP requests are performed by ``aiohttp``, which is an optional
+dependency: an ``ImproperlyConfigured`` error is raised when the client is
+configured without it.
+"""
+import asyncio
+import ssl
+
+from django.core.exceptions import ImproperlyConfigured
+from elasticsearch.client import Elasticsearch
+from elasticsearch.client.utils import _make_path
+from elasticsearch.compat import urlencode
+from elasticsearch.connection.base import Connection
+from elasticsearch.exceptions import (ConnectionError, ConnectionTimeout,
+                                      NotFoundError, SSLError, TransportError)
+from elasticsearch.transport import Transport
+
+from .abstracts import Base
+
+
+class AsyncTransport(Transport):
+    """Transport class whose requests are performed by coroutines.
+
+    The client of the official library unpacks the result of
+    :meth:`perform_request` and returns its data: this transport returns a
+    coroutine as the data, so each client method returns an awaitable.
+
+    Its connection class must provide a coroutine ``perform_request`` method.
+    Sniffing is not supported, as it would require blocking requests.
+    """
+    def __init__(self, hosts, **kwargs):
+        for option in ('sniff_on_start', 'sniffer_timeout',
+                       'sniff_on_connection_fail'):
+            if kwargs.get(option):
+                raise ImproperlyConfigured(
+                    'Option %r is not supported by asynchronous backends.'
+                    % option)
+
+        super(AsyncTransport, self).__init__(hosts, **kwargs)
+
+    def get_connection(self):
+        """Return a connection from the pool, without sniffing."""
+        return self.connection_pool.get_connection()
+
+    def perform_request(self, method, url, params=None, body=None):
+        """Return a status placeholder and the coroutine of the request."""
+        return None, self.request_data(method, url, params, body)
+
+    async def request_data(self, method, url, params=None, body=None):
+        """Perform the request and return its data only."""
+        _, data = await self.perform_request_async(method, url, params, body)
+        return data
+
+    async def perform_request_async(self, method, url, params=None,
+                                    body=None):
+        """Perform the request and return its status and data.
+
+        It behaves like the synchronous ``Transport.perform_request``: the
+        request is retried on another connection after a connection error, a
+        timeout (if ``retry_on_timeout`` is set), or a status in
+        ``retry_on_status``.
+        """
+        if body is not None:
+            body = self.serializer.dumps(body)
+
+            if method in ('HEAD', 'GET') and self.send_get_body_as != 'GET':
+                if self.send_get_body_as == 'POST':
+                    method = 'POST'
+                elif self.send_get_body_as == 'source':
+                    if params is None:
+                        params = {}
+                    params['source'] = body
+                    body = None
+
+        if body is not None:
+            try:
+                body = body.encode('utf-8')
+            except (UnicodeDecodeError, AttributeError):
+                # bytes/str - no need to re-encode
+                pass
+
+        ignore = ()
+        timeout = None
+        if params:
+            timeout = params.pop('request_timeout', None)
+            ignore = params.pop('ignore', ())
+            if isinstance(ignore, int):
+                ignore = (ignore, )
+
+        for attempt in range(self.max_retries + 1):
+            connection = self.get_connection()
+
+            try:
+                status, headers, data = await connection.perform_request(
+                    method, url, params, body, ignore=ignore, timeout=timeout)
+            except TransportError as error:
+                if isinstance(error, ConnectionTimeout):
+                    retry = self.retry_on_timeout
+                elif isinstance(error, ConnectionError):
+                    retry = True
+                else:
+                    retry = error.status_code in self.retry_on_status
+
+                if not retry or attempt == self.max_retries:
+                    raise
+
+                self.mark_dead(connection)
+            else:
+                self.connection_pool.mark_live(connection)
+                if data:
+                    data = self.deserializer.loads(
+                        data, headers.get('content-type'))
+                return status, data
+
+    async def close(self):
+        """Close the connections of the transport."""
+        for connection in self.connection_pool.connections:
+            await connection.close()
+
+
+class AiohttpConnection(Connection):
+    """Connection class using ``aiohttp`` and the http protocol.
+
+    All the requests to the host go through one ``aiohttp`` session, created
+    the first time it is needed, that keeps alive at most ``maxsize`` sockets.
+    As any ``aiohttp`` session, it must always be used by the same event loop.
+
+    :arg http_auth: optional http auth information as either ':' separated
+        string or a tuple
+    :arg use_ssl: use ssl for the connection if `True`
+    :arg verify_certs: whether to verify SSL certificates
+    :arg ca_certs: optional path to CA bundle
+    :arg maxsize: the maximum number of connections which will be kept open
+        to this host.
+    :arg keepalive_timeout: number of seconds an idle socket is kept open.
+    """
+    def __init__(self, host='localhost', port=9200, http_auth=None,
+                 use_ssl=False, verify_certs=False, ca_certs=None, maxsize=10,
+                 keepalive_timeout=15, **kwargs):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImproperlyConfigured(
+                'Djangoes asynchronous backends require aiohttp.')
+
+        super(AiohttpConnection, self).__init__(host=host, port=port,
+                                                **kwargs)
+        self.aiohttp = aiohttp
+        self.maxsize = maxsize
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.auth = None
+        self.ssl = True
+
+        if http_auth is not None:
+            if isinstance(http_auth, str):
+                http_auth = http_auth.split(':', 1)
+            self.auth = aiohttp.BasicAuth(*http_auth)
+
+        if use_ssl:
+            self.host = self.host.replace('http://', 'https://', 1)
+            if verify_certs:
+                self.ssl = ssl.create_default_context(cafile=ca_certs)
+            else:
+                self.ssl = False
+
+    def get_session(self):
+        """Return the session of the connection, creating it if needed."""
+        if self.session is None or self.session.closed:
+            connector = self.aiohttp.TCPConnector(
+                limit=self.maxsize,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=self.ssl)
+            self.session = self.aiohttp.ClientSession(connector=connector,
+                                                      auth=self.auth)
+
+        return self.session
+
+    async def perform_request(self, method, url, params=None, body=None,
+                              timeout=None, ignore=()):
+        url = self.url_prefix + url
+        if params:
+            url = '%s?%s' % (url, urlencode(params))
+        full_url = self.host + url
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        aiohttp = self.aiohttp
+        try:
+            client_timeout = aiohttp.ClientTimeout(
+                total=timeout or self.timeout)
+            async with self.get_session().request(
+                    method, full_url, data=body,
+                    timeout=client_timeout) as response:
+                raw_data = await response.text()
+            duration = loop.time() - start
+        except aiohttp.ClientSSLError as error:
+            self.log_request_fail(method, full_url, body,
+                                  loop.time() - start, exception=error)
+            raise SSLError('N/A', str(error), error)
+        except asyncio.TimeoutError as error:
+            self.log_request_fail(method, full_url, body,
+                                  loop.time() - start, exception=error)
+            raise ConnectionTimeout('TIMEOUT', str(error), error)
+        except aiohttp.ClientError as error:
+            self.log_request_fail(method, full_url, body,
+                                  loop.time() - start, exception=error)
+            raise ConnectionError('N/A', str(error), error)
+
+        if not (200 <= response.status < 300) and response.status not in ignore:
+            self.log_request_fail(method, url, body, duration, response.status)
+            self._raise_error(response.status, raw_data)
+
+        self.log_request_success(method, full_url, url, body, response.status,
+                                 raw_data, duration)
+
+        return response.status, response.headers, raw_data
+
+    async def close(self):
+        """Close the session and its sockets."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncHttpBackend(Base):
+    """Asynchronous connection backend using ``aiohttp``.
+
+    It provides the same methods as
+    :class:`~djangoes.backends.elasticsearch.BaseElasticsearchBackend`, as
+    coroutines, and uses the configured indices the same way.
+    """
+    #: ElasticSearch transport class used by the client class to perform
+    #: requests.
+    transport_class = AsyncTransport
+    #: Connection class used by the transport class to perform requests.
+    connection_class = AiohttpConnection
+
+    def configure_client(self):
+        """Instantiate and configure the ElasticSearch client.
+
+        It works like the ``configure_client`` method of the synchronous
+        backends: HOSTS and PARAMS are given to the client, with the
+        ``transport_class`` and the ``connection_class`` of the backend.
+        """
+        hosts = self.server['HOSTS']
+        params = self.server['PARAMS']
+
+        #pylint: disable=star-args
+        self.client = Elasticsearch(hosts,
+                                    transport_class=self.transport_class,
+                                    connection_class=self.connection_class,
+                                    **params)
+
+    async def close(self):
+        """Close the client's connections."""
+        if self.client is not None:
+            await self.client.transport.close()
+
+    # Server methods
+    # ==============
+
+    async def ping(self, **kwargs):
+        try:
+            await self.client.transport.perform_request_async(
+                'HEAD', '/', params=kwargs)
+        except TransportError:
+            return False
+        return True
+
+    async def info(self, **kwargs):
+        return await self.client.info(**kwargs)
+
+    async def put_script(self, lang, script_id, body, **kwargs):
+        return await self.client.put_script(lang, script_id, body, **kwargs)
+
+    async def get_script(self, lang, script_id, **kwargs):
+        return await self.client.get_script(lang, script_id, **kwargs)
+
+    async def delete_script(self, lang, script_id, **kwargs):
+        return await self.client.delete_script(lang, script_id, **kwargs)
+
+    async def put_template(self, template_id, body, **kwargs):
+        return await self.client.put_template(template_id, body, **kwargs)
+
+    async def get_template(self, template_id, body=None, **kwargs):
+        return await self.client.get_template(template_id, body, **kwargs)
+
+    async def delete_template(self, template_id=None, **kwargs):
+        return await self.client.delete_template(template_id, **kwargs)
+
+    # Bulk methods
+    # ============
+
+    async def mget(self, body, index=None, doc_type=None, **kwargs):
+        return await self.client.mget(body, index, doc_type, **kwargs)
+
+    async def bulk(self, body, index=None, doc_type=None, **kwargs):
+        return await self.client.bulk(body, index, doc_type, **kwargs)
+
+    async def msearch(self, body, index=None, doc_type=None, **kwargs):
+        return await self.client.msearch(body, index, doc_type, **kwargs)
+
+    async def mpercolate(self, body, index=None, doc_type=None, **kwargs):
+        return await self.client.mpercolate(body, index, doc_type, **kwargs)
+
+    # Scroll methods
+    # ==============
+
+    async def scroll(self, scroll_id, **kwargs):
+        return await self.client.scroll(scroll_id, **kwargs)
+
+    async def clear_scroll(self, scroll_id, body=None, **kwargs):
+        return await self.client.clear_scroll(scroll_id, body, **kwargs)
+
+    # Query methods
+    # =============
+
+    async def create(self, doc_type, body, doc_id=None, **kwargs):
+        return await self.client.create(
+            self.indices_param, doc_type, body, doc_id, **kwargs)
+
+    async def index(self, doc_type, body, doc_id=None, **kwargs):
+        return await self.client.index(
+            self.indices_param, doc_type, body, doc_id, **kwargs)
+
+    async def exists(self, doc_id, doc_type='_all', **kwargs):
+        try:
+            await self.client.transport.perform_request_async(
+                'HEAD', _make_path(self.indices_param, doc_type, doc_id),
+                params=kwargs)
+        except NotFoundError:
+            return False
+        return True
+
+    async def get(self, doc_id, doc_type='_all', **kwargs):
+        return await self.client.get(
+            self.indices_param, doc_id, doc_type, **kwargs)
+
+    async def get_source(self, doc_id, doc_type='_all', **kwargs):
+        return await self.client.get_source(
+            self.indices_param, doc_id, doc_type, **kwargs)
+
+    async def update(self, doc_type, doc_id, body=None, **kwargs):
+        return await self.client.update(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
+
+    async def search(self, doc_type=None, body=None, **kwargs):
+        return await self.client.search(
+            self.indices_param, doc_type, body, **kwargs)
+
+    async def search_shards(self, doc_type=None, **kwargs):
+        return await self.client.search_shards(
+            self.indices_param, doc_type, **kwargs)
+
+    async def search_template(self, doc_type=None, body=None, **kwargs):
+        return await self.client.search_template(
+            self.indices_param, doc_type, body, **kwargs)
+
+    async def explain(self, doc_type, doc_id, body=None, **kwargs):
+        return await self.client.explain(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
+
+    async def delete(self, doc_type, doc_id, **kwargs):
+        return await self.client.delete(
+            self.indices_param, doc_type, doc_id, **kwargs)
+
+    async def count(self, doc_type=None, body=None, **kwargs):
+        return await self.client.count(
+            self.indices_param, doc_type, body, **kwargs)
+
+    async def delete_by_query(self, doc_type=None, body=None, **kwargs):
+        return await self.client.delete_by_query(
+            self.indices_param, doc_type, body, **kwargs)
+
+    async def suggest(self, body, **kwargs):
+        return await self.client.suggest(body, self.indices_param, **kwargs)
+
+    async def percolate(self, doc_type, doc_id=None, body=None, **kwargs):
+        return await self.client.percolate(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
+
+    async def count_percolate(self, doc_type, doc_id=None, body=None,
+                              **kwargs):
+        return await self.client.count_percolate(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
+
+    async def mlt(self, doc_type, doc_id, body=None, **kwargs):
+        return await self.client.mlt(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
+
+    async def termvector(self, doc_type, doc_id, body=None, **kwargs):
+        return await self.client.termvector(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
+
+    async def mtermvectors(self, doc_type=None, body=None, **kwargs):
+        return await self.client.mtermvectors(
+            self.indices_param, doc_type, body, **kwargs)
+
+    async def benchmark(self, doc_type=None, body=None, **kwargs):
+        return await self.client.benchmark(
+            self.indices_param, doc_type, body, **kwargs)
+
+    async def abort_benchmark(self, name=None, **kwargs):
+        return await self.client.abort_benchmark(name, **kwargs)
+
+    async def list_benchmarks(self, doc_type=None, **kwargs):
+        return await self.client.list_benchmarks(
+            self.indices_param, doc_type, **kwargs)
@@ -0,0 +1,248 @@
+"""Batching of the queries performed in a block into one request.
+
+Code performing queries in a loop, such as a template getting documents one
+by one, sends one request per query. In a :meth:`batch` block of a backend,
+its ``get`` and ``get_source`` queries are not performed at once: they return
+a :class:`LazyResult`, and they are all sent as one ``mget`` request, when
+the block ends or when one of the results is used::
+
+    with connection.batch():
+        documents = [connection.get(doc_id) for doc_id in doc_ids]
+
+    for document in documents:
+        print(document['_source'])
+
+Likewise, the ``search`` queries of the block are sent as one ``msearch``
+request, each one on the indices of the backend::
+
+    with connection.batch():
+        results = connection.search(body=results_query)
+        facets = connection.search(body=facets_query)
+        related = connection.search('product', body=related_query)
+
+A :class:`LazyResult` is a read-only mapping, used like the result of the
+query. When its query failed, using it raises the error of the query, such
+as the ``NotFoundError`` of a missing document. The same document requested
+twice is fetched once.
+
+The ``mget`` and ``msearch`` requests are performed with the backend's
+methods, so they go through all its interceptors. The queries with other
+arguments than the ones supported by these requests are performed at once,
+as usual: the id and the type of a document, and the type, the body and the
+:data:`SEARCH_HEADERS` of a search.
+"""
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+from threading import RLock
+
+from elasticsearch.exceptions import NotFoundError, TransportError
+
+from .interceptors import Interceptor
+
+
+_current_batches = ContextVar('djangoes_batches', default=None)
+
+#: Arguments of a search sent in the header of its ``msearch`` request.
+SEARCH_HEADERS = frozenset(['search_type', 'preference', 'routing'])
+
+
+class LazyResult(Mapping):
+    """Result of a batched query, available once its batch is performed.
+
+    Using it as a mapping (or calling :meth:`result`) performs the batch, if
+    it is not performed yet.
+    """
+    __slots__ = ('batch', 'value', 'error', 'resolved')
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.value = None
+        self.error = None
+        self.resolved = False
+
+    def resolve(self, value=None, error=None):
+        """Set the `value` of the result, or the `error` of its query."""
+        self.value = value
+        self.error = error
+        self.resolved = True
+
+    def result(self):
+        """Return the result of the query, or raise its error."""
+        if not self.resolved:
+            self.batch.perform()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def __getitem__(self, key):
+        return self.result()[key]
+
+    def __iter__(self):
+        return iter(self.result())
+
+    def __len__(self):
+        return len(self.result())
+
+    def __repr__(self):
+        if not self.resolved:
+            return '<LazyResult: pending>'
+        return '<LazyResult: %r>' % (self.error or self.value)
+
+
+class Batch(object):
+    """Queries of a backend waiting to be performed together."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.documents = {}
+        self.searches = []
+        self._lock = RLock()
+
+    def add(self, query):
+        """Add `query` to the batch, and return its :class:`LazyResult`, or
+        return ``None`` if it can not be batched."""
+        if query.method == 'search':
+            return self.add_search(query)
+        return self.add_get(query)
+
+    def add_get(self, query):
+        """Add a ``get`` or ``get_source`` `query` to the batch."""
+        arguments = query.arguments
+        doc_id = arguments.pop('doc_id')
+        doc_type = arguments.pop('doc_type', '_all')
+
+        if arguments:
+            return None
+
+        lazy = LazyResult(self)
+        with self._lock:
+            self.documents.setdefault((doc_id, doc_type), []).append(
+                (query.method, lazy))
+        return lazy
+
+    def add_search(self, query):
+        """Add a ``search`` `query` to the batch."""
+        arguments = query.arguments
+        doc_type = arguments.pop('doc_type', None)
+        body = arguments.pop('body', None)
+
+        if not SEARCH_HEADERS.issuperset(arguments):
+            return None
+
+        header = dict(arguments, index=list(self.backend.indices))
+        if doc_type:
+            header['type'] = doc_type
+
+        lazy = LazyResult(self)
+        with self._lock:
+            self.searches.append((header, body or {}, lazy))
+        return lazy
+
+    def perform(self):
+        """Perform the queries waiting in the batch."""
+        with self._lock:
+            documents, self.documents = self.documents, {}
+            searches, self.searches = self.searches, []
+
+            if documents:
+                self.perform_gets(documents)
+            if searches:
+                self.perform_searches(searches)
+
+    def perform_gets(self, documents):
+        """Fetch the `documents` with one ``mget`` request, and resolve their
+        results."""
+        keys = list(documents)
+        docs = []
+        for doc_id, doc_type in keys:
+            doc = {'_id': doc_id}
+            if doc_type != '_all':
+                doc['_type'] = doc_type
+            docs.append(doc)
+
+        try:
+            response = self.backend.mget(
+                {'docs': docs}, index=self.backend.indices_param)
+        except Exception as e:  #pylint: disable=broad-except
+            for results in documents.values():
+                for _, lazy in results:
+                    lazy.resolve(error=e)
+            return
+
+        for key, doc in zip(keys, response['docs']):
+            for method, lazy in documents[key]:
+                if 'error' in doc:
+                    lazy.resolve(error=TransportError(
+                        'N/A', doc['error'], doc))
+                elif not doc.get('found'):
+                    lazy.resolve(error=NotFoundError(
+                        404, json.dumps(doc), doc))
+                elif method == 'get_source':
+                    lazy.resolve(doc['_source'])
+                else:
+                    lazy.resolve(doc)
+
+    def perform_searches(self, searches):
+        """Perform the `searches` with one ``msearch`` request, and resolve
+        their results."""
+        body = []
+        for header, search_body, _ in searches:
+            body.append(header)
+            body.append(search_body)
+
+        try:
+            response = self.backend.msearch(body)
+        except Exception as e:  #pylint: disable=broad-except
+            for _, _, lazy in searches:
+                lazy.resolve(error=e)
+            return
+
+        for (_, _, lazy), result in zip(searches, response['responses']):
+            if 'error' in result:
+                lazy.resolve(error=TransportError(
+                    result.get('status', 'N/A'), result['error'], result))
+            else:
+                lazy.resolve(result)
+
+
+@contextmanager
+def batch(backend):
+    """Batch the queries of `backend` performed in the block.
+
+    The queries are performed when the block ends, unless it ends with an
+    exception: then they are performed only when one of their results is
+    used.
+    """
+    current = Batch(backend)
+    batches = dict(_current_batches.get() or {})
+    batches[backend] = current
+    token = _current_batches.set(batches)
+
+    try:
+        yield current
+    finally:
+        _current_batches.reset(token)
+
+    current.perform()
+
+
+class BatchingInterceptor(Interceptor):
+    """Add the queries performed in a :func:`batch` block to its batch.
+
+    It is always enabled.
+    """
+    #: Methods whose queries are batched.
+    methods = frozenset(['get', 'get_source', 'search'])
+
+    def intercept(self, query):
+        batches = _current_batches.get()
+
+        if batches and query.method in self.methods:
+            current = batches.get(self.backend)
+            if current is not None:
+                lazy = current.add(query)
+                if lazy is not None:
+                    return lazy
+
+        return query.proceed()
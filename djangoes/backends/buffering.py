@@ -0,0 +1,427 @@
+"""Write-behind buffer of the writes of a connection, sent by bulk requests.
+
+Each ``index``, ``update`` or ``delete`` of a connection costs a request,
+while the caller rarely needs its response. With the ``WRITE_BUFFER``
+option of a server, its backend has a :class:`WriteBuffer`, that queues
+these operations and sends them as one ``bulk`` request::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2'],
+            'INDICES': ['catalog'],
+            'WRITE_BUFFER': {
+                'MAX_ACTIONS': 500,
+                'MAX_DELAY': 1,
+            },
+        }
+    }
+
+    connection.write_buffer.index('product', {'name': name}, product.pk)
+    connection.write_buffer.delete('product', old_product.pk)
+
+With the ``INTERCEPT`` key of the option, the ``index``, ``create``,
+``update`` and ``delete`` queries of the connection itself go through its
+buffer (see :class:`WriteBufferInterceptor`)::
+
+    'WRITE_BUFFER': {
+        'INTERCEPT': True,
+    },
+
+    connection.index('product', {'name': name}, product.pk)
+
+The buffer is flushed when it has ``MAX_ACTIONS`` operations, or
+``MAX_BYTES`` bytes of JSON, or by the next write once its oldest operation
+has been waiting for ``MAX_DELAY`` seconds. It is also flushed when the
+connection is closed or garbage collected (such as when its thread ends), and
+by Django's ``request_finished`` signal for the connections of the current
+thread (see
+:meth:`djangoes.ConnectionHandler.flush_writes`). There is no background
+flush: outside of a request, the last writes wait for the connection to be
+closed, or for :meth:`WriteBuffer.flush`.
+
+The operations on the same document are merged in the buffer: an ``index``
+or a ``delete`` replaces the previous operations, and the partial ``doc`` of
+an ``update`` is merged into the document of the previous ``index`` or
+``update``. Other operations (such as an update by script) are sent after
+the previous ones, in order.
+
+The writes are not performed when the methods return, so their errors can
+not be raised to the caller: the failed operations, and the errors of the
+bulk requests, are logged by the ``djangoes.writes`` logger. Only an explicit
+call to :meth:`WriteBuffer.flush` raises the error of its request.
+"""
+from collections import OrderedDict
+import logging
+from threading import Lock
+import time
+import weakref
+
+from .interceptors import Interceptor
+from .transport import get_size
+
+
+logger = logging.getLogger('djangoes.writes')  #pylint: disable=invalid-name
+
+#: Default maximum number of operations waiting in a buffer.
+DEFAULT_WRITE_BUFFER_ACTIONS = 500
+
+#: Default maximum size, in bytes, of the operations waiting in a buffer.
+DEFAULT_WRITE_BUFFER_BYTES = 5 * 1024 * 1024
+
+#: Default maximum time, in seconds, during which an operation waits.
+DEFAULT_WRITE_BUFFER_DELAY = 1
+
+#: Metadata identifying the document of an operation.
+DOCUMENT_KEYS = ('_index', '_type', '_id', '_routing', '_parent')
+
+#: Keys of the body of an update that can be merged with another one.
+MERGEABLE_UPDATE_KEYS = frozenset(['doc', 'doc_as_upsert'])
+
+#: Methods of a backend performing the write of a document.
+WRITE_METHODS = frozenset(['index', 'create', 'update', 'delete'])
+
+#: Arguments of a write sent as the metadata of its bulk action.
+ACTION_PARAMS = frozenset([
+    'routing', 'parent', 'version', 'version_type', 'ttl', 'timestamp',
+    'retry_on_conflict',
+])
+
+
+def merge_documents(document, changes):
+    """Return a copy of `document` updated with `changes`, merging their
+    objects recursively, as ElasticSearch does for a partial update."""
+    merged = dict(document)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = merge_documents(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def get_errors(response):
+    """Return the items of the failed actions of a bulk `response`."""
+    errors = []
+    for item in response['items']:
+        (result,) = item.values()
+        if not 200 <= result.get('status', 500) < 300:
+            errors.append(item)
+    return errors
+
+
+class Operation(object):
+    """An operation of a bulk request: its type, its metadata (such as
+    ``_index`` and ``_id``) and its body, ``None`` for a ``delete``."""
+    __slots__ = ('op_type', 'meta', 'body')
+
+    def __init__(self, op_type, meta, body=None):
+        self.op_type = op_type
+        self.meta = meta
+        self.body = body
+
+    @property
+    def key(self):
+        """Key of the document of the operation, or ``None`` without id."""
+        if self.meta.get('_id') is None:
+            return None
+        return tuple(self.meta.get(key) for key in DOCUMENT_KEYS)
+
+    @property
+    def is_partial(self):
+        """Tell if it is an update with a partial document only, that can be
+        merged with another operation."""
+        return (self.op_type == 'update' and
+                set(self.meta).issubset(DOCUMENT_KEYS) and
+                'doc' in self.body and
+                MERGEABLE_UPDATE_KEYS.issuperset(self.body))
+
+    def merge(self, operation):
+        """Return the operation doing this one then `operation`, on the same
+        document, or ``None`` if they can not be merged."""
+        if operation.op_type in ('index', 'delete'):
+            return operation
+
+        if not operation.is_partial:
+            return None
+
+        if self.op_type in ('index', 'create'):
+            body = merge_documents(self.body, operation.body['doc'])
+            return Operation(self.op_type, self.meta, body)
+
+        if (self.is_partial and self.body.get('doc_as_upsert') ==
+                operation.body.get('doc_as_upsert')):
+            body = dict(self.body, doc=merge_documents(
+                self.body['doc'], operation.body['doc']))
+            return Operation('update', self.meta, body)
+
+        return None
+
+    def get_lines(self):
+        """Return the lines of the operation in a bulk body."""
+        if self.body is None:
+            return [{self.op_type: self.meta}]
+        return [{self.op_type: self.meta}, self.body]
+
+
+def get_operation(query):
+    """Return the bulk :class:`Operation` of the write `query`, or ``None``
+    if it can not be sent by a bulk request, such as when it has other
+    arguments than the metadata of a bulk action (see
+    :data:`ACTION_PARAMS`)."""
+    arguments = query.arguments
+    op_type = query.method
+    if op_type == 'index' and arguments.get('op_type') == 'create':
+        op_type = 'create'
+        del arguments['op_type']
+
+    index = arguments.pop('index', None) or query.backend.get_bulk_index()
+    meta = {'_index': index, '_type': arguments.pop('doc_type')}
+    doc_id = arguments.pop('doc_id', None)
+    if doc_id is not None:
+        meta['_id'] = str(doc_id)
+    body = arguments.pop('body', None)
+
+    for name in ACTION_PARAMS.intersection(arguments):
+        meta['_%s' % name] = arguments.pop(name)
+
+    if arguments or index is None:
+        return None
+    if op_type != 'delete' and body is None:
+        return None
+
+    return Operation(op_type, meta, body)
+
+
+class WriteBuffer(object):
+    """Thread-safe buffer of the write operations of a backend.
+
+    :param backend: the backend performing the ``bulk`` requests
+    :param max_actions: number of operations flushing the buffer
+    :param max_bytes: size of the operations flushing the buffer
+    :param max_delay: time, in seconds, after which an operation is flushed
+
+    The buffer keeps a weak reference to its backend: once the backend is
+    garbage collected, the buffer is flushed by its client directly.
+    """
+    def __init__(self, backend, max_actions=DEFAULT_WRITE_BUFFER_ACTIONS,
+                 max_bytes=DEFAULT_WRITE_BUFFER_BYTES,
+                 max_delay=DEFAULT_WRITE_BUFFER_DELAY):
+        self._backend = weakref.ref(backend)
+        self.alias = backend.alias
+        self.client = backend.client
+        self.max_actions = max_actions
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._operations = OrderedDict()
+        self._count = 0
+        self._size = 0
+        # Time of the oldest operation in the buffer.
+        self._since = None
+        self._lock = Lock()
+        # Flushes are performed one at a time, so the writes to a document
+        # are sent in order.
+        self._flush_lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def backend(self):
+        """The backend of the buffer, or ``None`` once it is garbage
+        collected."""
+        return self._backend()
+
+    @property
+    def size(self):
+        """Size, in bytes, of the JSON of the operations in the buffer."""
+        return self._size
+
+    def index(self, doc_type, body, doc_id=None, index=None, **meta):
+        """Queue the indexing of the document `body`.
+
+        The other keyword arguments are metadata of the action, without
+        their ``_`` prefix (such as ``routing``).
+        """
+        self.add('index', body, index, doc_type, doc_id, meta)
+
+    def create(self, doc_type, body, doc_id=None, index=None, **meta):
+        """Queue the creation of the document `body`."""
+        self.add('create', body, index, doc_type, doc_id, meta)
+
+    def update(self, doc_type, doc_id, body, index=None, **meta):
+        """Queue the update of the document `doc_id`, with the `body` of an
+        update request (such as ``{'doc': {...}}``)."""
+        self.add('update', body, index, doc_type, doc_id, meta)
+
+    def delete(self, doc_type, doc_id, index=None, **meta):
+        """Queue the deletion of the document `doc_id`."""
+        self.add('delete', None, index, doc_type, doc_id, meta)
+
+    def add(self, op_type, body, index, doc_type, doc_id, meta):
+        """Queue an operation, and flush the buffer if it is full.
+
+        By default, the `index` is given by the ``get_bulk_index`` method of
+        the backend: a ``ValueError`` is raised if there is none.
+        """
+        if index is None:
+            index = self.backend.get_bulk_index()
+            if index is None:
+                raise ValueError('The index of the operation is required: '
+                                 '%r has several indices.'
+                                 % self.alias)
+
+        meta = {'_%s' % name: value for name, value in meta.items()}
+        meta.update(_index=index, _type=doc_type)
+        if doc_id is not None:
+            meta['_id'] = str(doc_id)
+
+        self.push(Operation(op_type, meta, body))
+
+    def push(self, operation):
+        """Queue `operation`, merged with the previous operation on the same
+        document if possible, and flush the buffer if it is full, or if its
+        oldest operation has waited for ``max_delay`` seconds.
+
+        The error of this flush is logged, not raised: it has nothing to do
+        with the caller's operation.
+        """
+        key = operation.key
+        if key is None:
+            key = object()
+
+        with self._lock:
+            operations = self._operations.setdefault(key, [])
+            if operations:
+                merged = operations[-1].merge(operation)
+                if merged is not None:
+                    self._remove(operations.pop())
+                    operation = merged
+
+            operations.append(operation)
+            self._count += 1
+            self._size += self.get_size(operation)
+
+            now = time.monotonic()
+            if self._since is None:
+                self._since = now
+            full = (self._count >= self.max_actions or
+                    self._size >= self.max_bytes or
+                    now - self._since >= self.max_delay)
+
+        if full:
+            self.flush_later()
+
+    def get_size(self, operation):
+        """Return the size, in bytes, of `operation` in a bulk body."""
+        serializer = self.client.transport.serializer
+        return sum(get_size(serializer.dumps(line)) + 1
+                   for line in operation.get_lines())
+
+    def _remove(self, operation):
+        self._count -= 1
+        self._size -= self.get_size(operation)
+
+    def flush(self):
+        """Send the operations of the buffer as one ``bulk`` request, and
+        return its response, or ``None`` if the buffer is empty.
+
+        The error of the request is raised, and its operations are lost. The
+        failed operations are logged.
+        """
+        with self._flush_lock:
+            with self._lock:
+                operations = [operation
+                              for operations in self._operations.values()
+                              for operation in operations]
+                self._operations = OrderedDict()
+                self._count = 0
+                self._size = 0
+                self._since = None
+
+            if not operations:
+                return None
+
+            body = []
+            for operation in operations:
+                body.extend(operation.get_lines())
+
+            backend = self.backend
+            bulk = self.client.bulk if backend is None else backend.bulk
+            response = bulk(body)
+
+        errors = get_errors(response)
+        if errors:
+            logger.warning('%d of %d buffered writes of %s failed',
+                           len(errors), len(operations), self.alias,
+                           extra={'errors': errors})
+
+        return response
+
+    def flush_later(self):
+        """Flush the buffer, and log the error of the request, if any.
+
+        It is called when the buffer is full, at the end of a request, and
+        when the connection is closed or garbage collected.
+        """
+        try:
+            self.flush()
+        except Exception:  #pylint: disable=broad-except
+            logger.exception('Unable to flush the buffered writes of %s',
+                             self.alias)
+
+    @classmethod
+    def from_backend(cls, backend):
+        """Return the write buffer of `backend`, or ``None`` if it is not
+        enabled by its ``WRITE_BUFFER`` option.
+
+        The option is either ``True``, or a dict with ``MAX_ACTIONS``,
+        ``MAX_BYTES``, ``MAX_DELAY`` (in seconds) and ``INTERCEPT`` (see
+        :class:`WriteBufferInterceptor`), by default
+        :data:`DEFAULT_WRITE_BUFFER_ACTIONS`,
+        :data:`DEFAULT_WRITE_BUFFER_BYTES` and
+        :data:`DEFAULT_WRITE_BUFFER_DELAY`.
+        """
+        options = backend.server.get('WRITE_BUFFER')
+
+        if not options:
+            return None
+
+        if options is True:
+            options = {}
+
+        return cls(backend,
+                   max_actions=options.get('MAX_ACTIONS',
+                                           DEFAULT_WRITE_BUFFER_ACTIONS),
+                   max_bytes=options.get('MAX_BYTES',
+                                         DEFAULT_WRITE_BUFFER_BYTES),
+                   max_delay=options.get('MAX_DELAY',
+                                         DEFAULT_WRITE_BUFFER_DELAY))
+
+
+class WriteBufferInterceptor(Interceptor):
+    """Route the writes of a backend through its write buffer.
+
+    It is enabled by the ``INTERCEPT`` key of the ``WRITE_BUFFER`` option
+    of the server. A buffered write returns ``None`` instead of the response
+    of its request. The writes that can not be sent by a bulk request (see
+    :func:`get_operation`) are performed at once.
+    """
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('WRITE_BUFFER')
+
+        if not options or options is True or not options.get('INTERCEPT'):
+            return None
+
+        return cls(backend)
+
+    def intercept(self, query):
+        write_buffer = self.backend.write_buffer
+        if query.method not in WRITE_METHODS or write_buffer is None:
+            return query.proceed()
+
+        operation = get_operation(query)
+        if operation is None:
+            return query.proceed()
+
+        write_buffer.push(operation)
+        return None
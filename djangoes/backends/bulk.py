@@ -0,0 +1,411 @@
+"""Streaming bulk indexing, chunked by number of actions and by bytes.
+
+The ``bulk`` method of a backend sends one body, built by the caller. Its
+``streaming_bulk`` method (see :func:`streaming_bulk`) takes any iterable of
+actions, such as a generator reading a database, and sends them by chunks,
+so the memory used does not depend on the number of actions::
+
+    def actions():
+        for product in Product.objects.iterator():
+            yield {'_id': product.pk, '_type': 'product',
+                   'name': product.name}
+
+    for ok, item in connection.streaming_bulk(actions()):
+        if not ok:
+            logger.error('Unable to index: %r', item)
+
+Each action is a dict, as expected by ``elasticsearch.helpers.bulk``: the
+keys starting with ``_`` (``_op_type``, ``_index``, ``_type``, ``_id``,
+etc.) describe the action, and the others (or its ``_source``) are the
+document. A string is a JSON document to index.
+
+The result of each action is given in order, as ``(ok, item)``, where
+``item`` is the item of the action in the bulk response.
+
+A single stream of bulk requests uses one node at a time, while a cluster
+can index several chunks at once. The ``parallel_bulk`` method (see
+:func:`parallel_bulk`) sends the chunks concurrently, from a pool of
+threads, with a bounded number of chunks in flight so the actions are not
+read faster than they are indexed::
+
+    for ok, item in connection.parallel_bulk(actions(), thread_count=8):
+        if not ok:
+            logger.error('Unable to index: %r', item)
+
+When building the documents and serializing them takes more time than
+indexing them, the ``process_bulk`` method (see :func:`process_bulk`) does
+both in a pool of worker processes, one batch of items at a time, while the
+calling thread sends the bodies they build::
+
+    def get_action(product):
+        return {'_id': product.pk, '_type': 'product',
+                'name': product.name, 'tags': product.get_tags()}
+
+    results = connection.process_bulk(Product.objects.iterator(),
+                                      get_action, processes=4)
+
+The function building the actions is called by the workers, so it must be
+defined at the module level, and the items must be picklable. The workers
+are forked by default, so they inherit the settings and the state of Django
+(see :func:`get_mp_context`).
+"""
+from collections import deque
+from concurrent import futures
+import contextvars
+from itertools import islice
+import multiprocessing
+import os
+
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import BulkIndexError, expand_action
+
+from .transport import get_size
+
+
+#: Default maximum number of actions of a chunk.
+DEFAULT_CHUNK_SIZE = 500
+
+#: Default maximum size, in bytes, of a chunk.
+DEFAULT_MAX_CHUNK_BYTES = 100 * 1024 * 1024
+
+#: Default number of threads sending the chunks of :func:`parallel_bulk`.
+DEFAULT_THREAD_COUNT = 4
+
+#: Serializer of the actions in a worker process of :func:`process_bulk`.
+_worker_serializer = None  #pylint: disable=invalid-name
+
+
+def chunk_actions(actions, serializer, chunk_size=DEFAULT_CHUNK_SIZE,
+                  max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    """Serialize the `actions` and yield them by chunks.
+
+    Each chunk is a list of ``(action, data)`` pairs of JSON strings, where
+    ``data`` is ``None`` for a ``delete`` action. A chunk has at most
+    `chunk_size` actions, and at most `max_chunk_bytes` bytes once joined by
+    newlines, unless it has one action only, bigger than that.
+    """
+    chunk = []
+    size = 0
+
+    for action in actions:
+        action, data = expand_action(action)
+        action = serializer.dumps(action)
+        action_size = get_size(action) + 1
+
+        if data is not None:
+            data = serializer.dumps(data)
+            action_size += get_size(data) + 1
+
+        if chunk and (len(chunk) == chunk_size or
+                      size + action_size > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+
+        chunk.append((action, data))
+        size += action_size
+
+    if chunk:
+        yield chunk
+
+
+def get_bulk_body(chunk):
+    """Return the body of the bulk request of `chunk`, as JSON lines."""
+    lines = []
+    for action, data in chunk:
+        lines.append(action)
+        if data is not None:
+            lines.append(data)
+    return '\n'.join(lines) + '\n'
+
+
+def get_failed_items(body, error, serializer):
+    """Return the items of the actions of the bulk `body`, failed with
+    `error`."""
+    items = []
+    lines = iter(body.splitlines())
+    for action in lines:
+        op_type, info = serializer.loads(action).popitem()
+        info = dict(info, error=str(error), status=error.status_code,
+                    exception=error)
+        if op_type != 'delete':
+            info['data'] = serializer.loads(next(lines))
+        items.append({op_type: info})
+    return items
+
+
+def perform_body(backend, body, serializer, raise_on_exception=True,
+                 **kwargs):
+    """Perform the bulk `body` with one ``bulk`` request of `backend`, and
+    return the result of each action as ``(ok, item)``.
+
+    If `raise_on_exception` is ``False``, the error of a failed request is
+    not raised: all the actions of the body are failed items.
+    """
+    try:
+        response = backend.bulk(body, **kwargs)
+    except TransportError as e:
+        if raise_on_exception:
+            raise
+        return [(False, item)
+                for item in get_failed_items(body, e, serializer)]
+
+    results = []
+    for item in response['items']:
+        (result,) = item.values()
+        results.append((200 <= result.get('status', 500) < 300, item))
+    return results
+
+
+def perform_chunk(backend, chunk, serializer, raise_on_exception=True,
+                  **kwargs):
+    """Perform the actions of `chunk` with one ``bulk`` request of
+    `backend`, and return the result of each action as ``(ok, item)``.
+
+    See :func:`perform_body`.
+    """
+    return perform_body(backend, get_bulk_body(chunk), serializer,
+                        raise_on_exception, **kwargs)
+
+
+def iter_results(results, raise_on_error=True):
+    """Yield the `results` of a chunk.
+
+    If `raise_on_error` is ``True``, the failed items are not given: a
+    ``BulkIndexError`` with all of them is raised after the successful ones.
+    """
+    errors = []
+    for ok, item in results:
+        if not ok and raise_on_error:
+            errors.append(item)
+        elif ok or not errors:
+            yield ok, item
+
+    if errors:
+        raise BulkIndexError(
+            '%i document(s) failed to index.' % len(errors), errors)
+
+
+def streaming_bulk(backend, actions, chunk_size=DEFAULT_CHUNK_SIZE,
+                   max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                   raise_on_error=True, raise_on_exception=True, **kwargs):
+    """Perform the `actions` with `backend` by chunks, and yield the result
+    of each action as ``(ok, item)``.
+
+    If `raise_on_error` is ``True``, a ``BulkIndexError`` with the failed
+    items is raised after the chunk where an action failed. If
+    `raise_on_exception` is ``False``, the error of a failed bulk request is
+    not raised: all the actions of its chunk are failed items.
+
+    The other keyword arguments are given to the ``bulk`` method of the
+    backend, for each chunk.
+    """
+    serializer = backend.client.transport.serializer
+
+    for chunk in chunk_actions(actions, serializer, chunk_size,
+                               max_chunk_bytes):
+        results = perform_chunk(backend, chunk, serializer,
+                                raise_on_exception, **kwargs)
+        yield from iter_results(results, raise_on_error)
+
+
+def parallel_bulk(backend, actions, thread_count=DEFAULT_THREAD_COUNT,
+                  queue_size=None, ordered=True,
+                  chunk_size=DEFAULT_CHUNK_SIZE,
+                  max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                  raise_on_error=True, raise_on_exception=True, **kwargs):
+    """Perform the `actions` with `backend` by chunks, sent concurrently by
+    `thread_count` threads, and yield the result of each action as
+    ``(ok, item)``.
+
+    The actions are read and serialized by the calling thread, and at most
+    `queue_size` chunks (by default `thread_count`) are sent or waiting for
+    a thread at the same time: the next actions are read only once a chunk
+    is done, and its results are given. If `ordered` is ``True``, the
+    results are given in the order of the actions, otherwise in the order
+    the chunks are done.
+
+    The errors are handled chunk by chunk, as by :func:`streaming_bulk`.
+    When the iteration stops (on an error, or when the generator is closed),
+    the chunks not sent yet are cancelled, and the ones being sent are
+    waited for.
+    """
+    serializer = backend.client.transport.serializer
+    queue_size = queue_size or thread_count
+    chunks = chunk_actions(actions, serializer, chunk_size, max_chunk_bytes)
+    pending = deque()
+
+    def submit(executor, chunk):
+        # The chunk is performed in the context of the caller, as it would
+        # be by streaming_bulk.
+        context = contextvars.copy_context()
+        pending.append(executor.submit(
+            context.run, perform_chunk, backend, chunk, serializer,
+            raise_on_exception, **kwargs))
+
+    executor = futures.ThreadPoolExecutor(
+        max_workers=thread_count,
+        thread_name_prefix='djangoes-bulk-%s' % backend.alias)
+
+    try:
+        for chunk in chunks:
+            submit(executor, chunk)
+            if len(pending) < queue_size:
+                continue
+            yield from iter_results(next_results(pending, ordered),
+                                    raise_on_error)
+
+        while pending:
+            yield from iter_results(next_results(pending, ordered),
+                                    raise_on_error)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def next_results(pending, ordered=True):
+    """Remove a done chunk from the `pending` futures, and return its results.
+
+    If `ordered` is ``True``, it is the first one, waited for if necessary;
+    otherwise it is the first one done.
+    """
+    if ordered:
+        future = pending.popleft()
+    else:
+        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        future = next(future for future in pending if future in done)
+        pending.remove(future)
+    return future.result()
+
+
+def iter_batches(items, size):
+    """Yield the `items` by lists of at most `size` items."""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_mp_context(mp_context=None):
+    """Return the multiprocessing context of worker processes.
+
+    By default, the workers are forked: they inherit the settings of Django,
+    even when they are not given by ``DJANGO_SETTINGS_MODULE``, and its
+    connections. A ``ValueError`` is raised where ``fork`` is not available.
+    With another `mp_context` (or the name of its start method), Django is
+    set up again in each worker (see :func:`setup_worker`).
+    """
+    if mp_context is None:
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError('Worker processes are forked by default: an '
+                             'mp_context is required on this platform.')
+        mp_context = 'fork'
+
+    if isinstance(mp_context, str):
+        mp_context = multiprocessing.get_context(mp_context)
+
+    return mp_context
+
+
+def setup_worker(start_method):
+    """Set up Django in a worker process started by `start_method`.
+
+    Only a forked process inherits the settings and the applications of
+    Django: the others set them up from ``DJANGO_SETTINGS_MODULE``.
+    """
+    if start_method != 'fork':
+        import django
+        django.setup()
+
+
+def init_serializer(serializer, start_method):
+    """Set up a worker process of :func:`process_bulk`, that serializes the
+    actions with `serializer`."""
+    global _worker_serializer  #pylint: disable=global-statement,invalid-name
+    setup_worker(start_method)
+    _worker_serializer = serializer
+
+
+def serialize_items(transform, items, chunk_size=DEFAULT_CHUNK_SIZE,
+                    max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                    serializer=None):
+    """Return the bulk bodies of the actions built by `transform` from each
+    of the `items`, by chunks (see :func:`chunk_actions`), encoded in UTF-8.
+
+    It is performed by the worker processes of :func:`process_bulk`, with
+    the serializer given to the worker once, when it starts. The `transform`
+    function returns the action of an item, or ``None`` to skip it.
+    """
+    serializer = serializer or _worker_serializer
+    actions = (transform(item) for item in items)
+    return [get_bulk_body(chunk).encode('utf-8')
+            for chunk in chunk_actions(
+                (action for action in actions if action is not None),
+                serializer, chunk_size, max_chunk_bytes)]
+
+
+def perform_bodies(backend, bodies, serializer, raise_on_error=True,
+                   raise_on_exception=True, **kwargs):
+    """Perform each of the bulk `bodies` with `backend`, and yield the result
+    of each action, as :func:`streaming_bulk`."""
+    for body in bodies:
+        results = perform_body(backend, body, serializer,
+                               raise_on_exception, **kwargs)
+        yield from iter_results(results, raise_on_error)
+
+
+def process_bulk(backend, items, transform, processes=None, queue_size=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                 raise_on_error=True, raise_on_exception=True,
+                 mp_context=None, **kwargs):
+    """Build the actions of the `items` with `transform` in `processes`
+    worker processes, perform them with `backend` by chunks, and yield the
+    result of each action as ``(ok, item)``.
+
+    The `items` are sent to the workers by batches of `chunk_size`. Each
+    worker builds their actions, serializes them, and sends back their bulk
+    bodies, encoded (see :func:`serialize_items`), so the `items`, the
+    `transform` function and the actions must be picklable. The calling
+    thread is the only one performing the requests: the workers never use a
+    connection. The workers are started by `mp_context` (see
+    :func:`get_mp_context`).
+
+    At most `queue_size` batches (by default twice the number of workers)
+    are built or waiting to be sent at the same time. The results are given
+    in the order of the items, and the errors are handled chunk by chunk, as
+    by :func:`streaming_bulk`.
+    """
+    serializer = backend.client.transport.serializer
+    pending = deque()
+
+    processes = processes or os.cpu_count() or 1
+    queue_size = queue_size or 2 * processes
+    mp_context = get_mp_context(mp_context)
+    executor = futures.ProcessPoolExecutor(
+        max_workers=processes, mp_context=mp_context,
+        initializer=init_serializer,
+        initargs=(serializer, mp_context.get_start_method()))
+
+    try:
+        for batch in iter_batches(items, chunk_size):
+            pending.append(executor.submit(
+                serialize_items, transform, batch, chunk_size,
+                max_chunk_bytes))
+            if len(pending) < queue_size:
+                continue
+            yield from perform_bodies(backend, pending.popleft().result(),
+                                      serializer, raise_on_error,
+                                      raise_on_exception, **kwargs)
+
+        while pending:
+            yield from perform_bodies(backend, pending.popleft().result(),
+                                      serializer, raise_on_error,
+                                      raise_on_exception, **kwargs)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,275 @@
+"""Cache of the results of read queries, with Django's cache framework.
+
+With the ``RESULT_CACHE`` option of a server, the results of its ``search``,
+``count``, ``get`` and ``get_source`` queries are stored in one of the caches
+of the ``CACHES`` setting, for a limited time::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2'],
+            'INDICES': ['catalog'],
+            'RESULT_CACHE': {
+                'CACHE': 'default',
+                'TIMEOUT': 300,
+            },
+        }
+    }
+
+Each index has a generation counter, stored in the same cache, that is part
+of the key of the results of its queries. Each write query (such as ``index``
+or ``bulk``) performed by djangoes increments the generation of its indices:
+the results cached before are not used anymore, and they expire with their
+timeout. The names of an index and of its aliases, as configured in
+``ES_INDICES``, share the same generation, and so do the connections using
+the same index: the writes of one connection invalidate the results cached
+by another one (such as a replica given by a router). The connections to
+different clusters with the same index names must use different
+``KEY_PREFIX``.
+
+ElasticSearch shows a write to the searches only after the next refresh of
+the index (every second by default): a read performed in between would cache
+the old data under the new generation. So the results of the queries of an
+index are not cached during the ``REFRESH_WINDOW`` after a write, that must
+be at least the ``refresh_interval`` of the index.
+
+Only the connections with the ``RESULT_CACHE`` option increment the
+generations: the connection performing the writes (such as the primary given
+by a router) must have this option too, with the same ``CACHE`` and
+``KEY_PREFIX`` as the connections caching the results. Its own reads can be
+left out of the cache with an empty ``METHODS``.
+
+The data written to an index without djangoes (by another application, or
+by ElasticSearch itself with a TTL) does not invalidate the cache: the
+results are up to date only after their timeout.
+"""
+import json
+import time
+
+from django.core.cache import caches
+
+from .interceptors import Interceptor
+
+
+#: Methods whose results are cached by default.
+CACHED_METHODS = frozenset(['search', 'count', 'get', 'get_source'])
+
+#: Methods that increment the generation of their indices.
+WRITE_METHODS = frozenset([
+    'index', 'create', 'update', 'delete', 'bulk', 'delete_by_query',
+])
+
+#: Name of the generation incremented by the writes to unknown indices, such
+#: as ``_all`` or a wildcard, that is part of the key of every result.
+ALL_INDICES = '_all'
+
+#: Default time, in seconds, during which the results are cached.
+DEFAULT_RESULT_CACHE_TIMEOUT = 60
+
+#: Default time, in seconds, after a write during which the results of the
+#: queries of its indices are not cached, the default ``refresh_interval``.
+DEFAULT_REFRESH_WINDOW = 1
+
+
+def split_indices(indices):
+    """Return the list of names of the comma-separated `indices`."""
+    if not indices:
+        return []
+    if isinstance(indices, str):
+        indices = indices.split(',')
+    return [name.strip() for name in indices if name.strip()]
+
+
+def get_bulk_actions(body):
+    """Return the metadata of the actions of a bulk body, such as
+    ``{'_index': 'catalog', '_id': '1'}``.
+
+    The `body` is either a list of actions and documents, or their JSON
+    lines as a string.
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    if isinstance(body, str):
+        lines = []
+        for line in body.splitlines():
+            try:
+                lines.append(json.loads(line))
+            except ValueError:
+                pass
+        body = lines
+
+    actions = []
+    for line in body or ():
+        if isinstance(line, dict) and len(line) == 1:
+            (action,) = line.values()
+            if isinstance(action, dict):
+                actions.append(action)
+
+    return actions
+
+
+def get_bulk_indices(body):
+    """Return the names of the indices given by the actions of a bulk body."""
+    return [action['_index'] for action in get_bulk_actions(body)
+            if '_index' in action]
+
+
+class ResultCacheInterceptor(Interceptor):
+    """Cache the results of the read queries, and invalidate them on writes.
+
+    It is enabled by the ``RESULT_CACHE`` option of the server, either
+    ``True`` or a dict with:
+
+    * ``CACHE``: the alias of the cache in the ``CACHES`` setting, by default
+      ``default``,
+    * ``TIMEOUT``: time, in seconds, during which the results are cached, by
+      default :data:`DEFAULT_RESULT_CACHE_TIMEOUT`,
+    * ``KEY_PREFIX``: prefix of the keys, by default ``djangoes``,
+    * ``METHODS``: the methods whose results are cached, by default
+      :data:`CACHED_METHODS`,
+    * ``REFRESH_WINDOW``: time, in seconds, after a write during which the
+      results of the queries of its indices are not cached, by default
+      :data:`DEFAULT_REFRESH_WINDOW`.
+    """
+    def __init__(self, backend, cache='default',
+                 timeout=DEFAULT_RESULT_CACHE_TIMEOUT, key_prefix='djangoes',
+                 methods=CACHED_METHODS,
+                 refresh_window=DEFAULT_REFRESH_WINDOW):
+        super(ResultCacheInterceptor, self).__init__(backend)
+        self.cache_alias = cache
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.methods = frozenset(methods)
+        self.refresh_window = refresh_window
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('RESULT_CACHE')
+
+        if not options:
+            return None
+
+        if options is True:
+            options = {}
+
+        return cls(backend,
+                   cache=options.get('CACHE', 'default'),
+                   timeout=options.get('TIMEOUT',
+                                       DEFAULT_RESULT_CACHE_TIMEOUT),
+                   key_prefix=options.get('KEY_PREFIX', 'djangoes'),
+                   methods=options.get('METHODS', CACHED_METHODS),
+                   refresh_window=options.get('REFRESH_WINDOW',
+                                              DEFAULT_REFRESH_WINDOW))
+
+    @property
+    def cache(self):
+        """The Django cache storing the results."""
+        return caches[self.cache_alias]
+
+    def get_index_names(self, indices):
+        """Return the names of the generations of `indices`.
+
+        The names of a configured index and of its aliases are replaced by
+        the alias of its configuration. Wildcards and ``_all`` are replaced
+        by :data:`ALL_INDICES`.
+        """
+        configured = {}
+        for index_alias, index in self.backend.server_indices.items():
+            configured[index['NAME']] = index_alias
+            for alias in index['ALIASES']:
+                configured[alias] = index_alias
+
+        names = set()
+        for name in indices:
+            if name == ALL_INDICES or '*' in name:
+                names.add(ALL_INDICES)
+            else:
+                names.add(configured.get(name, name))
+
+        return sorted(names)
+
+    def get_generation_key(self, name):
+        """Return the cache key of the generation of the index `name`."""
+        return '%s:generation:%s' % (self.key_prefix, name)
+
+    def get_refresh_key(self, name):
+        """Return the cache key telling the index `name` has been written
+        during the refresh window."""
+        return '%s:refresh:%s' % (self.key_prefix, name)
+
+    def get_generations(self, names):
+        """Return the current generation of each index of `names`, or
+        ``None`` if one of them has been written during the refresh window.
+
+        A generation missing from the cache (never incremented, or evicted)
+        is created with the current time, so it is always greater than the
+        ones it may have had before.
+        """
+        cache = self.cache
+        keys = [self.get_generation_key(name) for name in names]
+        refresh_keys = []
+        if self.refresh_window:
+            refresh_keys = [self.get_refresh_key(name) for name in names]
+        generations = cache.get_many(keys + refresh_keys)
+
+        if any(key in generations for key in refresh_keys):
+            return None
+
+        for key in keys:
+            if key not in generations:
+                cache.add(key, int(time.time() * 1000), None)
+                generations[key] = cache.get(key)
+
+        return [generations[key] for key in keys]
+
+    def increment(self, names):
+        """Increment the generation of each index of `names`, and start their
+        refresh window."""
+        cache = self.cache
+
+        for name in names:
+            key = self.get_generation_key(name)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Missing from the cache: a new generation is enough.
+                cache.add(key, int(time.time() * 1000), None)
+
+        if self.refresh_window:
+            cache.set_many(dict((self.get_refresh_key(name), True)
+                                for name in names), self.refresh_window)
+
+    def get_key(self, query):
+        """Return the cache key of the result of `query`, or ``None`` if it
+        must not be cached, during the refresh window of its indices."""
+        names = self.get_index_names(split_indices(query.indices))
+        if ALL_INDICES not in names:
+            names.append(ALL_INDICES)
+        generations = self.get_generations(names)
+        if generations is None:
+            return None
+        return '%s:result:%s:%s' % (
+            self.key_prefix, query.fingerprint(),
+            '.'.join(str(generation) for generation in generations))
+
+    def intercept(self, query):
+        if query.method in self.methods:
+            key = self.get_key(query)
+            if key is None:
+                return query.proceed()
+            result = self.cache.get(key)
+            if result is None:
+                result = query.proceed()
+                self.cache.set(key, result, self.timeout)
+            return result
+
+        if query.method in WRITE_METHODS:
+            indices = split_indices(query.indices)
+            if query.method == 'bulk':
+                indices.extend(get_bulk_indices(query.arguments['body']))
+            try:
+                return query.proceed()
+            finally:
+                # Even a failed write may have changed some documents.
+                self.increment(self.get_index_names(indices))
+
+        return query.proceed()
@@ -0,0 +1,176 @@
+"""Single-flight coalescing of identical concurrent read queries.
+
+When a popular page's cache expires, many threads perform the very same
+search at the same time. With the ``COALESCE`` option of a server, identical
+read queries performed concurrently by the threads of a process share one
+request to ElasticSearch: the first thread performs it, and the others wait
+for its result::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2'],
+            'COALESCE': True,
+        }
+    }
+
+Queries are identical when they have the same
+:meth:`~djangoes.backends.interceptors.Query.fingerprint`: the same alias,
+method, indices, and arguments, including the body. The waiting threads
+receive a copy of the result (or the same error), so a caller can not change
+the result of another one.
+
+A waiting thread performs the query itself when it has waited for more than
+the ``TIMEOUT`` option, or when the first thread has been interrupted (by a
+``BaseException``) before the end of its query.
+"""
+import copy
+import os
+from threading import Event, Lock
+
+from .interceptors import Interceptor
+
+
+#: Methods whose queries are coalesced by default.
+COALESCED_METHODS = frozenset([
+    'search', 'count', 'get', 'get_source', 'mget', 'msearch',
+])
+
+#: Default time, in seconds, a query waits for an identical query in flight,
+#: the default timeout of a request.
+DEFAULT_COALESCE_TIMEOUT = 10
+
+
+class Flight(object):
+    """A query in flight, and its result once it is finished.
+
+    It is ``aborted`` when the query has been interrupted before it is
+    finished: it has neither result nor error.
+    """
+    __slots__ = ('done', 'result', 'error', 'aborted', 'followers')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.aborted = False
+        self.followers = 0
+
+    def wait(self, timeout=None):
+        """Wait for the query to finish, at most `timeout` seconds, and
+        return ``True`` if it is finished."""
+        return self.done.wait(timeout)
+
+    def get(self):
+        """Return a copy of the result of the finished query, or raise its
+        error."""
+        if self.error is not None:
+            raise self.error
+        return copy.deepcopy(self.result)
+
+
+class FlightRegistry(object):
+    """Thread-safe registry of the queries in flight, by fingerprint."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all the queries in flight."""
+        self._lock = Lock()
+        self._flights = {}
+
+    def join(self, key):
+        """Return ``(flight, leader)``: the flight of `key`, and whether it
+        has just been created, so the caller must perform the query."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def land(self, key, flight, result=None, error=None, aborted=False):
+        """Set the `result` or `error` of `flight`, or mark it `aborted`, and
+        remove it, so the next queries with the same `key` are performed
+        again."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            followers = flight.followers
+
+        if followers and result is not None:
+            # The caller may change its result while followers copy it.
+            result = copy.deepcopy(result)
+
+        flight.result = result
+        flight.error = error
+        flight.aborted = aborted
+        flight.done.set()
+
+
+flights = FlightRegistry()  #pylint: disable=invalid-name
+
+if hasattr(os, 'register_at_fork'):
+    # The threads performing the queries in flight do not survive a fork.
+    os.register_at_fork(after_in_child=flights.reset)
+
+
+class CoalescingInterceptor(Interceptor):
+    """Share one request between identical concurrent read queries.
+
+    It is enabled by the ``COALESCE`` option of the server: either ``True``,
+    or a dict with the keys:
+
+    * ``METHODS``: the coalesced methods, by default
+      :data:`COALESCED_METHODS`,
+    * ``TIMEOUT``: the time, in seconds, a query waits for an identical query
+      in flight before it is performed on its own, by default
+      :data:`DEFAULT_COALESCE_TIMEOUT`.
+    """
+    def __init__(self, backend, methods=COALESCED_METHODS,
+                 timeout=DEFAULT_COALESCE_TIMEOUT):
+        super(CoalescingInterceptor, self).__init__(backend)
+        self.methods = frozenset(methods)
+        self.timeout = timeout
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('COALESCE')
+
+        if not options:
+            return None
+
+        if options is True:
+            options = {}
+
+        return cls(backend,
+                   methods=options.get('METHODS', COALESCED_METHODS),
+                   timeout=options.get('TIMEOUT', DEFAULT_COALESCE_TIMEOUT))
+
+    def intercept(self, query):
+        if query.method not in self.methods:
+            return query.proceed()
+
+        key = query.fingerprint()
+        flight, leader = flights.join(key)
+
+        if not leader:
+            if flight.wait(self.timeout) and not flight.aborted:
+                return flight.get()
+            return query.proceed()
+
+        result = error = None
+        aborted = True
+        try:
+            result = query.proceed()
+            aborted = False
+        except Exception as e:
+            error = e
+            aborted = False
+            raise
+        finally:
+            # The followers are always released, even when the query is
+            # interrupted: they perform it on their own then.
+            flights.land(key, flight, result, error, aborted)
+
+        return result
@@ -7,14 +7,60 @@ Each backend implements the expected behavior defined in the base class - that
 is to say: they provide methods that don't need to get an index or an alias
 as argument to perform requests (when applicable).
 """
+import os
+import weakref
+
 from django.core.exceptions import ImproperlyConfigured
-from elasticsearch.client import Elasticsearch, Transport
+from elasticsearch.client import Elasticsearch
 from elasticsearch.connection.http_urllib3 import Urllib3HttpConnection
 from elasticsearch.connection.http_requests import RequestsHttpConnection
 from elasticsearch.connection.thrift import ThriftConnection
 from elasticsearch.connection.memcached import MemcachedConnection
 
 from .abstracts import Base
+from .batching import BatchingInterceptor, batch
+from .bulk import (DEFAULT_CHUNK_SIZE, DEFAULT_MAX_CHUNK_BYTES,
+                   DEFAULT_THREAD_COUNT, parallel_bulk, process_bulk,
+                   streaming_bulk)
+from .instrumentation import StatsInterceptor
+from .buffering import WriteBuffer, WriteBufferInterceptor
+from .caching import ResultCacheInterceptor
+from .coalescing import CoalescingInterceptor
+from .hedging import HedgingInterceptor
+from .interceptors import build_interceptors, intercepted
+from .lru import HotDocumentInterceptor
+from .pagination import DEFAULT_PER_PAGE, CursorPaginator
+from .querylog import QueryLogInterceptor
+from .resilience import CircuitBreakerInterceptor, RetryInterceptor
+from .scrolling import (DEFAULT_SCAN_SIZE, DEFAULT_SCROLL,
+                        DEFAULT_SLICED_QUEUE_SIZE, scan, scan_slices,
+                        sliced_scan)
+from .slowlog import SlowQueryInterceptor
+from .transactions import OnCommitInterceptor
+from .pooling import PooledHttpConnection, close_transport, open_sockets
+from .transport import MeasuredTransport
+
+
+def close_client(transport, pid, write_buffer=None):
+    """Flush `write_buffer`, if any, then close the sockets of `transport`,
+    only in the process `pid` (see
+    :func:`~djangoes.backends.pooling.close_transport`)."""
+    if write_buffer is not None and pid == os.getpid():
+        write_buffer.flush_later()
+    close_transport(transport, pid)
+
+
+class Client(Elasticsearch):
+    """ElasticSearch client accepting bulk bodies already encoded.
+
+    The bodies of ``bulk`` and ``msearch`` given as bytes are sent as they
+    are, such as the bodies built by the workers of
+    :func:`~djangoes.backends.bulk.process_bulk`.
+    """
+    def _bulk_body(self, body):
+        if isinstance(body, bytes):
+            return body if body.endswith(b'\n') else body + b'\n'
+        return super(Client, self)._bulk_body(body)
 
 
 class BaseElasticsearchBackend(Base):
@@ -23,7 +69,8 @@ class BaseElasticsearchBackend(Base):
     It uses two entry points to configure the underlying connection:
 
     * ``transport_class``: the transport class from ``elasticsearch``. By
-      default ``elasticsearch.transport.Transport``.
+      default :class:`~djangoes.backends.transport.MeasuredTransport`, based
+      on ``elasticsearch.transport.Transport``.
     * ``connection_class``: the connection class used by the transport class.
       It's undefined by default, as it is on the subclasses to provide one.
 
@@ -32,10 +79,26 @@ class BaseElasticsearchBackend(Base):
     """
     #: ElasticSearch transport class used by the client class to perform
     #: requests.
-    transport_class = Transport
+    transport_class = MeasuredTransport
     #: ElasticSearch connection class used by the transport class to perform
     #: requests.
     connection_class = None
+    #: Interceptors of the queries, from the outermost to the innermost (see
+    #: :mod:`djangoes.backends.interceptors`).
+    interceptor_classes = [
+        BatchingInterceptor,
+        OnCommitInterceptor,
+        WriteBufferInterceptor,
+        StatsInterceptor,
+        QueryLogInterceptor,
+        SlowQueryInterceptor,
+        ResultCacheInterceptor,
+        HotDocumentInterceptor,
+        CoalescingInterceptor,
+        RetryInterceptor,
+        CircuitBreakerInterceptor,
+        HedgingInterceptor,
+    ]
 
     def configure_client(self):
         """Instantiate and configure the ElasticSearch client.
@@ -51,7 +114,7 @@ class BaseElasticsearchBackend(Base):
         elements is undefined.
         """
         hosts = self.server['HOSTS']
-        params = self.server['PARAMS']
+        params = self.get_client_params()
 
         if not self.transport_class:
             raise ImproperlyConfigured(
@@ -64,10 +127,218 @@ class BaseElasticsearchBackend(Base):
                 'no connection class provided' % self.__class__)
 
         #pylint: disable=star-args
-        self.client = Elasticsearch(hosts,
-                                    transport_class=self.transport_class,
-                                    connection_class=self.connection_class,
-                                    **params)
+        self.client = Client(hosts,
+                             transport_class=self.transport_class,
+                             connection_class=self.connection_class,
+                             **params)
+
+        self.interceptors = self.get_interceptors()
+        self.write_buffer = WriteBuffer.from_backend(self)
+
+        # Sockets are closed, once the write buffer is flushed, when the
+        # backend is garbage collected (such as when its thread ends), if it
+        # is not closed before, but never by a child process after a fork.
+        self._finalizer = weakref.finalize(self, close_client,
+                                           self.client.transport,
+                                           os.getpid(), self.write_buffer)
+
+    def get_interceptors(self):
+        """Return the interceptors of the queries, built from
+        ``interceptor_classes``."""
+        return build_interceptors(self, self.interceptor_classes)
+
+    def close(self):
+        """Close the sockets of all the connections of the client, once the
+        write buffer is flushed."""
+        super(BaseElasticsearchBackend, self).close()
+        finalizer = getattr(self, '_finalizer', None)
+        if finalizer is not None:
+            finalizer()
+
+    def batch(self):
+        """Return a context manager batching the queries performed in its
+        block by the current thread (see :mod:`djangoes.backends.batching`).
+        """
+        return batch(self)
+
+    def get_bulk_index(self):
+        """Return the default index of the bulk actions, or ``None``.
+
+        When the connection has only one index, it is its only alias if it
+        has one, otherwise its name. With several indices, each action must
+        give its own ``_index``.
+        """
+        if len(self.server_indices) != 1:
+            return None
+
+        (index,) = self.server_indices.values()
+        if len(index['ALIASES']) == 1:
+            return index['ALIASES'][0]
+        return index['NAME']
+
+    def streaming_bulk(self, actions, chunk_size=DEFAULT_CHUNK_SIZE,
+                       max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                       raise_on_error=True, raise_on_exception=True,
+                       index=None, doc_type=None, **kwargs):
+        """Perform the `actions` by chunks of at most `chunk_size` actions
+        and `max_chunk_bytes` bytes, and yield the result of each action.
+
+        The `actions` can be any iterable, such as a generator: they are
+        consumed one chunk at a time. By default, the `index` of the actions
+        is given by :meth:`get_bulk_index`. See
+        :func:`djangoes.backends.bulk.streaming_bulk`.
+        """
+        if index is None:
+            index = self.get_bulk_index()
+
+        return streaming_bulk(self, actions, chunk_size=chunk_size,
+                              max_chunk_bytes=max_chunk_bytes,
+                              raise_on_error=raise_on_error,
+                              raise_on_exception=raise_on_exception,
+                              index=index, doc_type=doc_type, **kwargs)
+
+    def parallel_bulk(self, actions, thread_count=DEFAULT_THREAD_COUNT,
+                      queue_size=None, ordered=True,
+                      chunk_size=DEFAULT_CHUNK_SIZE,
+                      max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                      raise_on_error=True, raise_on_exception=True,
+                      index=None, doc_type=None, **kwargs):
+        """Perform the `actions` by chunks, sent concurrently by
+        `thread_count` threads, and yield the result of each action.
+
+        At most `queue_size` chunks (by default `thread_count`) are in flight
+        at the same time. The results are given in the order of the actions
+        if `ordered` is ``True``, otherwise as soon as their chunk is done.
+        By default, the `index` of the actions is given by
+        :meth:`get_bulk_index`. See
+        :func:`djangoes.backends.bulk.parallel_bulk`.
+        """
+        if index is None:
+            index = self.get_bulk_index()
+
+        return parallel_bulk(self, actions, thread_count=thread_count,
+                             queue_size=queue_size, ordered=ordered,
+                             chunk_size=chunk_size,
+                             max_chunk_bytes=max_chunk_bytes,
+                             raise_on_error=raise_on_error,
+                             raise_on_exception=raise_on_exception,
+                             index=index, doc_type=doc_type, **kwargs)
+
+    def process_bulk(self, items, transform, processes=None, queue_size=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE,
+                     max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                     raise_on_error=True, raise_on_exception=True,
+                     mp_context=None, index=None, doc_type=None, **kwargs):
+        """Build the actions of the `items` with `transform` in `processes`
+        worker processes, perform them by chunks, and yield the result of
+        each action.
+
+        The workers only build and serialize the actions: the requests are
+        all performed by the calling thread, with this connection. By
+        default, the `index` of the actions is given by
+        :meth:`get_bulk_index`. See
+        :func:`djangoes.backends.bulk.process_bulk`.
+        """
+        if index is None:
+            index = self.get_bulk_index()
+
+        return process_bulk(self, items, transform, processes=processes,
+                            queue_size=queue_size, chunk_size=chunk_size,
+                            max_chunk_bytes=max_chunk_bytes,
+                            raise_on_error=raise_on_error,
+                            raise_on_exception=raise_on_exception,
+                            mp_context=mp_context, index=index,
+                            doc_type=doc_type, **kwargs)
+
+    def scan(self, doc_type=None, body=None, size=DEFAULT_SCAN_SIZE,
+             scroll=DEFAULT_SCROLL, preserve_order=False, raise_on_error=True,
+             **kwargs):
+        """Yield all the hits of the search `body` on the indices of the
+        connection, fetched by pages of `size` hits with a scroll context
+        kept alive for `scroll`.
+
+        The scroll context is cleared when the iteration stops, even early.
+        See :func:`djangoes.backends.scrolling.scan`.
+        """
+        return scan(self, doc_type, body, size=size, scroll=scroll,
+                    preserve_order=preserve_order,
+                    raise_on_error=raise_on_error, **kwargs)
+
+    def scan_slices(self, doc_type=None, body=None, slices=None, **kwargs):
+        """Return one :meth:`scan` iterator per slice of the search `body`,
+        each one on a part of the shards of the indices.
+
+        There are `slices` slices, by default one per shard. See
+        :func:`djangoes.backends.scrolling.scan_slices`.
+        """
+        return scan_slices(self, doc_type, body, slices=slices, **kwargs)
+
+    def sliced_scan(self, doc_type=None, body=None, slices=None,
+                    workers=None, processes=False,
+                    queue_size=DEFAULT_SLICED_QUEUE_SIZE,
+                    size=DEFAULT_SCAN_SIZE, scroll=DEFAULT_SCROLL,
+                    raise_on_error=True, mp_context=None, **kwargs):
+        """Yield all the hits of the search `body`, scanned by `slices`
+        slices concurrently, by worker threads, or worker processes started
+        by `mp_context` if `processes` is ``True``.
+
+        At most `queue_size` pages of hits wait to be consumed. See
+        :func:`djangoes.backends.scrolling.sliced_scan`.
+        """
+        return sliced_scan(self, doc_type, body, slices=slices,
+                           workers=workers, processes=processes,
+                           queue_size=queue_size, size=size, scroll=scroll,
+                           raise_on_error=raise_on_error,
+                           mp_context=mp_context, **kwargs)
+
+    def paginate(self, body=None, per_page=DEFAULT_PER_PAGE, doc_type=None,
+                 sort=None, tiebreaker=None, **kwargs):
+        """Return a paginator of the hits of the search `body`, by pages of
+        `per_page` hits after or before a cursor, with ``search_after``.
+
+        The `tiebreaker`, a unique field with doc values, is required. See
+        :class:`djangoes.backends.pagination.CursorPaginator`.
+        """
+        return CursorPaginator(self, body, per_page=per_page,
+                               doc_type=doc_type, sort=sort,
+                               tiebreaker=tiebreaker, **kwargs)
+
+    def warm_up(self, sockets=1, sniff=False):
+        """Open keep-alive sockets to each host before they are needed.
+
+        If `sniff` is ``True``, the nodes of the cluster are sniffed first, so
+        the sockets are opened to all its nodes. Only the connections based on
+        ``urllib3`` can open sockets in advance; the others are ignored.
+        """
+        transport = self.client.transport
+
+        if sniff:
+            transport.sniff_hosts()
+
+        for connection in transport.connection_pool.connections:
+            pool = getattr(connection, 'pool', None)
+            if pool is not None and hasattr(pool, '_get_conn'):
+                open_sockets(pool, sockets)
+
+    def get_client_params(self):
+        """Return the keyword arguments used to instantiate the client.
+
+        By default, it is the ``PARAMS`` dict of the server's settings.
+        """
+        return self.server['PARAMS']
+
+    def pool_stats(self):
+        """Return the stats of each host's connection pool, when available.
+
+        Return a dict where each key is a host, and each value is the dict
+        given by the ``stats`` method of the host's connection. Connections
+        without such method are ignored.
+        """
+        return {
+            connection.host: connection.stats()
+            for connection in self.client.transport.connection_pool.connections
+            if hasattr(connection, 'stats')
+        }
 
     # Server methods
     # ==============
@@ -75,27 +346,35 @@ class BaseElasticsearchBackend(Base):
     # related queries, such as "ping" or "info". The connection wrapper act
     # for them as a proxy.
 
+    @intercepted
     def ping(self, **kwargs):
         return self.client.ping(**kwargs)
 
+    @intercepted
     def info(self, **kwargs):
         return self.client.info(**kwargs)
 
+    @intercepted
     def put_script(self, lang, script_id, body, **kwargs):
         return self.client.put_script(lang, script_id, body, **kwargs)
 
+    @intercepted
     def get_script(self, lang, script_id, **kwargs):
         return self.client.get_script(lang, script_id, **kwargs)
 
+    @intercepted
     def delete_script(self, lang, script_id, **kwargs):
         return self.client.delete_script(lang, script_id, **kwargs)
 
+    @intercepted
     def put_template(self, template_id, body, **kwargs):
         return self.client.put_template(template_id, body, **kwargs)
 
+    @intercepted
     def get_template(self, template_id, body=None, **kwargs):
         return self.client.get_template(template_id, body, **kwargs)
 
+    @intercepted
     def delete_template(self, template_id=None, **kwargs):
         return self.client.delete_template(template_id, **kwargs)
 
@@ -105,15 +384,19 @@ class BaseElasticsearchBackend(Base):
     # As it makes sense to not give an index, developers are free to use these
     # as they want, as long as they are careful.
 
+    @intercepted
     def mget(self, body, index=None, doc_type=None, **kwargs):
         return self.client.mget(body, index, doc_type, **kwargs)
 
+    @intercepted
     def bulk(self, body, index=None, doc_type=None, **kwargs):
         return self.client.bulk(body, index, doc_type, **kwargs)
 
+    @intercepted
     def msearch(self, body, index=None, doc_type=None, **kwargs):
         return self.client.msearch(body, index, doc_type, **kwargs)
 
+    @intercepted
     def mpercolate(self, body, index=None, doc_type=None, **kwargs):
         return self.client.mpercolate(body, index, doc_type, **kwargs)
 
@@ -121,9 +404,11 @@ class BaseElasticsearchBackend(Base):
     # ==============
     # The underlying client does not require an index to perform scroll.
 
+    @intercepted
     def scroll(self, scroll_id, **kwargs):
         return self.client.scroll(scroll_id, **kwargs)
 
+    @intercepted
     def clear_scroll(self, scroll_id, body=None, **kwargs):
         return self.client.clear_scroll(scroll_id, body, **kwargs)
 
@@ -133,80 +418,110 @@ class BaseElasticsearchBackend(Base):
     # queries. The connection wrapper overrides these client methods to
     # automatically uses the configured names (indices and/or aliases).
 
+    @intercepted
     def create(self, doc_type, body, doc_id=None, **kwargs):
         return self.client.create(
-            self.indices, doc_type, body, doc_id, **kwargs)
+            self.indices_param, doc_type, body, doc_id, **kwargs)
 
+    @intercepted
     def index(self, doc_type, body, doc_id=None, **kwargs):
         return self.client.index(
-            self.indices, doc_type, body, doc_id, **kwargs)
+            self.indices_param, doc_type, body, doc_id, **kwargs)
 
+    @intercepted
     def exists(self, doc_id, doc_type='_all', **kwargs):
-        return self.client.exists(self.indices, doc_id, doc_type, **kwargs)
+        return self.client.exists(
+            self.indices_param, doc_id, doc_type, **kwargs)
 
+    @intercepted
     def get(self, doc_id, doc_type='_all', **kwargs):
-        return self.client.get(self.indices, doc_id, doc_type, **kwargs)
+        return self.client.get(self.indices_param, doc_id, doc_type, **kwargs)
 
+    @intercepted
     def get_source(self, doc_id, doc_type='_all', **kwargs):
-        return self.client.get_source(self.indices, doc_id, doc_type, **kwargs)
+        return self.client.get_source(
+            self.indices_param, doc_id, doc_type, **kwargs)
 
+    @intercepted
     def update(self, doc_type, doc_id, body=None, **kwargs):
         return self.client.update(
-            self.indices, doc_type, doc_id, body, **kwargs)
+            self.indices_param, doc_type, doc_id, body, **kwargs)
 
+    @intercepted
     def search(self, doc_type=None, body=None, **kwargs):
-        return self.client.search(self.indices, doc_type, body, **kwargs)
+        return self.client.search(self.indices_param, doc_type, body, **kwargs)
 
+    @intercepted
     def search_shards(self, doc_type=None, **kwargs):
-        return self.client.search_shards(self.indices, doc_type, **kwargs)
+        return self.client.search_shards(
+            self.indices_param, doc_type, **kwargs)
 
+    @intercepted
     def search_template(self, doc_type=None, body=None, **kwargs):
         return self.client.search_template(
-            self.indices, doc_type, body, **kwargs)
+            self.indices_param, doc_type, body, **kwargs)
 
+    @intercepted
     def explain(self, doc_type, doc_id, body=None, **kwargs):
         return self.client.explain(
-            self.indices, doc_type, doc_id, body, **kwargs)
+            self.indices_param, doc_type, doc_id, body, **kwargs)
 
+    @intercepted
     def delete(self, doc_type, doc_id, **kwargs):
-        return self.client.delete(self.indices, doc_type, doc_id, **kwargs)
+        return self.client.delete(
+            self.indices_param, doc_type, doc_id, **kwargs)
 
+    @intercepted
     def count(self, doc_type=None, body=None, **kwargs):
-        return self.client.count(self.indices, doc_type, body, **kwargs)
+        return self.client.count(self.indices_param, doc_type, body, **kwargs)
 
+    @intercepted
     def delete_by_query(self, doc_type=None, body=None, **kwargs):
         return self.client.delete_by_query(
-            self.indices, doc_type, body, **kwargs)
+            self.indices_param, doc_type, body, **kwargs)
 
+    @intercepted
     def suggest(self, body, **kwargs):
-        return self.client.suggest(body, self.indices, **kwargs)
+        return self.client.suggest(body, self.indices_param, **kwargs)
 
+    @intercepted
     def percolate(self, doc_type, doc_id=None, body=None, **kwargs):
         return self.client.percolate(
-            self.indices, doc_type, doc_id, body, **kwargs)
+            self.indices_param, doc_type, doc_id, body, **kwargs)
 
+    @intercepted
     def count_percolate(self, doc_type, doc_id=None, body=None, **kwargs):
         return self.client.count_percolate(
-            self.indices, doc_type, doc_id, body, **kwargs)
+            self.indices_param, doc_type, doc_id, body, **kwargs)
 
+    @intercepted
     def mlt(self, doc_type, doc_id, body=None, **kwargs):
-        return self.client.mlt(self.indices, doc_type, doc_id, body, **kwargs)
+        return self.client.mlt(
+            self.indices_param, doc_type, doc_id, body, **kwargs)
 
+    @intercepted
     def termvector(self, doc_type, doc_id, body=None, **kwargs):
         return self.client.termvector(
-            self.indices, doc_type, doc_id, body, **kwargs)
+            self.indices_param, doc_type, doc_id, body, **kwargs)
 
+    @intercepted
     def mtermvectors(self, doc_type=None, body=None, **kwargs):
-        return self.client.mtermvectors(self.indices, doc_type, body, **kwargs)
+        return self.client.mtermvectors(
+            self.indices_param, doc_type, body, **kwargs)
 
+    @intercepted
     def benchmark(self, doc_type=None, body=None, **kwargs):
-        return self.client.benchmark(self.indices, doc_type, body, **kwargs)
+        return self.client.benchmark(
+            self.indices_param, doc_type, body, **kwargs)
 
+    @intercepted
     def abort_benchmark(self, name=None, **kwargs):
         return self.client.abort_benchmark(name, **kwargs)
 
+    @intercepted
     def list_benchmarks(self, doc_type=None, **kwargs):
-        return self.client.list_benchmarks(self.indices, doc_type, **kwargs)
+        return self.client.list_benchmarks(
+            self.indices_param, doc_type, **kwargs)
 
 
 # ElasticSearch backends
@@ -217,6 +532,44 @@ class SimpleHttpBackend(BaseElasticsearchBackend):
     connection_class = Urllib3HttpConnection
 
 
+class PooledHttpBackend(BaseElasticsearchBackend):
+    """Connection backend using a bounded and reaped ``urllib3`` pool.
+
+    Its connection pools are thread-safe: used with the ``SHARED`` option, one
+    client and its pools are shared by all the threads of a process. The pools
+    are configured by the ``POOL`` dict of the server's settings:
+
+    * ``MAXSIZE``: maximum number of sockets kept open to each host,
+    * ``BLOCK``: if ``True``, ``MAXSIZE`` is a hard cap and threads wait for a
+      free socket instead of opening a new one,
+    * ``TIMEOUT``: how long a thread can wait for a free socket,
+    * ``IDLE_TIMEOUT``: number of seconds after which an idle socket is closed.
+    """
+    connection_class = PooledHttpConnection
+
+    def get_client_params(self):
+        """Add the ``POOL`` options to the client parameters."""
+        params = dict(super(PooledHttpBackend, self).get_client_params())
+        pool = self.server.get('POOL', {})
+
+        params.setdefault('maxsize', pool.get('MAXSIZE', 10))
+        params.setdefault('block', pool.get('BLOCK', False))
+        params.setdefault('pool_timeout', pool.get('TIMEOUT'))
+        params.setdefault('idle_timeout', pool.get('IDLE_TIMEOUT'))
+
+        return params
+
+    def reap(self):
+        """Close the idle sockets of all hosts' pools.
+
+        Return the number of closed sockets.
+        """
+        return sum(
+            connection.reap()
+            for connection in self.client.transport.connection_pool.connections
+        )
+
+
 class SimpleRequestsHttpBackend(BaseElasticsearchBackend):
     """Connection backend using the HTTP for Human request connection class."""
     connection_class = RequestsHttpConnection
@@ -0,0 +1,300 @@
+"""Hedged read queries, to cut the tail latency.
+
+When one node of the cluster is slow (during a long garbage collection for
+example), the queries it receives are slow too, and they make the tail of the
+latency of the whole application. With the ``HEDGING`` option of a server,
+its read queries that do not get a response within a delay are sent again to
+another host: the first response is used, and the other one is discarded::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2', 'host_3'],
+            'HEDGING': {
+                'PERCENTILE': 95,
+            },
+        }
+    }
+
+The delay is the given percentile of the latency of the method, as measured
+by the connection's stats (see :mod:`djangoes.backends.instrumentation`), so
+only a few queries are sent twice. Until enough queries have been measured,
+or when the stats are disabled, the delay is the ``DELAY`` option.
+
+The primary request is performed by the calling thread, as any query: a
+fast query is never handed over to another thread. Its hedged request is sent
+by a worker thread after the delay, then the first response is used, and the
+other request is aborted: its socket is shut down (see
+:meth:`~djangoes.backends.transport.ConnectionChoice.abort`), so the
+connections of a backend with ``HEDGING`` are made interruptible.
+
+The hedged request measures its own transfer (see
+:func:`~djangoes.backends.transport.measure_transfer`): only the bytes it
+receives when its response is used are added to the transfer of the query.
+
+A query is not hedged when the connection has only one live host, as the
+hedged request would go to the slow host again, nor when too many hedged
+requests of the alias are in flight already: under load, hedging would only
+add more load.
+"""
+from concurrent import futures
+import contextvars
+import heapq
+import itertools
+import os
+from threading import BoundedSemaphore, Condition, Lock, Thread
+import time
+
+from .instrumentation import registry
+from .interceptors import Interceptor
+from .transport import choose_connection, current_transfer, measure_transfer
+
+
+#: Methods hedged by default.
+HEDGED_METHODS = frozenset(['search', 'get', 'mget', 'count'])
+
+#: Default delay, in milliseconds, before hedging a query, used without stats.
+DEFAULT_HEDGING_DELAY = 50
+
+#: Default number of queries measured before using the percentile delay.
+DEFAULT_HEDGING_MIN_CALLS = 100
+
+#: Default maximum number of hedged requests of an alias in flight.
+DEFAULT_HEDGING_WORKERS = 32
+
+
+class ExecutorRegistry(object):
+    """Thread-safe registry of the executor of each alias, and of the
+    semaphore capping its hedged requests in flight."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all the executors, without waiting for them."""
+        self._lock = Lock()
+        self._executors = {}
+
+    def get(self, alias, workers):
+        """Return the executor of `alias` and its semaphore, created if
+        necessary."""
+        with self._lock:
+            executor = self._executors.get(alias)
+            if executor is None:
+                executor = self._executors[alias] = (
+                    futures.ThreadPoolExecutor(
+                        max_workers=workers,
+                        thread_name_prefix='djangoes-hedging-%s' % alias),
+                    BoundedSemaphore(workers))
+            return executor
+
+
+executors = ExecutorRegistry()  #pylint: disable=invalid-name
+
+
+class HedgeScheduler(object):
+    """Thread starting the hedged requests once their delay is over.
+
+    One thread waits for the deadlines of all the hedged requests, so a
+    query does not hand anything over to a worker thread until it is slow.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all the hedged requests, and the thread."""
+        self._condition = Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._thread = None
+
+    def schedule(self, hedge):
+        """Start `hedge` at its deadline."""
+        with self._condition:
+            heapq.heappush(self._heap,
+                           (hedge.deadline, next(self._counter), hedge))
+            if self._thread is None:
+                self._thread = Thread(target=self.run,
+                                      args=(self._condition, self._heap),
+                                      name='djangoes-hedging', daemon=True)
+                self._thread.start()
+            elif self._heap[0][2] is hedge:
+                self._condition.notify()
+
+    @staticmethod
+    def run(condition, heap):
+        """Start each hedged request of `heap` at its deadline, forever."""
+        while True:
+            with condition:
+                while True:
+                    timeout = (heap[0][0] - time.monotonic()) if heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    condition.wait(timeout)
+                _, _, hedge = heapq.heappop(heap)
+            hedge.start()
+
+
+scheduler = HedgeScheduler()  #pylint: disable=invalid-name
+
+if hasattr(os, 'register_at_fork'):
+    # Threads do not survive a fork.
+    os.register_at_fork(after_in_child=executors.reset)
+    os.register_at_fork(after_in_child=scheduler.reset)
+
+
+class Hedge(object):
+    """Hedged request of a query, sent to another host after `delay`
+    milliseconds, unless the primary request is done.
+
+    :param query: the query performed by the primary request
+    :param choice: the connection choice of the primary request, aborted by
+      the hedged request when it wins
+    :param delay: the delay before sending the hedged request
+    :param executor: the executor performing the hedged request
+    :param slots: the semaphore capping the hedged requests in flight
+    """
+    def __init__(self, query, choice, delay, executor, slots):
+        self.query = query.copy()
+        self.choice = choice
+        self.deadline = time.monotonic() + delay / 1000.0
+        self.executor = executor
+        self.slots = slots
+        self.context = contextvars.copy_context()
+        self.lock = Lock()
+        self.done = False
+        self.future = None
+        self.hedged_choice = None
+        self.transfer = None
+
+    def start(self):
+        """Send the hedged request, unless the primary request is done, or
+        too many hedged requests are in flight: it is then dropped."""
+        with self.lock:
+            if self.done or not self.slots.acquire(blocking=False):
+                return
+            used = self.choice.used
+            self.future = self.executor.submit(
+                self.context.run, self.perform, [used] if used else [])
+
+    def perform(self, excluded):
+        """Perform the hedged request, and abort the primary request if it
+        succeeds first."""
+        try:
+            with measure_transfer() as self.transfer, \
+                    choose_connection(excluded) as choice:
+                with self.lock:
+                    self.hedged_choice = choice
+                    if self.done:
+                        choice.abort()
+                result = self.query.proceed()
+        finally:
+            self.slots.release()
+
+        with self.lock:
+            if not self.done:
+                self.choice.abort()
+
+        return result
+
+    def finish(self, abort=False):
+        """Tell the primary request is done, and return the future of the
+        hedged request, or ``None`` if it has not been sent.
+
+        With `abort`, the primary request succeeded: the hedged request is
+        aborted if it is in flight.
+        """
+        with self.lock:
+            self.done = True
+            if abort and self.hedged_choice is not None:
+                self.hedged_choice.abort()
+            return self.future
+
+    def result(self):
+        """Return the response of the hedged request, adding the bytes it
+        received to the transfer of the current context."""
+        result = self.future.result()
+        transfer = current_transfer()
+        if transfer is not None:
+            transfer.received += self.transfer.received
+        return result
+
+
+class HedgingInterceptor(Interceptor):
+    """Send a read query again to another host when it is too slow.
+
+    It is enabled by the ``HEDGING`` option of the server, a dict with:
+
+    * ``PERCENTILE``: percentile of the method's latency used as the delay
+      before hedging a query, by default 95,
+    * ``DELAY``: delay before hedging a query, in milliseconds, until enough
+      queries are measured, by default :data:`DEFAULT_HEDGING_DELAY`,
+    * ``MIN_CALLS``: number of queries to measure before using the
+      percentile, by default :data:`DEFAULT_HEDGING_MIN_CALLS`,
+    * ``METHODS``: the methods to hedge, by default :data:`HEDGED_METHODS`,
+    * ``WORKERS``: maximum number of hedged requests of the alias in flight,
+      by default :data:`DEFAULT_HEDGING_WORKERS`: a query is not hedged when
+      this limit is reached.
+
+    The connections of the backend's transport are made interruptible, if
+    it is a :class:`~djangoes.backends.transport.MeasuredTransport`.
+    """
+    def __init__(self, backend, percentile=95, delay=DEFAULT_HEDGING_DELAY,
+                 min_calls=DEFAULT_HEDGING_MIN_CALLS, methods=HEDGED_METHODS,
+                 workers=DEFAULT_HEDGING_WORKERS):
+        super(HedgingInterceptor, self).__init__(backend)
+        self.percentile = percentile
+        self.delay = delay
+        self.min_calls = min_calls
+        self.methods = frozenset(methods)
+        self.workers = workers
+        # The losing request is aborted by shutting down its socket.
+        set_interruptible = getattr(backend.client.transport,
+                                    'set_interruptible', None)
+        if set_interruptible is not None:
+            set_interruptible()
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('HEDGING')
+
+        if not options:
+            return None
+
+        return cls(backend,
+                   percentile=options.get('PERCENTILE', 95),
+                   delay=options.get('DELAY', DEFAULT_HEDGING_DELAY),
+                   min_calls=options.get('MIN_CALLS',
+                                         DEFAULT_HEDGING_MIN_CALLS),
+                   methods=options.get('METHODS', HEDGED_METHODS),
+                   workers=options.get('WORKERS', DEFAULT_HEDGING_WORKERS))
+
+    def get_delay(self, query):
+        """Return the delay before hedging `query`, in milliseconds."""
+        delay = registry.percentile(query.alias, query.method,
+                                    self.percentile, self.min_calls)
+        return self.delay if delay is None else delay
+
+    def intercept(self, query):
+        connections = self.backend.client.transport.connection_pool.connections
+        if query.method not in self.methods or len(connections) < 2:
+            return query.proceed()
+
+        executor, slots = executors.get(query.alias, self.workers)
+
+        with choose_connection() as choice:
+            hedge = Hedge(query, choice, self.get_delay(query), executor,
+                          slots)
+            scheduler.schedule(hedge)
+
+            try:
+                result = query.proceed()
+            except Exception:
+                future = hedge.finish()
+                # The primary request failed, or it has been aborted by the
+                # hedged request: the error of the primary request is raised
+                # only if both failed.
+                if future is None or future.exception() is not None:
+                    raise
+                return hedge.result()
+
+        hedge.finish(abort=True)
+        return result
@@ -0,0 +1,197 @@
+"""Latency and throughput statistics of the queries of each connection.
+
+The :class:`StatsInterceptor` measures each query performed by a backend: its
+duration, the number of bytes sent and received, and whether it raised an
+error. Measures are aggregated by connection alias and by method into the
+process-wide :data:`registry`, and sent with the
+:data:`~djangoes.signals.query_finished` signal.
+
+The stats of all connections are given by
+:meth:`djangoes.ConnectionHandler.stats`.
+"""
+import os
+from threading import Lock
+import time
+
+from djangoes.signals import query_finished
+
+from .interceptors import Interceptor
+from .transport import measure_transfer
+
+
+#: Upper bounds, in milliseconds, of the buckets of the latency histograms.
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000,
+                   10000)
+
+
+class MethodStats(object):
+    """Aggregated measures of the queries of one method."""
+    __slots__ = ('calls', 'errors', 'sent', 'received', 'total_time',
+                 'max_time', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # One more bucket for the queries above the last bound.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, duration, sent, received, error):
+        """Add the measures of one query (`duration` is in milliseconds)."""
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.sent += sent
+        self.received += received
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        self.buckets[index] += 1
+
+    def percentile(self, percent):
+        """Estimate the `percent` percentile of latency, in milliseconds.
+
+        The estimation is the upper bound of the histogram's bucket where the
+        percentile is, or the max latency for the last bucket.
+        """
+        if not self.calls:
+            return None
+
+        rank = self.calls * percent / 100.0
+        cumulated = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            cumulated += count
+            if cumulated >= rank:
+                return min(bound, self.max_time)
+
+        return self.max_time
+
+    def as_dict(self):
+        """Return the measures as a dict."""
+        histogram = {
+            str(bound): count
+            for bound, count in zip(LATENCY_BUCKETS, self.buckets)
+        }
+        histogram['+Inf'] = self.buckets[-1]
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'sent': self.sent,
+            'received': self.received,
+            'total_time': self.total_time,
+            'mean_time': self.total_time / self.calls if self.calls else None,
+            'max_time': self.max_time,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'histogram': histogram,
+        }
+
+
+class StatsRegistry(object):
+    """Thread-safe registry of the stats of each alias and method."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all the stats."""
+        self._lock = Lock()
+        self._stats = {}
+
+    def record(self, alias, method, duration, sent, received, error):
+        """Add the measures of one query of `method` for `alias`."""
+        with self._lock:
+            methods = self._stats.setdefault(alias, {})
+            try:
+                stats = methods[method]
+            except KeyError:
+                stats = methods[method] = MethodStats()
+            stats.record(duration, sent, received, error)
+
+    def percentile(self, alias, method, percent, min_calls=1):
+        """Estimate the `percent` percentile of latency of `method` for
+        `alias`, or return ``None`` with less than `min_calls` queries."""
+        with self._lock:
+            stats = self._stats.get(alias, {}).get(method)
+            if stats is None or stats.calls < min_calls:
+                return None
+            return stats.percentile(percent)
+
+    def snapshot(self, alias=None):
+        """Return the stats as ``{alias: {method: stats_dict}}``.
+
+        If `alias` is given, only its stats are returned, as
+        ``{method: stats_dict}``.
+        """
+        with self._lock:
+            if alias is not None:
+                return {
+                    method: stats.as_dict()
+                    for method, stats in self._stats.get(alias, {}).items()
+                }
+
+            return {
+                alias: {
+                    method: stats.as_dict()
+                    for method, stats in methods.items()
+                }
+                for alias, methods in self._stats.items()
+            }
+
+
+#: Stats of all the connections of the current process.
+registry = StatsRegistry()  #pylint: disable=invalid-name
+
+if hasattr(os, 'register_at_fork'):
+    # Each process has its own stats.
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+class StatsInterceptor(Interceptor):
+    """Measure each query into the :data:`registry`.
+
+    It is enabled by the server's ``STATS`` option, which defaults to
+    ``True`` only when ``HEDGING`` is set, as hedging delays queries by the
+    measured latency. The :data:`~djangoes.signals.query_finished` signal is
+    only sent when it has receivers.
+    """
+    @classmethod
+    def from_backend(cls, backend):
+        default = bool(backend.server.get('HEDGING'))
+        if not backend.server.get('STATS', default):
+            return None
+        return cls(backend)
+
+    def intercept(self, query):
+        error = None
+        start = time.perf_counter()
+
+        with measure_transfer() as transfer:
+            try:
+                return query.proceed()
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                duration = (time.perf_counter() - start) * 1000
+                registry.record(query.alias, query.method, duration,
+                                transfer.sent, transfer.received,
+                                error is not None)
+                if query_finished.receivers:
+                    query_finished.send(sender=self.backend.__class__,
+                                        alias=query.alias,
+                                        method=query.method,
+                                        duration=duration,
+                                        sent=transfer.sent,
+                                        received=transfer.received,
+                                        exception=error)
@@ -0,0 +1,185 @@
+"""Interceptors of the queries performed by backends.
+
+Each query method of a backend decorated with :func:`intercepted` goes through
+the backend's chain of interceptors before calling the client. An interceptor
+receives the :class:`Query` and decides what to do with it: measure it, log
+it, retry it, answer it from a cache, etc. To continue with the next
+interceptor (and finally with the client), it calls :meth:`Query.proceed`.
+
+The chain of a backend is built by its ``configure_client`` method, from the
+backend's ``interceptor_classes``: each class is instantiated by its
+:meth:`Interceptor.from_backend` class method, that may return ``None`` when
+the interceptor is not enabled for this backend. Without any interceptor, a
+query method calls the client directly.
+"""
+from functools import wraps
+import hashlib
+import inspect
+import json
+
+from django.utils.module_loading import import_string
+
+
+class Query(object):
+    """A call to a query method of a backend, going through interceptors.
+
+    :param backend: the backend performing the query
+    :param method: name of the backend's method
+    :param func: the backend's function performing the query with the client
+    :param args: positional arguments of the call
+    :param kwargs: keyword arguments of the call
+    """
+    __slots__ = ('backend', 'method', 'func', 'args', 'kwargs',
+                 'interceptors', 'position')
+
+    def __init__(self, backend, method, func, args, kwargs, interceptors):
+        self.backend = backend
+        self.method = method
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.interceptors = interceptors
+        self.position = 0
+
+    @property
+    def alias(self):
+        """Alias of the backend's connection."""
+        return self.backend.alias
+
+    @property
+    def arguments(self):
+        """Dict of all the arguments of the call, by name.
+
+        Positional arguments are named after the parameters of the backend's
+        method, and extra keyword arguments are in the dict too.
+        """
+        signature = get_signature(self.func)
+        bound = signature.bind(self.backend, *self.args, **self.kwargs)
+        arguments = dict(bound.arguments)
+        arguments.pop('self', None)
+        arguments.update(arguments.pop('kwargs', {}))
+        return arguments
+
+    @property
+    def indices(self):
+        """Indices of the query: its ``index`` argument, or by default the
+        indices of the connection."""
+        return self.arguments.get('index') or self.backend.indices_param
+
+    def fingerprint(self):
+        """Return a hash of the alias, the method, the indices and all the
+        arguments (such as the body) of the query.
+
+        Two queries with the same fingerprint are identical: a read query
+        returns the same result as another one with the same fingerprint,
+        given the data did not change. The keys of the dicts are sorted, so
+        their order does not matter.
+        """
+        arguments = self.arguments
+        arguments['index'] = self.indices
+        body = arguments.get('body')
+        if isinstance(body, bytes):
+            arguments['body'] = body.decode('utf-8')
+        canonical = json.dumps([self.alias, self.method, arguments],
+                               sort_keys=True, separators=(',', ':'),
+                               default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def proceed(self):
+        """Call the next interceptor, or the client after the last one.
+
+        It can be called more than once by the same interceptor (to retry a
+        query for example): the next interceptors are then called again.
+        """
+        position = self.position
+
+        if position == len(self.interceptors):
+            return self.func(self.backend, *self.args, **self.kwargs)
+
+        self.position = position + 1
+        try:
+            return self.interceptors[position].intercept(self)
+        finally:
+            self.position = position
+
+    def copy(self):
+        """Return a copy of the query, at the same position in the chain.
+
+        A copy must be used to proceed from another thread.
+        """
+        query = Query(self.backend, self.method, self.func, self.args,
+                      dict(self.kwargs), self.interceptors)
+        query.position = self.position
+        return query
+
+    def __repr__(self):
+        return '<Query: %s.%s>' % (self.alias, self.method)
+
+
+_SIGNATURES = {}
+
+
+def get_signature(func):
+    """Return the (cached) signature of `func`."""
+    try:
+        return _SIGNATURES[func]
+    except KeyError:
+        signature = _SIGNATURES[func] = inspect.signature(func)
+        return signature
+
+
+def intercepted(func):
+    """Decorate a query method of a backend to use its interceptors."""
+    method = func.__name__
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        interceptors = self.interceptors
+        if not interceptors:
+            return func(self, *args, **kwargs)
+        return Query(self, method, func, args, kwargs, interceptors).proceed()
+
+    return wrapper
+
+
+class Interceptor(object):
+    """Base class of interceptors.
+
+    An interceptor is instantiated once per backend, with this backend as its
+    only argument.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    @classmethod
+    def from_backend(cls, backend):
+        """Return an interceptor for `backend`, or ``None`` if disabled.
+
+        By default, the interceptor is always enabled.
+        """
+        return cls(backend)
+
+    def intercept(self, query):
+        """Intercept `query`, and return its result.
+
+        By default, it only proceeds with the query.
+        """
+        return query.proceed()
+
+
+def build_interceptors(backend, interceptor_classes):
+    """Instantiate the interceptors of `backend`, in order.
+
+    Each item of `interceptor_classes` is either a class or its dotted path.
+    Interceptors not enabled for `backend` are ignored.
+    """
+    interceptors = []
+
+    for interceptor_class in interceptor_classes:
+        if isinstance(interceptor_class, str):
+            interceptor_class = import_string(interceptor_class)
+        interceptor = interceptor_class.from_backend(backend)
+        if interceptor is not None:
+            interceptors.append(interceptor)
+
+    return tuple(interceptors)
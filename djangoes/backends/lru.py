@@ -0,0 +1,314 @@
+"""In-process cache of hot documents, fetched by id.
+
+Some documents, such as configuration or feature flags, are fetched by id on
+every request, and almost never change. With the ``HOT_DOCUMENTS`` option of
+a server, the results of its ``get`` and ``get_source`` queries are kept in
+memory by the process, in a bounded LRU cache shared by its threads::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2'],
+            'HOT_DOCUMENTS': {
+                'MAX_ENTRIES': 1000,
+                'MAX_BYTES': 10 * 1024 * 1024,
+                'TTL': 60,
+            },
+        }
+    }
+
+A document is used without any request during ``TTL`` seconds. Then, with
+``VALIDATE``, the ``_version`` of a document returned by ``get`` is fetched
+without its source: if it did not change, the document is used for another
+``TTL`` seconds, without fetching it again.
+
+The documents written by the process (with ``index``, ``create``,
+``update``, ``delete`` or ``bulk``) are removed from the cache of all the
+connections, and ``delete_by_query`` clears them. The documents written by
+other processes are only updated after their ``TTL``.
+"""
+from collections import OrderedDict
+import json
+import os
+from threading import Lock
+import time
+
+from elasticsearch.exceptions import NotFoundError
+
+from .caching import get_bulk_actions
+from .interceptors import Interceptor
+
+
+#: Methods whose documents are cached.
+CACHED_METHODS = frozenset(['get', 'get_source'])
+
+#: Methods removing the documents they write from the caches.
+WRITE_METHODS = frozenset(['index', 'create', 'update', 'delete'])
+
+#: Default maximum number of documents of a cache.
+DEFAULT_MAX_ENTRIES = 1000
+
+#: Default maximum size, in bytes, of the JSON documents of a cache.
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+#: Default time, in seconds, during which a document is used without request.
+DEFAULT_TTL = 60
+
+
+class Entry(object):
+    """A cached document, as JSON."""
+    __slots__ = ('doc_id', 'data', 'size', 'expires_at', 'version')
+
+    def __init__(self, doc_id, data, expires_at, version=None):
+        self.doc_id = doc_id
+        self.data = data
+        self.size = len(data)
+        self.expires_at = expires_at
+        self.version = version
+
+
+class DocumentCache(object):
+    """Thread-safe LRU cache of documents, bounded by their number and by the
+    approximate size of their JSON."""
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        # Incremented by each removal, so a document fetched before it is
+        # not stored after it.
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._keys_by_id = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the entry of `key`, or ``None``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, generation=None):
+        """Store `entry` for `key`, and evict the least recently used entries
+        if the cache is full.
+
+        If `generation` is given, and documents have been removed since this
+        :attr:`generation`, the entry is not stored, as it may be outdated.
+        """
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._pop(key)
+            self._entries[key] = entry
+            self._keys_by_id.setdefault(entry.doc_id, set()).add(key)
+            self.size += entry.size
+
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+
+    def discard(self, doc_id):
+        """Remove the entries of the document `doc_id`."""
+        with self._lock:
+            self.generation += 1
+            for key in list(self._keys_by_id.get(doc_id, ())):
+                self._pop(key)
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_id.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        keys = self._keys_by_id[entry.doc_id]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_id[entry.doc_id]
+
+
+class DocumentCacheRegistry(object):
+    """Thread-safe registry of the document cache of each alias."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all the document caches."""
+        self._lock = Lock()
+        self._caches = {}
+
+    def get(self, alias, max_entries, max_bytes):
+        """Return the document cache of `alias`, created if necessary."""
+        with self._lock:
+            cache = self._caches.get(alias)
+            if cache is None:
+                cache = self._caches[alias] = DocumentCache(max_entries,
+                                                            max_bytes)
+            cache.max_entries = max_entries
+            cache.max_bytes = max_bytes
+            return cache
+
+    def discard(self, doc_ids):
+        """Remove the documents `doc_ids` from the caches of all aliases."""
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            for doc_id in doc_ids:
+                cache.discard(doc_id)
+
+    def clear(self):
+        """Remove all the documents from the caches of all aliases."""
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            cache.clear()
+
+
+document_caches = DocumentCacheRegistry()  #pylint: disable=invalid-name
+
+if hasattr(os, 'register_at_fork'):
+    # Each process has its own documents.
+    os.register_at_fork(after_in_child=document_caches.reset)
+
+
+def get_bulk_ids(body):
+    """Return the ids of the documents given by the actions of a bulk body."""
+    return [str(action['_id']) for action in get_bulk_actions(body)
+            if '_id' in action]
+
+
+class HotDocumentInterceptor(Interceptor):
+    """Keep the documents fetched by id in the process' memory.
+
+    It is enabled by the ``HOT_DOCUMENTS`` option of the server, either
+    ``True`` or a dict with:
+
+    * ``MAX_ENTRIES``: maximum number of documents kept, by default
+      :data:`DEFAULT_MAX_ENTRIES`,
+    * ``MAX_BYTES``: maximum size of the documents kept, as JSON, by default
+      :data:`DEFAULT_MAX_BYTES`,
+    * ``TTL``: time, in seconds, during which a document is used without
+      any request, by default :data:`DEFAULT_TTL`,
+    * ``VALIDATE``: a ``bool``, if ``True`` the version of an expired
+      document returned by ``get`` is checked before fetching it again, by
+      default ``False``.
+
+    The documents are shared by the connections of the same alias in the
+    process (see :data:`document_caches`).
+    """
+    def __init__(self, backend, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                 validate=False):
+        super(HotDocumentInterceptor, self).__init__(backend)
+        self.documents = document_caches.get(backend.alias, max_entries,
+                                             max_bytes)
+        self.ttl = ttl
+        self.validate = validate
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('HOT_DOCUMENTS')
+
+        if not options:
+            return None
+
+        if options is True:
+            options = {}
+
+        return cls(backend,
+                   max_entries=options.get('MAX_ENTRIES',
+                                           DEFAULT_MAX_ENTRIES),
+                   max_bytes=options.get('MAX_BYTES', DEFAULT_MAX_BYTES),
+                   ttl=options.get('TTL', DEFAULT_TTL),
+                   validate=options.get('VALIDATE', False))
+
+    def intercept(self, query):
+        if query.method in CACHED_METHODS:
+            return self.get(query)
+
+        if query.method in WRITE_METHODS:
+            doc_id = query.arguments.get('doc_id')
+            try:
+                return query.proceed()
+            finally:
+                if doc_id is not None:
+                    document_caches.discard([str(doc_id)])
+
+        if query.method == 'bulk':
+            doc_ids = get_bulk_ids(query.arguments['body'])
+            try:
+                return query.proceed()
+            finally:
+                document_caches.discard(doc_ids)
+
+        if query.method == 'delete_by_query':
+            try:
+                return query.proceed()
+            finally:
+                document_caches.clear()
+
+        return query.proceed()
+
+    def get(self, query):
+        """Return the document of `query` from the cache, or fetch it."""
+        key = query.fingerprint()
+        entry = self.documents.get(key)
+
+        if entry is not None:
+            if time.monotonic() < entry.expires_at:
+                return json.loads(entry.data)
+            if entry.version is not None and self.is_valid(query, entry):
+                entry.expires_at = time.monotonic() + self.ttl
+                return json.loads(entry.data)
+
+        doc_id = str(query.arguments['doc_id'])
+        generation = self.documents.generation
+        try:
+            result = query.proceed()
+        except NotFoundError:
+            self.documents.discard(doc_id)
+            raise
+
+        version = None
+        if self.validate and query.method == 'get':
+            version = result.get('_version')
+
+        self.documents.set(key, Entry(doc_id, json.dumps(result),
+                                      time.monotonic() + self.ttl, version),
+                           generation)
+        return result
+
+    def is_valid(self, query, entry):
+        """Return ``True`` if the version of the document of `query` is still
+        the one of `entry`.
+
+        The version is fetched by a ``get`` query without the source, that
+        goes through the next interceptors.
+        """
+        arguments = query.arguments
+        check = query.copy()
+        check.args = ()
+        check.kwargs = dict(arguments, _source=False)
+        check.kwargs.pop('_source_include', None)
+        check.kwargs.pop('_source_exclude', None)
+        check.kwargs.pop('fields', None)
+
+        try:
+            result = check.proceed()
+        except NotFoundError:
+            return False
+
+        return result.get('_version') == entry.version
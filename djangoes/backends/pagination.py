@@ -0,0 +1,249 @@
+"""Cursor pagination of the hits of a search, with ``search_after``.
+
+A page of a search given by ``from`` and ``size`` costs more the deeper it
+is, as each shard sorts ``from + size`` hits, and it fails after
+``index.max_result_window`` hits. The ``paginate`` method of a backend (see
+:class:`CursorPaginator`) gives pages of hits after (or before) a cursor
+instead, with ``search_after``: each page costs the same, however deep it
+is::
+
+    paginator = connection.paginate(
+        body={'query': {'term': {'tag': 'sale'}}},
+        sort=[{'price': 'asc'}], tiebreaker='sku', per_page=20)
+    page = paginator.get_page(request.GET.get('page'))
+
+    for hit in page:
+        print(hit['_source']['name'])
+
+    if page.has_next():
+        next_url = '?page=%s' % page.next_page_number()
+
+The sort of the search always ends with a unique field, the tie-breaker, so
+two hits never have the same sort values. It is required: it must be a
+field of the documents with doc values, such as a keyword copy of their id.
+``_uid`` is deprecated by ElasticSearch 6 and removed by 7, and sorting on
+``_uid`` or ``_id`` loads them in the fielddata of the cluster.
+
+A cursor is an opaque token, signed with the ``SECRET_KEY`` setting, with
+the sort values of the first or last hit of a page, and a hash of the
+search: a cursor can not be forged, nor used with another search. A page
+has a cursor to the next page and one to the previous page, in place of the
+page numbers of Django's ``Paginator``: the templates written for it work
+the same, but there is no total number of pages.
+"""
+from collections.abc import Sequence
+import hashlib
+import json
+
+from django.core import signing
+from django.core.paginator import EmptyPage, InvalidPage
+
+
+#: Default number of hits of a page.
+DEFAULT_PER_PAGE = 20
+
+#: Salt of the signature of the cursors.
+CURSOR_SALT = 'djangoes.pagination.cursor'
+
+
+class InvalidCursor(InvalidPage):
+    """The cursor of a page is not valid: malformed, tampered with, or made
+    for another search."""
+
+
+def get_order(sort_field):
+    """Return ``(field, options)`` of a sort field of a search, where
+    ``options`` is a dict with at least the ``order``."""
+    if isinstance(sort_field, str):
+        field, options = sort_field, {}
+    else:
+        ((field, options),) = sort_field.items()
+        if isinstance(options, str):
+            options = {'order': options}
+
+    options = dict(options)
+    options.setdefault('order', 'desc' if field == '_score' else 'asc')
+    return field, options
+
+
+def get_sort(sort, tiebreaker):
+    """Return the `sort` of a search as a list of ``{field: options}``,
+    ending with `tiebreaker` if it is not sorted already."""
+    if isinstance(sort, (str, dict)):
+        sort = [sort]
+
+    fields = [get_order(sort_field) for sort_field in sort or ()]
+    if tiebreaker not in [field for field, _ in fields]:
+        fields.append(get_order(tiebreaker))
+
+    return [{field: options} for field, options in fields]
+
+
+def reverse_sort(sort):
+    """Return the sort `sort` (as given by :func:`get_sort`), in reverse."""
+    reverse = []
+    for sort_field in sort:
+        field, options = get_order(sort_field)
+        order = 'desc' if options['order'] == 'asc' else 'asc'
+        reverse.append({field: dict(options, order=order)})
+    return reverse
+
+
+class CursorPage(Sequence):
+    """A page of hits, like a page of Django's ``Paginator``.
+
+    Its :attr:`number` is its cursor, ``None`` for the first page, and the
+    "numbers" of the next and previous pages are their cursors.
+    """
+    def __init__(self, object_list, number, paginator, next_cursor=None,
+                 previous_cursor=None, response=None):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        #: Response of the search of the page.
+        self.response = response
+
+    def __repr__(self):
+        return '<CursorPage: %d hits>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        """Return the cursor of the next page."""
+        if self.next_cursor is None:
+            raise EmptyPage('That page contains no results')
+        return self.next_cursor
+
+    def previous_page_number(self):
+        """Return the cursor of the previous page."""
+        if self.previous_cursor is None:
+            raise EmptyPage('That page contains no results')
+        return self.previous_cursor
+
+
+class CursorPaginator(object):
+    """Paginator of the hits of a search of a backend, by cursors.
+
+    :param backend: the backend performing the searches
+    :param body: the body of the search, without ``from`` nor ``size``
+    :param per_page: the number of hits of a page
+    :param doc_type: the document type of the search
+    :param sort: the sort of the search, by default the one of its body,
+      else by ``_score``
+    :param tiebreaker: the unique field ending the sort, with doc values
+    :param kwargs: the other arguments of the ``search`` method
+
+    Each page is one search, of ``per_page + 1`` hits: the extra one tells
+    whether there is a page after it. A ``ValueError`` is raised without
+    `tiebreaker`.
+    """
+    def __init__(self, backend, body=None, per_page=DEFAULT_PER_PAGE,
+                 doc_type=None, sort=None, tiebreaker=None, **kwargs):
+        body = dict(body or {})
+        if 'from' in body or 'search_after' in body:
+            raise ValueError('The body of a cursor pagination can not have '
+                             'a "from" or a "search_after".')
+        if not tiebreaker:
+            raise ValueError('The tiebreaker of a cursor pagination is '
+                             'required: a unique field with doc values.')
+
+        self.backend = backend
+        self.per_page = per_page
+        self.doc_type = doc_type
+        self.sort = get_sort(sort or body.pop('sort', '_score'), tiebreaker)
+        body.pop('sort', None)
+        body.pop('size', None)
+        self.body = body
+        self.kwargs = kwargs
+
+    def fingerprint(self):
+        """Return a hash of the search, so a cursor can only be used with
+        the same search."""
+        canonical = json.dumps(
+            [self.backend.alias, self.doc_type, self.body, self.sort,
+             self.kwargs],
+            sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+    def encode_cursor(self, values, reverse=False):
+        """Return the signed cursor of the hits after (or, if `reverse` is
+        ``True``, before) the hit with the sort `values`."""
+        payload = {'v': values, 'q': self.fingerprint()}
+        if reverse:
+            payload['r'] = 1
+        return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        """Return ``(values, reverse)`` of a signed `cursor`, or raise
+        :class:`InvalidCursor`."""
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidCursor('That page cursor is not valid')
+
+        if payload.get('q') != self.fingerprint():
+            raise InvalidCursor('That page cursor is for another search')
+
+        return payload['v'], bool(payload.get('r'))
+
+    def validate_number(self, number):
+        """Return the sort values and the direction of the page `number`, a
+        cursor or ``None`` for the first page."""
+        if not number:
+            return None, False
+        return self.decode_cursor(number)
+
+    def page(self, number=None):
+        """Return the page of the cursor `number`, by default the first one.
+
+        An :class:`InvalidCursor` is raised if the cursor is not valid.
+        """
+        values, reverse = self.validate_number(number)
+
+        body = dict(self.body, size=self.per_page + 1,
+                    sort=reverse_sort(self.sort) if reverse else self.sort)
+        if values is not None:
+            body['search_after'] = values
+
+        response = self.backend.search(self.doc_type, body, **self.kwargs)
+        hits = response['hits']['hits']
+        more = len(hits) > self.per_page
+        hits = hits[:self.per_page]
+
+        if reverse:
+            hits.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, values is not None
+
+        next_cursor = previous_cursor = None
+        if hits and has_next:
+            next_cursor = self.encode_cursor(hits[-1]['sort'])
+        if hits and has_previous:
+            previous_cursor = self.encode_cursor(hits[0]['sort'], True)
+
+        return CursorPage(hits, number or None, self, next_cursor,
+                          previous_cursor, response)
+
+    def get_page(self, number=None):
+        """Return the page of the cursor `number`, or the first page if the
+        cursor is not valid, like ``Paginator.get_page``."""
+        try:
+            return self.page(number)
+        except InvalidCursor:
+            return self.page()
@@ -0,0 +1,235 @@
+"""Connection pooling for backends shared by all threads of a process.
+
+By default, each thread gets its own backend, hence its own client and its own
+``urllib3`` connection pool. This module provides a connection class whose
+pool can be safely shared by all the threads of a process:
+
+* the number of sockets opened to one host can be capped (``MAXSIZE`` and
+  ``BLOCK``),
+* sockets idle for too long are closed (``IDLE_TIMEOUT``),
+* the pool can report how full it is (see :meth:`PooledHttpConnection.stats`).
+"""
+import os
+import time
+
+import urllib3
+from elasticsearch.connection.http_urllib3 import Urllib3HttpConnection
+
+
+def open_sockets(pool, count):
+    """Open up to `count` keep-alive sockets in the ``urllib3`` `pool`.
+
+    Sockets are opened by borrowing connections from the pool, then given
+    back to the pool so they can be reused by the next requests. The pool
+    never keeps more than its maximum size, so `count` is capped to it.
+
+    Return the number of sockets opened.
+    """
+    count = min(count, pool.pool.maxsize or count)
+    borrowed = []
+    opened = 0
+
+    try:
+        for _ in range(count):
+            conn = pool._get_conn()
+            borrowed.append(conn)
+
+            if conn.sock is None:
+                conn.connect()
+                opened += 1
+    finally:
+        for conn in borrowed:
+            pool._put_conn(conn)
+
+    return opened
+
+
+def close_transport(transport, pid=None):
+    """Close the sockets of all the connections of `transport`.
+
+    The ``elasticsearch`` connection classes do not provide a ``close``
+    method: the ``urllib3`` pool (or the ``requests`` session) of each
+    connection is closed instead. Connections without any of them are
+    ignored.
+
+    If `pid` is given, the sockets are closed only in the process `pid` that
+    opened them: in a child process after a fork, they are still used by the
+    parent process.
+    """
+    if pid is not None and pid != os.getpid():
+        return
+
+    pool = transport.connection_pool
+    # Dead connections are not in ``connections`` anymore.
+    connections = set(pool.connections)
+    connections.update(getattr(pool, 'orig_connections', ()))
+
+    for connection in connections:
+        if hasattr(connection, 'close'):
+            connection.close()
+        elif hasattr(connection, 'pool'):
+            connection.pool.close()
+        elif hasattr(connection, 'session'):
+            connection.session.close()
+
+
+class ReapingPoolMixin(object):
+    """Mixin for ``urllib3`` pools that close their idle sockets.
+
+    Each time a socket is given back to the pool, the current time is stored
+    on its connection object. A socket idle for more than ``idle_timeout``
+    seconds is closed instead of being reused, and the whole pool is checked
+    for such sockets at most twice per ``idle_timeout``.
+
+    The slot of a closed socket is kept in the pool: ``urllib3`` will open a
+    new socket the next time this slot is used.
+    """
+    def __init__(self, *args, **kwargs):
+        self.idle_timeout = kwargs.pop('idle_timeout', None)
+        self.pool_timeout = kwargs.pop('pool_timeout', None)
+        self.maxsize = kwargs.get('maxsize', 1)
+        self.last_reap = time.monotonic()
+        super(ReapingPoolMixin, self).__init__(*args, **kwargs)
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.pool_timeout
+
+        conn = super(ReapingPoolMixin, self)._get_conn(timeout=timeout)
+
+        if self.is_idle(conn, time.monotonic()):
+            conn.close()
+
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.idle_since = time.monotonic()
+
+        super(ReapingPoolMixin, self)._put_conn(conn)
+        self.maybe_reap()
+
+    def is_idle(self, conn, now):
+        """Tell if `conn` has an open socket idle for too long."""
+        if not self.idle_timeout or conn is None or conn.sock is None:
+            return False
+
+        return now - getattr(conn, 'idle_since', now) > self.idle_timeout
+
+    def maybe_reap(self):
+        """Call :meth:`reap` if it has not been called for a while."""
+        if not self.idle_timeout:
+            return
+
+        if time.monotonic() - self.last_reap > self.idle_timeout / 2:
+            self.reap()
+
+    def reap(self):
+        """Close every socket idle for more than ``idle_timeout`` seconds.
+
+        Return the number of closed sockets.
+        """
+        now = self.last_reap = time.monotonic()
+        queue = self.pool
+
+        if queue is None:
+            # The pool is closed.
+            return 0
+
+        closed = 0
+        with queue.mutex:
+            for conn in queue.queue:
+                if self.is_idle(conn, now):
+                    conn.close()
+                    closed += 1
+
+        return closed
+
+    def stats(self):
+        """Return a dict describing how full the pool is.
+
+        * ``maxsize``: maximum number of sockets kept by the pool,
+        * ``in_use``: number of connections currently borrowed by threads,
+        * ``idle``: number of open sockets waiting in the pool,
+        * ``opened``: number of sockets opened since the pool was created,
+        * ``requests``: number of requests performed by the pool.
+        """
+        queue = self.pool
+        in_use = idle = 0
+
+        if queue is not None:
+            with queue.mutex:
+                in_use = self.maxsize - len(queue.queue)
+                idle = sum(1 for conn in queue.queue
+                           if conn is not None and conn.sock is not None)
+
+        return {
+            'maxsize': self.maxsize,
+            'in_use': in_use,
+            'idle': idle,
+            'opened': self.num_connections,
+            'requests': self.num_requests,
+        }
+
+
+class ReapingHTTPConnectionPool(ReapingPoolMixin, urllib3.HTTPConnectionPool):
+    """HTTP connection pool closing its idle sockets."""
+    pass
+
+
+class ReapingHTTPSConnectionPool(ReapingPoolMixin, urllib3.HTTPSConnectionPool):
+    """HTTPS connection pool closing its idle sockets."""
+    pass
+
+
+class PooledHttpConnection(Urllib3HttpConnection):
+    """``urllib3`` connection class with a thread-safe, bounded pool.
+
+    It accepts the same arguments as ``Urllib3HttpConnection``, and:
+
+    * ``block``: if ``True``, never open more than ``maxsize`` sockets to the
+      host, and make threads wait for a free socket instead,
+    * ``pool_timeout``: when ``block`` is ``True``, how long (in seconds) a
+      thread can wait for a free socket before an error is raised; it waits
+      forever by default,
+    * ``idle_timeout``: number of seconds after which an idle socket is
+      closed; idle sockets are never closed by default.
+    """
+    def __init__(self, host='localhost', port=9200, maxsize=10, block=False,
+                 pool_timeout=None, idle_timeout=None, **kwargs):
+        super(PooledHttpConnection, self).__init__(
+            host=host, port=port, maxsize=maxsize, **kwargs)
+
+        # Urllib3HttpConnection does not allow to choose its pool class, so
+        # its pool is replaced by an equivalent pool that can reap.
+        base_pool = self.pool
+        pool_kwargs = {
+            'timeout': base_pool.timeout,
+            'maxsize': maxsize,
+            'block': block,
+            'pool_timeout': pool_timeout,
+            'idle_timeout': idle_timeout,
+        }
+
+        if isinstance(base_pool, urllib3.HTTPSConnectionPool):
+            pool_class = ReapingHTTPSConnectionPool
+            pool_kwargs.update({
+                'ssl_version': base_pool.ssl_version,
+                'cert_reqs': base_pool.cert_reqs,
+                'ca_certs': base_pool.ca_certs,
+                'cert_file': base_pool.cert_file,
+            })
+        else:
+            pool_class = ReapingHTTPConnectionPool
+
+        self.pool = pool_class(base_pool.host, port=base_pool.port,
+                               **pool_kwargs)
+        base_pool.close()
+
+    def stats(self):
+        """Return the stats of the underlying pool."""
+        return self.pool.stats()
+
+    def reap(self):
+        """Close the idle sockets of the underlying pool."""
+        return self.pool.reap()
@@ -0,0 +1,157 @@
+"""Log of the last queries of each connection, like Django's queries log.
+
+When the query log of a connection is enabled, its backend keeps the last
+queries performed by the current thread in a bounded ring buffer, available
+as :attr:`~djangoes.backends.abstracts.Base.queries`. Each entry is a dict
+with:
+
+* ``alias``: the alias of the connection,
+* ``method``: the name of the backend's method,
+* ``indices``: the indices of the query,
+* ``body``: the JSON body of the query, truncated,
+* ``arguments``: the other arguments of the query (such as a document id),
+  as JSON, truncated,
+* ``took``: the ``took`` of the response, in milliseconds, if any,
+* ``time``: the duration of the query seen by the client, in milliseconds,
+* ``error``: the name of the exception raised by the query, or ``None``.
+
+The query log is configured by the ``QUERY_LOG`` option of the server. When it
+is not enabled, its interceptor is not even installed.
+"""
+from collections import deque
+import json
+from threading import local
+import time
+
+from django.conf import settings
+
+from .batching import LazyResult
+from .interceptors import Interceptor
+
+
+#: Default maximum number of queries kept by a connection, per thread.
+DEFAULT_QUERY_LOG_SIZE = 200
+
+#: Default maximum length of the bodies kept by the query log.
+DEFAULT_QUERY_LOG_BODY_LENGTH = 1000
+
+
+class QueryLog(local):
+    """Ring buffer of the last queries, for each thread."""
+    def __init__(self, size=DEFAULT_QUERY_LOG_SIZE):
+        self.entries = deque(maxlen=size)
+
+    def append(self, entry):
+        self.entries.append(entry)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def format_body(body, max_length):
+    """Return `body` as a JSON string of at most `max_length` characters."""
+    if body is None:
+        return None
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    elif not isinstance(body, str):
+        try:
+            body = json.dumps(body, default=str, sort_keys=True)
+        except (TypeError, ValueError):
+            body = repr(body)
+
+    if len(body) > max_length:
+        body = body[:max_length] + '...'
+
+    return body
+
+
+def get_took(result):
+    """Return the ``took`` of an ElasticSearch response, or the max one of a
+    msearch, if any.
+
+    The result of a query batched by a ``batch`` block is used only once it
+    is resolved: its ``mget`` or ``msearch`` request is logged on its own,
+    with the ``took`` of its response.
+    """
+    if isinstance(result, LazyResult):
+        if not result.resolved or result.error is not None:
+            return None
+        result = result.value
+
+    if not isinstance(result, dict):
+        return None
+
+    if 'took' in result:
+        return result['took']
+
+    tooks = [response.get('took')
+             for response in result.get('responses', ())
+             if isinstance(response, dict)]
+    tooks = [took for took in tooks if took is not None]
+
+    return max(tooks) if tooks else None
+
+
+class QueryLogInterceptor(Interceptor):
+    """Log each query into the backend's :class:`QueryLog`.
+
+    It is enabled by the ``QUERY_LOG`` option of the server, a dict with:
+
+    * ``ENABLED``: by default, the ``DEBUG`` setting,
+    * ``SIZE``: maximum number of queries kept per thread, by default
+      :data:`DEFAULT_QUERY_LOG_SIZE`,
+    * ``BODY_LENGTH``: maximum length of the bodies kept, by default
+      :data:`DEFAULT_QUERY_LOG_BODY_LENGTH`.
+    """
+    def __init__(self, backend, size=DEFAULT_QUERY_LOG_SIZE,
+                 body_length=DEFAULT_QUERY_LOG_BODY_LENGTH):
+        super(QueryLogInterceptor, self).__init__(backend)
+        self.body_length = body_length
+        backend.query_log = QueryLog(size)
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('QUERY_LOG', {})
+
+        if not options.get('ENABLED', settings.DEBUG):
+            return None
+
+        return cls(backend,
+                   size=options.get('SIZE', DEFAULT_QUERY_LOG_SIZE),
+                   body_length=options.get('BODY_LENGTH',
+                                           DEFAULT_QUERY_LOG_BODY_LENGTH))
+
+    def intercept(self, query):
+        result = None
+        error = None
+        start = time.perf_counter()
+
+        try:
+            result = query.proceed()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            arguments = query.arguments
+            body = arguments.pop('body', None)
+            self.backend.query_log.append({
+                'alias': query.alias,
+                'method': query.method,
+                'indices': (arguments.get('index') or
+                            self.backend.indices_param),
+                'body': format_body(body, self.body_length),
+                'arguments': format_body(arguments, self.body_length),
+                'took': get_took(result),
+                'time': duration,
+                'error': error.__class__.__name__ if error else None,
+            })
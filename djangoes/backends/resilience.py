@@ -0,0 +1,293 @@
+"""Retries with backoff, and circuit breakers, for degraded clusters.
+
+When a cluster is saturated, it answers with ``429`` errors or timeouts: the
+:class:`RetryInterceptor` performs the idempotent queries again, after an
+exponential backoff with jitter, within a total time budget, and the
+:class:`CircuitBreakerInterceptor` fails fast after too many failures in a
+row, so the threads of a process stop waiting for a cluster that can not
+answer.
+
+Both are opt-in, with the ``RETRY`` and ``BREAKER`` options of the server::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2'],
+            'RETRY': {
+                'MAX_RETRIES': 3,
+                'BACKOFF': 0.05,
+                'MAX_BACKOFF': 1,
+                'BUDGET': 2,
+            },
+            'BREAKER': {
+                'THRESHOLD': 5,
+                'COOLDOWN': 30,
+            },
+        }
+    }
+
+The circuit breaker is consulted before each try of a query, so the retries
+of a query stop as soon as its circuit opens. Only transient errors are
+retried, and counted as failures by the circuit breaker: the connection
+errors (including timeouts), and the errors whose status is in the
+``STATUSES`` option (by default :data:`DEFAULT_TRANSIENT_STATUSES`).
+"""
+import os
+import random
+from threading import Lock
+import time
+
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from elasticsearch.exceptions import TransportError
+
+from .interceptors import Interceptor
+
+
+#: Methods performed again by default, as doing so has no other effect.
+IDEMPOTENT_METHODS = frozenset([
+    'ping', 'info', 'get_script', 'get_template', 'mget', 'msearch',
+    'mpercolate', 'exists', 'get', 'get_source', 'search', 'search_shards',
+    'search_template', 'explain', 'count', 'suggest', 'percolate',
+    'count_percolate', 'mlt', 'termvector', 'mtermvectors',
+])
+
+#: Status of the errors that are retried by default.
+DEFAULT_TRANSIENT_STATUSES = frozenset([429, 502, 503, 504])
+
+
+class CircuitOpenError(ESConnectionError):
+    """Raised instead of performing a query while a circuit is open.
+
+    As a subclass of ``elasticsearch.exceptions.ConnectionError``, it is
+    handled as any connection error by the code performing the query.
+    """
+
+
+def is_transient(error, statuses=DEFAULT_TRANSIENT_STATUSES):
+    """Return ``True`` if `error` may not happen when trying again."""
+    if isinstance(error, ESConnectionError):
+        return True
+    return (isinstance(error, TransportError) and
+            error.status_code in statuses)
+
+
+class RetryInterceptor(Interceptor):
+    """Perform the idempotent queries again after a transient error.
+
+    It is enabled by the ``RETRY`` option of the server, a dict with:
+
+    * ``MAX_RETRIES``: maximum number of retries of a query, by default 3,
+    * ``BACKOFF``: base delay before the first retry, in seconds, by default
+      ``0.05``; it doubles after each retry,
+    * ``MAX_BACKOFF``: maximum delay before a retry, in seconds, by default 1,
+    * ``BUDGET``: maximum time spent on a query and its retries, in seconds,
+      by default 2; no retry starts once it is spent,
+    * ``METHODS``: the methods to retry, by default
+      :data:`IDEMPOTENT_METHODS`,
+    * ``STATUSES``: status of the errors to retry, by default
+      :data:`DEFAULT_TRANSIENT_STATUSES`.
+
+    The delay before each retry is random, from zero to the backoff ("full
+    jitter"), so the threads do not retry all at the same time.
+    """
+    def __init__(self, backend, max_retries=3, backoff=0.05, max_backoff=1,
+                 budget=2, methods=IDEMPOTENT_METHODS,
+                 statuses=DEFAULT_TRANSIENT_STATUSES):
+        super(RetryInterceptor, self).__init__(backend)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.methods = frozenset(methods)
+        self.statuses = frozenset(statuses)
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('RETRY')
+
+        if not options:
+            return None
+
+        return cls(backend,
+                   max_retries=options.get('MAX_RETRIES', 3),
+                   backoff=options.get('BACKOFF', 0.05),
+                   max_backoff=options.get('MAX_BACKOFF', 1),
+                   budget=options.get('BUDGET', 2),
+                   methods=options.get('METHODS', IDEMPOTENT_METHODS),
+                   statuses=options.get('STATUSES',
+                                        DEFAULT_TRANSIENT_STATUSES))
+
+    def get_delay(self, retry):
+        """Return the delay before the `retry`-th retry (from 0)."""
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def intercept(self, query):
+        if query.method not in self.methods:
+            return query.proceed()
+
+        deadline = time.monotonic() + self.budget
+        retry = 0
+
+        while True:
+            try:
+                return query.proceed()
+            except Exception as e:  #pylint: disable=broad-except
+                if (retry >= self.max_retries or
+                        isinstance(e, CircuitOpenError) or
+                        not is_transient(e, self.statuses)):
+                    raise
+
+                delay = self.get_delay(retry)
+                if time.monotonic() + delay >= deadline:
+                    raise
+
+            time.sleep(delay)
+            retry += 1
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of one alias, shared by the threads of a process.
+
+    The circuit opens after `threshold` failures in a row. While it is open,
+    queries are not allowed; after `cooldown` seconds, one query is allowed
+    to try the cluster again (the circuit is "half-open"): its success
+    closes the circuit, and its failure opens it again for `cooldown`
+    seconds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        """State of the circuit: closed, open or half-open."""
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """Return ``True`` if a query can be performed."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        """Record a successful query, that closes the circuit."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        """Record a failed query, that may open the circuit."""
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class BreakerRegistry(object):
+    """Thread-safe registry of the circuit breaker of each alias."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all the circuit breakers."""
+        self._lock = Lock()
+        self._breakers = {}
+
+    def get(self, alias, threshold, cooldown):
+        """Return the circuit breaker of `alias`, created if necessary.
+
+        Its `threshold` and `cooldown` are updated, in case the settings have
+        changed since it was created.
+        """
+        with self._lock:
+            breaker = self._breakers.get(alias)
+            if breaker is None:
+                breaker = self._breakers[alias] = CircuitBreaker()
+            breaker.threshold = threshold
+            breaker.cooldown = cooldown
+            return breaker
+
+
+breakers = BreakerRegistry()  #pylint: disable=invalid-name
+
+if hasattr(os, 'register_at_fork'):
+    # Each process has its own circuits.
+    os.register_at_fork(after_in_child=breakers.reset)
+
+
+class CircuitBreakerInterceptor(Interceptor):
+    """Fail fast with :class:`CircuitOpenError` while the circuit is open.
+
+    It is enabled by the ``BREAKER`` option of the server, a dict with:
+
+    * ``THRESHOLD``: number of failed queries in a row that open the circuit,
+      by default 5,
+    * ``COOLDOWN``: time during which the circuit stays open, in seconds, by
+      default 30,
+    * ``STATUSES``: status of the errors counted as failures, by default
+      :data:`DEFAULT_TRANSIENT_STATUSES`.
+
+    The circuit is shared by all the connections of the same alias in the
+    process (see :data:`breakers`).
+    """
+    def __init__(self, backend, threshold=5, cooldown=30,
+                 statuses=DEFAULT_TRANSIENT_STATUSES):
+        super(CircuitBreakerInterceptor, self).__init__(backend)
+        self.breaker = breakers.get(backend.alias, threshold, cooldown)
+        self.statuses = frozenset(statuses)
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('BREAKER')
+
+        if not options:
+            return None
+
+        return cls(backend,
+                   threshold=options.get('THRESHOLD', 5),
+                   cooldown=options.get('COOLDOWN', 30),
+                   statuses=options.get('STATUSES',
+                                        DEFAULT_TRANSIENT_STATUSES))
+
+    def intercept(self, query):
+        breaker = self.breaker
+
+        if not breaker.allow():
+            raise CircuitOpenError(
+                'N/A', 'Circuit open for connection %r' % query.alias)
+
+        failed = True
+        try:
+            result = query.proceed()
+            failed = False
+        except Exception as e:
+            failed = is_transient(e, self.statuses)
+            raise
+        finally:
+            # An interrupted query (a BaseException) is a failure too, so a
+            # half-open circuit never stays on a trial that won't end.
+            if failed:
+                breaker.failure()
+            else:
+                breaker.success()
+
+        return result
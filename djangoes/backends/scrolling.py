@@ -0,0 +1,295 @@
+"""Iteration over all the hits of a query, with the scroll API.
+
+A ``search`` returns one page of hits, and deep pages are expensive. The
+``scan`` method of a backend (see :func:`scan`) gives all the hits of a
+query on the indices of the connection, fetched page by page with a scroll
+context, so only one page is kept in memory at a time::
+
+    for hit in connection.scan(body={'query': {'term': {'tag': 'sale'}}},
+                               size=500, _source_include=['name']):
+        print(hit['_id'], hit['_source']['name'])
+
+The scroll context is cleared as soon as the iteration stops: when all the
+hits are given, on error, or when the consumer stops early (the generator is
+then closed, explicitly or when it is garbage collected).
+
+A single scroll fetches one page at a time. The ``sliced_scan`` method (see
+:func:`sliced_scan`) splits the shards of the indices into slices, each one
+scanned by its own worker thread or process, and gives all their hits as
+they come::
+
+    for hit in connection.sliced_scan(body=query, slices=8):
+        export(hit)
+
+Each worker, thread or process, uses its own connection, configured as the
+one of the caller (the same backend class, server and indices): like the
+connections of :data:`djangoes.connections`, a backend is used by one thread
+only, unless it is ``SHARED``. The worker processes are forked by default
+(see :func:`~djangoes.backends.bulk.get_mp_context`).
+
+The ``scan_slices`` method (see :func:`scan_slices`) gives the iterator of
+each slice instead, to consume them in any other way.
+"""
+from concurrent import futures
+import logging
+from queue import Empty, Full, Queue
+from threading import Event
+
+from elasticsearch.helpers import ScanError
+
+from .bulk import get_mp_context, iter_batches, setup_worker
+
+
+logger = logging.getLogger('djangoes.scroll')  #pylint: disable=invalid-name
+
+#: Default number of hits of each page.
+DEFAULT_SCAN_SIZE = 1000
+
+#: Default time during which the scroll context is kept between two pages.
+DEFAULT_SCROLL = '5m'
+
+#: Default maximum number of pages of hits waiting to be consumed by a sliced
+#: scan.
+DEFAULT_SLICED_QUEUE_SIZE = 8
+
+#: Time, in seconds, between two checks of the stop event by a blocked worker.
+STOP_POLL_INTERVAL = 0.1
+
+
+def scan(backend, doc_type=None, body=None, size=DEFAULT_SCAN_SIZE,
+         scroll=DEFAULT_SCROLL, preserve_order=False, raise_on_error=True,
+         **kwargs):
+    """Yield all the hits of the search `body` of `backend`, fetched by pages
+    of `size` hits with the scroll API.
+
+    By default, the hits are sorted by ``_doc``, the cheapest order for the
+    cluster, replacing the ``sort`` of the search (the ``scan`` search type
+    does not exist anymore since ElasticSearch 5). With `preserve_order`, the
+    hits are given in the order of the search, which is more expensive.
+
+    If `raise_on_error` is ``True``, a ``ScanError`` is raised after a page
+    that failed on some shards. The `scroll` context is cleared once the
+    iteration stops, for whatever reason. The other keyword arguments are
+    given to the ``search`` method of the backend, such as ``_source``,
+    ``_source_include`` or ``_source_exclude`` to filter the source of the
+    hits.
+    """
+    if not preserve_order:
+        body = dict(body or {}, sort=['_doc'])
+
+    response = backend.search(doc_type, body, scroll=scroll, size=size,
+                              **kwargs)
+    scroll_id = response.get('_scroll_id')
+
+    try:
+        first = True
+        while scroll_id is not None:
+            if not first:
+                response = backend.scroll(scroll_id, scroll=scroll)
+                scroll_id = response.get('_scroll_id', scroll_id)
+            first = False
+
+            hits = response['hits']['hits']
+            yield from hits
+
+            check_shards(response, raise_on_error)
+
+            if not hits:
+                break
+    finally:
+        if scroll_id is not None:
+            clear_scroll(backend, scroll_id)
+
+
+def check_shards(response, raise_on_error=True):
+    """Log the failed shards of a scroll `response`, if any, and raise a
+    ``ScanError`` if `raise_on_error` is ``True``."""
+    shards = response['_shards']
+    if not shards['failed']:
+        return
+
+    message = 'Scroll request has failed on %d shards out of %d.' % (
+        shards['failed'], shards['total'])
+    logger.warning(message)
+    if raise_on_error:
+        raise ScanError(message)
+
+
+def clear_scroll(backend, scroll_id):
+    """Clear the scroll context `scroll_id` of `backend`.
+
+    The error of the request is logged, not raised: the context expires
+    anyway after its keep-alive.
+    """
+    try:
+        backend.clear_scroll(scroll_id, ignore=(404,))
+    except Exception:  #pylint: disable=broad-except
+        logger.exception('Unable to clear the scroll context of %s',
+                         backend.alias)
+
+
+def get_slices(backend, slices=None, **kwargs):
+    """Return the ``preference`` of each slice of a sliced scan of `backend`.
+
+    The shards of the indices are split between `slices` slices, by default
+    one per shard, with ``_shards:`` preferences (such as ``_shards:0,2``).
+    The other keyword arguments are given to the ``search_shards`` method of
+    the backend, such as ``routing``.
+    """
+    response = backend.search_shards(**kwargs)
+    numbers = sorted({copy['shard']
+                      for copies in response['shards']
+                      for copy in copies})
+    count = min(slices or len(numbers), len(numbers))
+
+    return ['_shards:%s' % ','.join(str(number)
+                                    for number in numbers[start::count])
+            for start in range(count)]
+
+
+def scan_slices(backend, doc_type=None, body=None, slices=None, **kwargs):
+    """Return one :func:`scan` iterator per slice of the search `body` of
+    `backend` (see :func:`get_slices`).
+
+    Each iterator has its own scroll context, and can be consumed by another
+    thread. The keyword arguments are given to :func:`scan`.
+    """
+    if 'preference' in kwargs:
+        raise ValueError('The preference of a sliced scan is its slice.')
+
+    return [scan(backend, doc_type, body, preference=preference, **kwargs)
+            for preference in get_slices(backend, slices)]
+
+
+def put(queue, item, stop):
+    """Put `item` in `queue`, waiting for a free slot unless `stop` is set.
+
+    Return ``False`` if `stop` has been set before.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=STOP_POLL_INTERVAL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def export_slice(backend, queue, stop, doc_type, body, preference, kwargs):
+    """Scan the slice `preference` of the search `body` of `backend`, and
+    put its hits in `queue`, one page at a time.
+
+    It is performed by the workers of :func:`sliced_scan`, that stop as soon
+    as the `stop` event is set: then the scroll context is cleared.
+    """
+    try:
+        hits = scan(backend, doc_type, body, preference=preference, **kwargs)
+        try:
+            for page in iter_batches(hits, kwargs['size']):
+                if not put(queue, ('hits', page), stop):
+                    return
+        finally:
+            hits.close()
+    except Exception as e:  #pylint: disable=broad-except
+        put(queue, ('error', e), stop)
+    else:
+        put(queue, ('done', None), stop)
+
+
+def get_config(backend):
+    """Return the configuration of `backend` given to the workers of
+    :func:`sliced_scan`: its class, alias, server and indices.
+
+    The read-only views of the settings are copied into dicts, so the
+    configuration can be pickled for the worker processes.
+    """
+    server_indices = {alias: dict(index)
+                      for alias, index in backend.server_indices.items()}
+    return (backend.__class__, backend.alias, dict(backend.server),
+            server_indices)
+
+
+def export_slice_from_worker(config, queue, stop, doc_type, body,
+                             preference, kwargs):
+    """Call :func:`export_slice` with a new connection built from `config`
+    (see :func:`get_config`), closed once the slice is done."""
+    backend_class, alias, server, server_indices = config
+    conn = backend_class(alias, server, server_indices)
+    conn.configure_client()
+
+    try:
+        export_slice(conn, queue, stop, doc_type, body, preference, kwargs)
+    finally:
+        conn.close()
+
+
+def sliced_scan(backend, doc_type=None, body=None, slices=None, workers=None,
+                processes=False, queue_size=DEFAULT_SLICED_QUEUE_SIZE,
+                size=DEFAULT_SCAN_SIZE, scroll=DEFAULT_SCROLL,
+                raise_on_error=True, mp_context=None, **kwargs):
+    """Yield all the hits of the search `body` of `backend`, scanned by
+    `slices` slices concurrently (see :func:`get_slices`).
+
+    Each slice is scanned by one of `workers` worker threads (by default one
+    per slice), or with `processes` by worker processes started by
+    `mp_context` (see :func:`~djangoes.backends.bulk.get_mp_context`). Each
+    worker uses its own connection configured as `backend` (see
+    :func:`get_config`), so its configuration must be picklable for the
+    processes. The hits of all the slices are given as they come, in no
+    particular order.
+
+    At most `queue_size` pages of hits wait to be consumed: the workers wait
+    for the consumer before fetching more. When the iteration stops, for
+    whatever reason, the workers stop, and their scroll contexts are
+    cleared. The error of a slice is raised by the iterator.
+    """
+    if 'preference' in kwargs:
+        raise ValueError('The preference of a sliced scan is its slice.')
+
+    preferences = get_slices(backend, slices)
+    kwargs.update(size=size, scroll=scroll, raise_on_error=raise_on_error)
+    workers = workers or len(preferences)
+
+    if processes:
+        mp_context = get_mp_context(mp_context)
+        manager = mp_context.Manager()
+        queue, stop = manager.Queue(queue_size), manager.Event()
+        executor = futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp_context,
+            initializer=setup_worker,
+            initargs=(mp_context.get_start_method(),))
+    else:
+        manager = None
+        queue, stop = Queue(queue_size), Event()
+        executor = futures.ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='djangoes-scan-%s' % backend.alias)
+
+    try:
+        config = get_config(backend)
+        tasks = [executor.submit(export_slice_from_worker, config, queue,
+                                 stop, doc_type, body, preference, kwargs)
+                 for preference in preferences]
+
+        remaining = len(preferences)
+        while remaining:
+            try:
+                kind, value = queue.get(timeout=STOP_POLL_INTERVAL)
+            except Empty:
+                # A worker may have failed before it could tell.
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                continue
+
+            if kind == 'hits':
+                yield from value
+            elif kind == 'done':
+                remaining -= 1
+            else:
+                raise value
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+        if manager is not None:
+            manager.shutdown()
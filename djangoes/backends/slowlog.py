@@ -0,0 +1,144 @@
+"""Client-side slow query log.
+
+When the ``SLOW_QUERY_MS`` option of a server is set, the searches of its
+connection slower than this threshold (in milliseconds, as seen by the client)
+are logged by the ``djangoes.slow_queries`` logger, with:
+
+* ``alias``: the alias of the connection,
+* ``method``: the name of the backend's method,
+* ``indices``: the indices of the connection,
+* ``body``: the body of the query,
+* ``took``: the ``took`` of the response, in milliseconds, if any,
+* ``time``: the duration of the query seen by the client, in milliseconds,
+* ``overhead``: the difference between ``time`` and ``took`` (network,
+  serialization, queueing, etc.), if ``took`` is known,
+* ``profile``: the profile of the query, if the query has been profiled,
+* ``error``: the name of the exception raised by the query, if it failed.
+
+A query that fails, such as on a timeout, is logged as well if it fails after
+the threshold: it has no ``took``, and it is never profiled.
+
+With the ``SLOW_QUERY_PROFILE`` option, a fraction of the slow ``search``
+queries are performed again with ``"profile": true``, so the log gives how
+ElasticSearch spent its time. Only ``search`` queries are profiled: the other
+methods do not support profiling, or they must not be run twice.
+
+The log record has the entry as its ``slow_query`` attribute.
+"""
+import json
+import logging
+import random
+import time
+
+from .interceptors import Interceptor
+from .querylog import get_took
+
+
+#pylint: disable=invalid-name
+logger = logging.getLogger('djangoes.slow_queries')
+
+#: Methods whose queries may be logged as slow queries.
+SLOW_QUERY_METHODS = frozenset([
+    'search', 'msearch', 'count', 'delete_by_query',
+])
+
+#: Methods whose slow queries may be performed again to be profiled.
+PROFILED_METHODS = frozenset(['search'])
+
+
+class SlowQueryInterceptor(Interceptor):
+    """Log the queries slower than the server's ``SLOW_QUERY_MS`` option.
+
+    `profile_rate` is the fraction (from ``0`` to ``1``) of the slow queries
+    to perform again with the profile API, given by the server's
+    ``SLOW_QUERY_PROFILE`` option. By default, no query is profiled.
+    """
+    def __init__(self, backend, threshold, profile_rate=0):
+        super(SlowQueryInterceptor, self).__init__(backend)
+        self.threshold = threshold
+        self.profile_rate = profile_rate
+
+    @classmethod
+    def from_backend(cls, backend):
+        threshold = backend.server.get('SLOW_QUERY_MS')
+
+        if threshold is None:
+            return None
+
+        return cls(backend, threshold,
+                   backend.server.get('SLOW_QUERY_PROFILE', 0))
+
+    def intercept(self, query):
+        if query.method not in SLOW_QUERY_METHODS:
+            return query.proceed()
+
+        start = time.perf_counter()
+        result = error = None
+        try:
+            result = query.proceed()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+
+            if duration >= self.threshold:
+                self.log(query, result, duration, error)
+
+        return result
+
+    def log(self, query, result, duration, error=None):
+        """Log the slow `query`, that returned `result` in `duration` ms, or
+        that raised `error`."""
+        arguments = query.arguments
+        took = get_took(result)
+        entry = {
+            'alias': query.alias,
+            'method': query.method,
+            'indices': list(self.backend.indices),
+            'body': arguments.get('body'),
+            'took': took,
+            'time': duration,
+            'overhead': duration - took if took is not None else None,
+            'profile': None,
+            'error': type(error).__name__ if error is not None else None,
+        }
+
+        if error is not None:
+            logger.warning('Slow query %s.%s on %s: failed after %.1f ms '
+                           '(%s): %s', entry['alias'], entry['method'],
+                           ','.join(entry['indices']), duration,
+                           entry['error'], entry['body'],
+                           extra={'slow_query': entry})
+            return
+
+        if (query.method in PROFILED_METHODS and
+                self.profile_rate and
+                random.random() < self.profile_rate):
+            entry['profile'] = self.profile(query, arguments)
+
+        logger.warning('Slow query %s.%s on %s: %.1f ms (took %s ms): %s',
+                       entry['alias'], entry['method'],
+                       ','.join(entry['indices']), duration, took,
+                       entry['body'], extra={'slow_query': entry})
+
+    def profile(self, query, arguments):
+        """Perform `query` again with the profile API, and return its profile.
+
+        The query is performed without going through the interceptors. If it
+        fails, the error is logged instead of being raised.
+        """
+        body = arguments.get('body') or {}
+        arguments = dict(arguments)
+
+        try:
+            if isinstance(body, (str, bytes)):
+                body = json.loads(body)
+            arguments['body'] = dict(body, profile=True)
+            result = query.func(query.backend, **arguments)
+        except Exception:  #pylint: disable=broad-except
+            logger.exception('Unable to profile slow query %s.%s',
+                             query.alias, query.method)
+            return None
+
+        return result.get('profile') if isinstance(result, dict) else None
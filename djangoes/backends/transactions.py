@@ -0,0 +1,216 @@
+"""Writes deferred until the commit of the database transaction.
+
+A document indexed in a ``transaction.atomic()`` block is visible in
+ElasticSearch at once, even if the transaction is rolled back afterward, and
+each write of the block is a request. With the ``ON_COMMIT`` option of a
+server, the ``index``, ``create``, ``update`` and ``delete`` queries of its
+connections performed in an atomic block are not performed at once: they are
+sent together, as one ``bulk`` request, when the transaction is committed::
+
+    ES_SERVERS = {
+        'default': {
+            'HOSTS': ['host_1', 'host_2'],
+            'INDICES': ['catalog'],
+            'ON_COMMIT': {
+                'DATABASE': 'default',
+            },
+        }
+    }
+
+    with transaction.atomic():
+        product.save()
+        connection.index('product', product.to_document(), product.pk)
+
+The writes of a rolled back transaction, or of a rolled back savepoint, are
+never sent. Outside of an atomic block, the writes are performed at once, as
+usual.
+
+The deferred writes of a thread are sent by a single callback registered
+with ``transaction.on_commit``, kept after the other callbacks of the
+transaction. The writes of a savepoint are tracked by a callback registered
+in this savepoint: Django drops it when the savepoint is rolled back, so
+the writes of the savepoint are dropped too. The writes of a rolled back
+transaction are dropped by a hook on the ``rollback`` method of the database
+connection (see :func:`on_rollback`), as Django has no rollback signal.
+
+.. warning::
+
+    Django provides no API to follow the savepoints of a transaction, so
+    this module relies on private attributes of the database connection:
+    the ``run_on_commit`` list of the callbacks of ``on_commit`` (its
+    entries are moved, not changed), and the ``savepoint_ids`` list of the
+    savepoints of the atomic blocks. They are the same from Django 2.2 to
+    5.2, the versions supported by djangoes and tested with ``tox``.
+
+A deferred write returns ``None`` instead of the response of its request,
+and its error is logged by the ``djangoes.writes`` logger, as it can not be
+raised to the caller. The writes with other arguments than the metadata of a
+bulk action (see :func:`~djangoes.backends.buffering.get_operation`) are
+performed at once.
+"""
+from functools import partial
+from threading import local
+import weakref
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .buffering import WRITE_METHODS, get_errors, get_operation, logger
+from .interceptors import Interceptor
+
+
+def on_rollback(connection, hook):
+    """Call `hook` after each rollback of the transaction of the database
+    `connection`, as long as it is alive: it must be a bound method.
+
+    The ``rollback`` method of the connection is wrapped the first time.
+    The rollback of a savepoint does not call `hook`.
+    """
+    hooks = connection.__dict__.get('djangoes_rollback_hooks')
+
+    if hooks is None:
+        hooks = connection.djangoes_rollback_hooks = []
+        rollback = connection.rollback
+
+        def rollback_and_call_hooks():
+            rollback()
+            for ref in list(hooks):
+                method = ref()
+                if method is None:
+                    hooks.remove(ref)
+                else:
+                    method()
+
+        connection.rollback = rollback_and_call_hooks
+
+    ref = weakref.WeakMethod(hook)
+    if ref not in hooks:
+        hooks.append(ref)
+
+
+class PendingWrites(local):
+    """Writes of a thread waiting for the commit of its transaction."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the pending writes."""
+        # Operations, with the innermost savepoint of their atomic block.
+        self.operations = []
+        # Whether the savepoints of the operations are committed, by id.
+        self.savepoints = {}
+        # Callback of the flush in the ``run_on_commit`` list of the
+        # database connection.
+        self.callback = None
+
+
+class OnCommitInterceptor(Interceptor):
+    """Defer the writes performed in an atomic block until its commit.
+
+    It is enabled by the ``ON_COMMIT`` option of the server: either
+    ``True``, or a dict with the ``DATABASE`` key, the alias of the database
+    whose transactions are followed, by default ``default``.
+    """
+    def __init__(self, backend, using=DEFAULT_DB_ALIAS):
+        super(OnCommitInterceptor, self).__init__(backend)
+        self.using = using
+        self.pending = PendingWrites()
+
+    @classmethod
+    def from_backend(cls, backend):
+        options = backend.server.get('ON_COMMIT')
+
+        if not options:
+            return None
+
+        if options is True:
+            options = {}
+
+        return cls(backend, using=options.get('DATABASE', DEFAULT_DB_ALIAS))
+
+    def intercept(self, query):
+        connection = transaction.get_connection(self.using)
+        if (query.method not in WRITE_METHODS or
+                not connection.in_atomic_block):
+            return query.proceed()
+
+        operation = get_operation(query)
+        if operation is None:
+            return query.proceed()
+
+        self.defer(connection, operation)
+        return None
+
+    def defer(self, connection, operation):
+        """Add `operation` to the writes waiting for the commit of the
+        transaction of the database `connection`.
+
+        A single flush is registered for the transaction, by its first
+        write. If it is dropped by the rollback of a savepoint, so are all
+        the writes registered after it: the next write registers a new one.
+        It is moved after the callbacks registered since, so it runs once
+        the savepoints of all the writes are known to be committed.
+        """
+        pending = self.pending
+        if pending.callback not in connection.run_on_commit:
+            # The savepoint of the first pending write was rolled back.
+            pending.reset()
+
+        sid = None
+        for savepoint_id in reversed(connection.savepoint_ids):
+            if savepoint_id is not None:
+                sid = savepoint_id
+                break
+
+        if sid is not None and sid not in pending.savepoints:
+            pending.savepoints[sid] = False
+            transaction.on_commit(partial(self.commit, sid),
+                                  using=self.using)
+
+        pending.operations.append((sid, operation))
+
+        if pending.callback is None:
+            on_rollback(connection, self.rollback)
+            transaction.on_commit(self.flush, using=self.using)
+            pending.callback = connection.run_on_commit[-1]
+        else:
+            connection.run_on_commit.remove(pending.callback)
+            connection.run_on_commit.append(pending.callback)
+
+    def commit(self, sid):
+        """Mark the savepoint `sid` as committed with its transaction."""
+        self.pending.savepoints[sid] = True
+
+    def rollback(self):
+        """Drop the pending writes of the rolled back transaction."""
+        self.pending.reset()
+
+    def flush(self):
+        """Send the committed operations as one ``bulk`` request: the ones
+        of the rolled back savepoints are dropped.
+
+        The error of the request is logged, not raised: the transaction is
+        already committed.
+        """
+        pending = self.pending
+        operations = [operation for sid, operation in pending.operations
+                      if sid is None or pending.savepoints[sid]]
+        pending.reset()
+        if not operations:
+            return
+
+        body = []
+        for operation in operations:
+            body.extend(operation.get_lines())
+
+        try:
+            response = self.backend.bulk(body)
+        except Exception:  #pylint: disable=broad-except
+            logger.exception('Unable to send the %d committed writes of %s',
+                             len(operations), self.backend.alias)
+            return
+
+        errors = get_errors(response)
+        if errors:
+            logger.warning('%d of %d committed writes of %s failed',
+                           len(errors), len(operations), self.backend.alias,
+                           extra={'errors': errors})
@@ -0,0 +1,266 @@
+"""Transport measuring the data sent to and received from ElasticSearch.
+
+The :class:`MeasuredTransport` counts the size of each serialized request body
+and of each raw response, and adds them to the :class:`Transfer` of the
+current context, if any. A caller measures its queries with
+:func:`measure_transfer`::
+
+   with measure_transfer() as transfer:
+       backend.search(body=body)
+
+   print(transfer.sent, transfer.received)
+
+The current transfer is stored in a context variable: it works in threads
+and in asynchronous tasks alike.
+
+The transport also tells which connection (which host) performed the
+requests of a context, and it can avoid some connections, with
+:func:`choose_connection`: this is how a hedged request is sent to another
+host (see :mod:`djangoes.backends.hedging`). The requests of a context can be
+aborted from another thread, with :meth:`ConnectionChoice.abort`: the socket
+of a ``urllib3`` request waiting for its response is then shut down.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import random
+import socket
+from threading import Lock
+
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch.transport import Transport
+
+
+_current_transfer = ContextVar('djangoes_transfer', default=None)
+_current_choice = ContextVar('djangoes_connection_choice', default=None)
+
+
+class Transfer(object):
+    """Number of bytes sent and received."""
+    __slots__ = ('sent', 'received')
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+
+
+@contextmanager
+def measure_transfer():
+    """Measure the data transferred in the block, and yield a Transfer."""
+    transfer = Transfer()
+    token = _current_transfer.set(transfer)
+    try:
+        yield transfer
+    finally:
+        _current_transfer.reset(token)
+
+
+def current_transfer():
+    """Return the :class:`Transfer` of the current context, or ``None``."""
+    return _current_transfer.get()
+
+
+class RequestAborted(ConnectionError):
+    """The request has been aborted by :meth:`ConnectionChoice.abort`."""
+
+
+class ConnectionChoice(object):
+    """Connections to avoid, and the last connection used.
+
+    Its requests can be aborted from another thread by :meth:`abort`.
+    """
+    __slots__ = ('excluded', 'used', 'aborted', 'interrupt', 'lock')
+
+    def __init__(self, excluded=()):
+        self.excluded = frozenset(excluded)
+        self.used = None
+        self.aborted = False
+        self.interrupt = None
+        self.lock = Lock()
+
+    def abort(self):
+        """Abort the request waiting for its response, if any, and the next
+        requests of the context, that raise :class:`RequestAborted`."""
+        with self.lock:
+            self.aborted = True
+            if self.interrupt is not None:
+                self.interrupt()
+
+
+@contextmanager
+def choose_connection(excluded=()):
+    """Avoid the `excluded` connections in the block, and yield a
+    :class:`ConnectionChoice` with the last connection used."""
+    choice = ConnectionChoice(excluded)
+    token = _current_choice.set(choice)
+    try:
+        yield choice
+    finally:
+        _current_choice.reset(token)
+
+
+@contextmanager
+def interruptible(interrupt):
+    """Call `interrupt` if the requests of the current context are aborted
+    during the block (see :meth:`ConnectionChoice.abort`).
+
+    :class:`RequestAborted` is raised if they are aborted already.
+    """
+    choice = _current_choice.get()
+
+    if choice is None:
+        yield
+        return
+
+    with choice.lock:
+        if choice.aborted:
+            raise RequestAborted('N/A', 'The request has been aborted.', None)
+        choice.interrupt = interrupt
+    try:
+        yield
+    finally:
+        # Once the block is done, the socket may be used by another request.
+        with choice.lock:
+            choice.interrupt = None
+
+
+def shutdown(sock):
+    """Shut down `sock`, so a thread waiting on it returns at once."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class InterruptibleConnectionMixin(object):
+    """Mixin for ``urllib3`` connections, whose wait for a response can be
+    interrupted by :meth:`ConnectionChoice.abort`."""
+    def getresponse(self, *args, **kwargs):
+        #pylint: disable=no-member
+        with interruptible(lambda: shutdown(self.sock)):
+            return super(InterruptibleConnectionMixin, self).getresponse(
+                *args, **kwargs)
+
+
+_INTERRUPTIBLE_CLASSES = {}
+
+
+def make_interruptible(connection):
+    """Make the requests of `connection` interruptible, if it is based on a
+    ``urllib3`` pool. The other connections are ignored."""
+    pool = getattr(connection, 'pool', None)
+    connection_cls = getattr(pool, 'ConnectionCls', None)
+
+    if (connection_cls is None or
+            issubclass(connection_cls, InterruptibleConnectionMixin)):
+        return
+
+    try:
+        interruptible_cls = _INTERRUPTIBLE_CLASSES[connection_cls]
+    except KeyError:
+        interruptible_cls = _INTERRUPTIBLE_CLASSES[connection_cls] = type(
+            'Interruptible%s' % connection_cls.__name__,
+            (InterruptibleConnectionMixin, connection_cls), {})
+
+    pool.ConnectionCls = interruptible_cls
+
+
+def get_size(data):
+    """Return the size, in bytes, of `data` encoded in UTF-8."""
+    if isinstance(data, str):
+        if data.isascii():
+            return len(data)
+        return len(data.encode('utf-8'))
+    return len(data)
+
+
+class MeasuredSerializer(object):
+    """Serializer counting the size of the serialized data."""
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.mimetype = serializer.mimetype
+
+    def loads(self, s):
+        return self.serializer.loads(s)
+
+    def dumps(self, data):
+        data = self.serializer.dumps(data)
+        transfer = _current_transfer.get()
+        if transfer is not None and data is not None:
+            transfer.sent += get_size(data)
+        return data
+
+
+class MeasuredDeserializer(object):
+    """Deserializer counting the size of the raw data."""
+    def __init__(self, deserializer):
+        self.deserializer = deserializer
+
+    def loads(self, s, mimetype=None):
+        transfer = _current_transfer.get()
+        if transfer is not None:
+            transfer.received += get_size(s)
+        return self.deserializer.loads(s, mimetype)
+
+
+class MeasuredTransport(Transport):
+    """Transport counting the data transferred by the current context.
+
+    See :func:`measure_transfer` and :func:`choose_connection`.
+    """
+    #: Whether the connections are made interruptible, see
+    #: :meth:`set_interruptible`.
+    interruptible = False
+
+    def __init__(self, *args, **kwargs):
+        super(MeasuredTransport, self).__init__(*args, **kwargs)
+        self.serializer = MeasuredSerializer(self.serializer)
+        self.deserializer = MeasuredDeserializer(self.deserializer)
+
+    def set_interruptible(self):
+        """Make the requests of the connections interruptible, including the
+        connections set later (after a sniff)."""
+        self.interruptible = True
+        for connection in self.connection_pool.connections:
+            make_interruptible(connection)
+
+    def set_connections(self, hosts):
+        super(MeasuredTransport, self).set_connections(hosts)
+        if self.interruptible:
+            for connection in self.connection_pool.connections:
+                make_interruptible(connection)
+
+    def get_connection(self):
+        """Return a connection, avoiding the ones excluded by the current
+        context, unless there is no other one.
+
+        :class:`RequestAborted` is raised if the requests of the current
+        context have been aborted, so the request is not retried.
+        """
+        connection = super(MeasuredTransport, self).get_connection()
+        choice = _current_choice.get()
+
+        if choice is None:
+            return connection
+
+        if choice.aborted:
+            raise RequestAborted('N/A', 'The request has been aborted.', None)
+
+        if connection in choice.excluded:
+            others = [other
+                      for other in self.connection_pool.connections
+                      if other not in choice.excluded]
+            if others:
+                connection = random.choice(others)
+
+        choice.used = connection
+        return connection
+
+    def mark_dead(self, connection):
+        """Mark `connection` as dead, unless its request has been aborted:
+        then the host did not fail."""
+        choice = _current_choice.get()
+
+        if choice is not None and choice.aborted:
+            return
+
+        super(MeasuredTransport, self).mark_dead(connection)
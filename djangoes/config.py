@@ -0,0 +1,99 @@
+"""Compiled configuration of connections.
+
+The settings of a connection (its server in ``ES_SERVERS`` and its indices in
+``ES_INDICES``) are prepared and validated once per process by the connections
+handler, then compiled into immutable objects shared by all the backends of
+this connection, whatever the thread (or greenlet) they are used in.
+
+Everything a backend needs that can be computed from the settings is computed
+here once: the list of names used to query ElasticSearch, the comma-joined
+string sent by the client, the index names, and the alias names.
+"""
+from types import MappingProxyType
+
+
+class FrozenConfig(object):
+    """Base class of immutable configuration objects.
+
+    Attributes are set once by ``__init__`` with :meth:`_set`, then any
+    attempt to set or to delete an attribute raises an ``AttributeError``.
+    """
+    __slots__ = ()
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%r object is immutable' %
+                             self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%r object is immutable' %
+                             self.__class__.__name__)
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.alias)
+
+
+class IndexConfig(FrozenConfig):
+    """Compiled configuration of one index of ``ES_INDICES``.
+
+    It expects the settings of the index to be already prepared, with their
+    default and test values.
+    """
+    __slots__ = ('alias', 'name', 'aliases', 'settings', 'settings_dict')
+
+    def __init__(self, alias, index):
+        self._set('alias', alias)
+        self._set('name', index['NAME'])
+        self._set('aliases', tuple(index['ALIASES']))
+        self._set('settings', index['SETTINGS'])
+        # Read-only view on the (copied) settings of the index.
+        self._set('settings_dict', MappingProxyType(dict(index)))
+
+    @property
+    def usage_names(self):
+        """Names to use to query this index: its aliases, or its name."""
+        return self.aliases or (self.name,)
+
+
+def unique(names):
+    """Return a tuple of `names` without duplicates, in their initial order."""
+    seen = set()
+    return tuple(name for name in names
+                 if not (name in seen or seen.add(name)))
+
+
+class ServerConfig(FrozenConfig):
+    """Compiled configuration of one connection of ``ES_SERVERS``.
+
+    It is built from the prepared settings of the server, the prepared
+    settings of its indices, and the backend class to use.
+    """
+    __slots__ = ('alias', 'server', 'backend_class', 'shared',
+                 'index_configs', 'server_indices', 'indices', 'index_names',
+                 'alias_names', 'indices_param')
+
+    def __init__(self, alias, server, server_indices, backend_class):
+        index_configs = tuple(
+            IndexConfig(index_alias, index)
+            for index_alias, index in server_indices.items())
+        indices = unique(name
+                         for index in index_configs
+                         for name in index.usage_names)
+
+        self._set('alias', alias)
+        self._set('server', server)
+        self._set('backend_class', backend_class)
+        self._set('shared', bool(server.get('SHARED', False)))
+        self._set('index_configs', index_configs)
+        self._set('server_indices', MappingProxyType({
+            index.alias: index.settings_dict for index in index_configs
+        }))
+        self._set('indices', indices)
+        self._set('index_names', unique(index.name
+                                        for index in index_configs))
+        self._set('alias_names', unique(name
+                                        for index in index_configs
+                                        for name in index.aliases))
+        self._set('indices_param', ','.join(indices))
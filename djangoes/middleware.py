@@ -0,0 +1,91 @@
+"""Django middlewares for ``djangoes``.
+
+The :class:`QueryLogMiddleware` summarizes the ElasticSearch queries of each
+request, from the query logs of the connections (see
+:mod:`djangoes.backends.querylog`)::
+
+    MIDDLEWARE = [
+        'djangoes.middleware.QueryLogMiddleware',
+        # ...
+    ]
+
+"""
+from collections import Counter
+import logging
+
+import djangoes
+
+
+logger = logging.getLogger('djangoes.queries')  #pylint: disable=invalid-name
+
+
+def summarize_queries(queries):
+    """Return a summary of the logged `queries`.
+
+    The summary is a dict with the number of queries (``count``) and of
+    failed queries (``errors``), the total duration seen by the client
+    (``time``) and by ElasticSearch (``took``), the number of queries of each
+    method (``methods``), and the queries performed more than once with the
+    same arguments and body (``duplicates``, with their ``count``).
+    """
+    methods = Counter(query['method'] for query in queries)
+    identical = Counter(
+        (query['alias'], query['method'], query['indices'], query['body'],
+         query['arguments'])
+        for query in queries)
+
+    return {
+        'count': len(queries),
+        'errors': sum(1 for query in queries if query['error']),
+        'time': sum(query['time'] for query in queries),
+        'took': sum(query['took'] or 0 for query in queries),
+        'methods': dict(methods),
+        'duplicates': [
+            {
+                'alias': alias,
+                'method': method,
+                'indices': indices,
+                'body': body,
+                'arguments': arguments,
+                'count': count,
+            }
+            for (alias, method, indices, body, arguments), count
+            in identical.items()
+            if count > 1
+        ],
+    }
+
+
+class QueryLogMiddleware(object):
+    """Log a summary of the ElasticSearch queries of each request.
+
+    The summary given by :func:`summarize_queries` is set as the
+    ``es_queries`` attribute of the request, and logged by the
+    ``djangoes.queries`` logger: as a warning when some queries are
+    duplicated, otherwise as an info.
+
+    Only the connections whose query log is enabled are summarized.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        djangoes.connections.reset_queries()
+
+        response = self.get_response(request)
+
+        queries = djangoes.connections.get_queries()
+        summary = request.es_queries = summarize_queries(queries)
+
+        if summary['count']:
+            duplicated = sum(duplicate['count']
+                             for duplicate in summary['duplicates'])
+            level = logging.WARNING if duplicated else logging.INFO
+            logger.log(level,
+                       '%s %s: %d ElasticSearch queries in %.1f ms '
+                       '(took %d ms), %d duplicated',
+                       request.method, request.path, summary['count'],
+                       summary['time'], summary['took'], duplicated,
+                       extra={'summary': summary})
+
+        return response
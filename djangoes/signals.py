@@ -0,0 +1,16 @@
+"""Signals sent by ``djangoes``."""
+from django.dispatch import Signal
+
+
+#: Sent after each query performed by a backend, when its stats are enabled.
+#:
+#: Arguments sent with this signal:
+#:
+#: * ``sender``: the backend's class,
+#: * ``alias``: the alias of the connection,
+#: * ``method``: the name of the backend's method,
+#: * ``duration``: the duration of the query, in milliseconds,
+#: * ``sent``: number of bytes sent to ElasticSearch,
+#: * ``received``: number of bytes received from ElasticSearch,
+#: * ``exception``: the exception raised by the query, or ``None``.
+query_finished = Signal()
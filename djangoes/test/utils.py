@@ -28,14 +28,16 @@ def setup_djangoes():
                 'indices for testing purpose.' % conn.alias)
 
         # Replace each index by its test settings.
-        for indices in conn.server_indices.values():
-            indices.update({
-                'NAME': indices['TEST']['NAME'],
-                'ALIASES': indices['TEST']['ALIASES'],
-                'SETTINGS': indices['TEST']['SETTINGS'],
-            })
+        conn.server_indices = {
+            alias: dict(index,
+                        NAME=index['TEST']['NAME'],
+                        ALIASES=index['TEST']['ALIASES'],
+                        SETTINGS=index['TEST']['SETTINGS'])
+            for alias, index in conn.server_indices.items()
+        }
 
         # Refresh connection's cached properties.
-        conn.indices = conn.get_indices()
-        conn.index_names = conn.get_index_names()
-        conn.alias_names = conn.get_alias_names()
+        conn.refresh_indices()
+
+        # Connections created from now on use the test settings too.
+        connections.set_config(conn)
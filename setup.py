@@ -16,7 +16,7 @@ classifiers = [
     'Intended Audience :: Developers',
     'License :: CC0 1.0 Universal (CC0 1.0) Public Domain Dedication',
     'Operating System :: OS Independent',
-    'Programming Language :: Python :: 3.4',
+    'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: 3 :: Only',
     'Topic :: Software Development :: Libraries :: Python Modules',
 ]
@@ -36,6 +36,18 @@ setup(
     keywords="django elasticsearch pytest",
     url="https://github.com/exirel/djangoes/",   # project home page, if any
 
+    # Dependencies
+    python_requires='>=3.7',
+    install_requires=[
+        'Django>=2.2,<6',
+        'elasticsearch>=1.9.0,<2',
+        'urllib3>=1.26,<2',
+    ],
+    # Optional dependencies
+    extras_require={
+        'aio': ['aiohttp>=3.7'],
+    },
+
     # Misc
     classifiers=classifiers,
 
@@ -1,7 +1,62 @@
+import json
+
+from elasticsearch.connection.base import Connection
+
 from djangoes.backends.abstracts import Base
+from djangoes.backends.elasticsearch import BaseElasticsearchBackend
 
 
 class ConnectionWrapper(Base):
     def configure_client(self):
         # Override to avoid the raise from Base class
         pass
+
+
+class FakeConnection(Connection):
+    """Connection that records requests instead of sending them.
+
+    Each response is taken from the class attribute ``responses``: either a
+    tuple ``(status, data)`` or an exception to raise. Without any response
+    left, it responds ``(200, {})``.
+    """
+    responses = []
+    requests = []
+
+    @classmethod
+    def reset(cls, responses=None):
+        cls.responses = list(responses or [])
+        cls.requests = []
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        self.requests.append((self.host, method, url, params, body))
+        response = self.responses.pop(0) if self.responses else (200, {})
+
+        if isinstance(response, Exception):
+            raise response
+
+        status, data = response
+        if not (200 <= status < 300) and status not in ignore:
+            self._raise_error(status, json.dumps(data))
+
+        return status, {'content-type': 'application/json'}, json.dumps(data)
+
+
+class FakeBackend(BaseElasticsearchBackend):
+    connection_class = FakeConnection
+
+
+def make_backend(backend_class=FakeBackend, alias='default', indices=None,
+                 **server):
+    """Return a configured backend using `server` options."""
+    server.setdefault('HOSTS', ['localhost'])
+    server.setdefault('PARAMS', {})
+    indices = indices or {
+        'index': {
+            'NAME': 'index',
+            'ALIASES': [],
+        }
+    }
+    backend = backend_class(alias, server, indices)
+    backend.configure_client()
+    return backend
@@ -1,8 +1,16 @@
 def pytest_configure(config):
     """Configure py.test with ES_SERVERS and ES_INDICES django settings."""
+    import django
     from django.conf import settings
 
-    settings.configure(ES_SERVERS={}, ES_INDICES={})
+    settings.configure(ES_SERVERS={}, ES_INDICES={}, SECRET_KEY='tests',
+                       DATABASES={
+                           'default': {
+                               'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': ':memory:',
+                           },
+                       })
+    django.setup()
 
 
 def pytest_runtest_setup(item):
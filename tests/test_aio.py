@@ -0,0 +1,270 @@
+import asyncio
+import json
+from unittest import IsolatedAsyncioTestCase
+
+from aiohttp import web
+from elasticsearch.connection.base import Connection
+from elasticsearch.exceptions import ConnectionError, NotFoundError
+
+from djangoes import ConnectionHandler
+from djangoes.backends.aio import (AiohttpConnection, AsyncHttpBackend,
+                                   AsyncTransport)
+
+
+class FakeAsyncConnection(Connection):
+    """Asynchronous connection that records requests instead of sending them.
+
+    Each response is taken from the class attribute ``responses``: either a
+    tuple ``(status, data)`` or an exception to raise.
+    """
+    responses = []
+    requests = []
+
+    async def perform_request(self, method, url, params=None, body=None,
+                              timeout=None, ignore=()):
+        self.requests.append((self.host, method, url, params, body))
+        response = self.responses.pop(0)
+
+        if isinstance(response, Exception):
+            raise response
+
+        status, data = response
+        if not (200 <= status < 300) and status not in ignore:
+            self._raise_error(status, json.dumps(data))
+
+        return status, {'content-type': 'application/json'}, json.dumps(data)
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncBackend(AsyncHttpBackend):
+    connection_class = FakeAsyncConnection
+
+
+def make_backend(hosts=None, indices=None, params=None):
+    server = {
+        'HOSTS': hosts or ['localhost'],
+        'PARAMS': params or {},
+    }
+    indices = indices or {
+        'index': {
+            'NAME': 'index',
+            'ALIASES': [],
+        }
+    }
+    backend = FakeAsyncBackend('default', server, indices)
+    backend.configure_client()
+    return backend
+
+
+class TestAsyncHttpBackend(IsolatedAsyncioTestCase):
+    def setUp(self):
+        FakeAsyncConnection.responses = []
+        FakeAsyncConnection.requests = []
+
+    async def test_search(self):
+        """Assert search is a coroutine using the configured indices."""
+        FakeAsyncConnection.responses = [(200, {'hits': {'total': 0}})]
+        backend = make_backend()
+
+        result = await backend.search(body={'query': {'match_all': {}}})
+
+        assert result == {'hits': {'total': 0}}
+        (_, method, url, _, body), = FakeAsyncConnection.requests
+        assert method == 'GET'
+        assert url == '/index/_search'
+        assert json.loads(body.decode('utf-8')) == {
+            'query': {'match_all': {}}}
+
+    async def test_get(self):
+        FakeAsyncConnection.responses = [(200, {'_id': '42', 'found': True})]
+        backend = make_backend()
+
+        result = await backend.get('42')
+
+        assert result == {'_id': '42', 'found': True}
+        assert FakeAsyncConnection.requests[0][2] == '/index/_all/42'
+
+    async def test_exists(self):
+        FakeAsyncConnection.responses = [(200, ''), (404, {})]
+        backend = make_backend()
+
+        assert await backend.exists('42') is True
+        assert await backend.exists('43') is False
+
+    async def test_ping(self):
+        FakeAsyncConnection.responses = [
+            (200, ''),
+            ConnectionError('N/A', 'unreachable', None)]
+        backend = make_backend(params={'max_retries': 0})
+
+        assert await backend.ping() is True
+        assert await backend.ping() is False
+
+    async def test_not_found(self):
+        FakeAsyncConnection.responses = [(404, {'found': False})]
+        backend = make_backend()
+
+        with self.assertRaises(NotFoundError):
+            await backend.get('42')
+
+    async def test_retry_on_connection_error(self):
+        """Assert the request is sent to another host after an error."""
+        FakeAsyncConnection.responses = [
+            ConnectionError('N/A', 'unreachable', None),
+            (200, {'count': 3})]
+        backend = make_backend(hosts=['host_1', 'host_2'])
+
+        result = await backend.count()
+
+        assert result == {'count': 3}
+        assert len(FakeAsyncConnection.requests) == 2
+
+    async def test_concurrent_queries(self):
+        FakeAsyncConnection.responses = [(200, {'count': i})
+                                         for i in range(10)]
+        backend = make_backend()
+
+        results = await asyncio.gather(*[backend.count() for _ in range(10)])
+
+        assert sorted(r['count'] for r in results) == list(range(10))
+
+
+class TestAsyncTransport(IsolatedAsyncioTestCase):
+    def test_sniffing_not_supported(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        with self.assertRaises(ImproperlyConfigured):
+            AsyncTransport([{}], connection_class=FakeAsyncConnection,
+                           sniff_on_start=True)
+
+
+class TestAiohttpConnection(IsolatedAsyncioTestCase):
+    """Assert the aiohttp connection performs real HTTP requests."""
+
+    async def asyncSetUp(self):
+        async def handler(request):
+            self.received.append((request.method, request.path_qs,
+                                  await request.text()))
+            if request.path == '/missing':
+                return web.json_response({'error': 'missing'}, status=404)
+            return web.json_response({'ok': True})
+
+        self.received = []
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def test_perform_request(self):
+        connection = AiohttpConnection(host='127.0.0.1', port=self.port)
+
+        status, headers, data = await connection.perform_request(
+            'POST', '/index/_search', {'size': 1}, b'{}')
+        await connection.close()
+
+        assert status == 200
+        assert json.loads(data) == {'ok': True}
+        assert self.received == [('POST', '/index/_search?size=1', '{}')]
+
+    async def test_perform_request_error(self):
+        connection = AiohttpConnection(host='127.0.0.1', port=self.port)
+
+        with self.assertRaises(NotFoundError):
+            await connection.perform_request('GET', '/missing')
+
+        await connection.close()
+
+    async def test_connection_error(self):
+        connection = AiohttpConnection(host='127.0.0.1', port=1)
+
+        with self.assertRaises(ConnectionError):
+            await connection.perform_request('GET', '/')
+
+        await connection.close()
+
+
+class TestAsyncConnectionHandler(IsolatedAsyncioTestCase):
+    """Assert how asynchronous connections are given by ConnectionHandler."""
+
+    def get_handler(self):
+        servers = {
+            'default': {
+                'ASYNC_ENGINE': 'tests.test_aio.FakeAsyncBackend',
+                'HOSTS': ['localhost'],
+                'INDICES': ['index'],
+            }
+        }
+        indices = {
+            'index': {}
+        }
+        return ConnectionHandler(servers, indices)
+
+    async def test_get_async(self):
+        handler = self.get_handler()
+
+        conn = handler.get_async('default')
+
+        assert isinstance(conn, FakeAsyncBackend)
+        assert conn.indices == ['index']
+        assert handler.get_async('default') is conn
+
+    async def test_get_async_shared_by_tasks(self):
+        """Assert all the tasks of a loop share the same connection."""
+        handler = self.get_handler()
+
+        async def get_conn():
+            return handler.get_async('default')
+
+        conns = await asyncio.gather(get_conn(), get_conn())
+
+        assert conns[0] is conns[1]
+        assert handler.get_async('default') is conns[0]
+
+    async def test_set_async(self):
+        """Assert set_async only affects the current context."""
+        handler = self.get_handler()
+        conn = handler.get_async('default')
+        other_conn = make_backend()
+
+        async def use_other():
+            handler.set_async('default', other_conn)
+            return handler.get_async('default')
+
+        assert await asyncio.create_task(use_other()) is other_conn
+        assert handler.get_async('default') is conn
+
+    def test_get_async_not_shared_by_loops(self):
+        """Assert a connection is not leaked to the tasks of another loop by
+        a context they have in common."""
+        handler = self.get_handler()
+        handler.set_async('other', make_backend())
+
+        async def get_conn():
+            return handler.get_async('default')
+
+        first = asyncio.run(get_conn())
+        second = asyncio.run(get_conn())
+
+        assert first is not second
+
+    async def test_reset_connections(self):
+        handler = self.get_handler()
+        conn = handler.get_async('default')
+
+        handler.reset_connections()
+
+        assert handler.get_async('default') is not conn
+
+    def test_get_async_without_loop(self):
+        handler = self.get_handler()
+
+        with self.assertRaises(RuntimeError):
+            handler.get_async('default')
@@ -0,0 +1,247 @@
+import json
+from unittest.case import TestCase
+
+from elasticsearch.exceptions import NotFoundError, TransportError
+
+import djangoes
+from djangoes import ConnectionHandler
+from djangoes.backends.batching import LazyResult
+
+from .backend import FakeConnection, make_backend
+
+
+def mget(*docs):
+    return (200, {'docs': list(docs)})
+
+
+def found(doc_id, **source):
+    return {'_id': doc_id, '_type': 'doc', 'found': True, '_version': 1,
+            '_source': source}
+
+
+class TestGetBatching(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_batch(self):
+        FakeConnection.reset([mget(found('1', a=1), found('2', a=2))])
+        backend = make_backend()
+
+        with backend.batch():
+            first = backend.get('1')
+            second = backend.get_source('2', 'doc')
+            assert isinstance(first, LazyResult)
+            assert FakeConnection.requests == []
+
+        (request,) = FakeConnection.requests
+        assert request[1:3] == ('GET', '/index/_mget')
+        assert json.loads(request[4]) == {
+            'docs': [{'_id': '1'}, {'_id': '2', '_type': 'doc'}]}
+        assert first['_source'] == {'a': 1}
+        assert dict(first) == found('1', a=1)
+        assert second == {'a': 2}
+
+    def test_first_access(self):
+        """Assert a result used in the block performs the whole batch."""
+        FakeConnection.reset([mget(found('1', a=1), found('2', a=2)),
+                              mget(found('3', a=3))])
+        backend = make_backend()
+
+        with backend.batch():
+            first = backend.get('1')
+            second = backend.get('2')
+            assert first['_source'] == {'a': 1}
+            assert len(FakeConnection.requests) == 1
+            third = backend.get('3')
+
+        assert second['_source'] == {'a': 2}
+        assert third['_source'] == {'a': 3}
+        assert len(FakeConnection.requests) == 2
+
+    def test_duplicates(self):
+        FakeConnection.reset([mget(found('1', a=1))])
+        backend = make_backend()
+
+        with backend.batch():
+            first = backend.get('1')
+            source = backend.get_source('1')
+            again = backend.get('1')
+
+        assert json.loads(FakeConnection.requests[0][4]) == {
+            'docs': [{'_id': '1'}]}
+        assert first == again == found('1', a=1)
+        assert source == {'a': 1}
+
+    def test_not_found(self):
+        FakeConnection.reset([mget(
+            {'_id': '1', '_index': 'index', 'found': False},
+            {'_id': '2', 'error': 'IndexMissingException'},
+            found('3'))])
+        backend = make_backend()
+
+        with backend.batch():
+            missing = backend.get('1')
+            error = backend.get('2')
+            document = backend.get('3')
+
+        with self.assertRaises(NotFoundError):
+            missing['_source']
+        with self.assertRaises(TransportError):
+            error.result()
+        assert document['found']
+
+    def test_request_error(self):
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+        backend = make_backend()
+
+        with backend.batch():
+            first = backend.get('1')
+            second = backend.get('2')
+
+        for result in (first, second):
+            with self.assertRaises(TransportError):
+                result.result()
+
+    def test_not_batched(self):
+        """Assert the queries with other arguments are performed at once."""
+        FakeConnection.reset([(200, found('1'))])
+        backend = make_backend()
+
+        with backend.batch():
+            result = backend.get('1', routing='a')
+            assert len(FakeConnection.requests) == 1
+
+        assert result == found('1')
+
+    def test_exception(self):
+        """Assert the batch is not performed when the block fails."""
+        FakeConnection.reset([mget(found('1'))])
+        backend = make_backend()
+
+        with self.assertRaises(ValueError):
+            with backend.batch():
+                result = backend.get('1')
+                raise ValueError()
+
+        assert FakeConnection.requests == []
+        assert result['found']
+
+    def test_other_backend(self):
+        backend = make_backend()
+        other = make_backend()
+
+        with backend.batch():
+            result = other.get('1')
+
+        assert not isinstance(result, LazyResult)
+
+    def test_after_block(self):
+        backend = make_backend()
+
+        with backend.batch():
+            pass
+
+        assert not isinstance(backend.get('1'), LazyResult)
+        assert len(FakeConnection.requests) == 1
+
+    def test_connection_proxy(self):
+        FakeConnection.reset([mget(found('1'), found('2'))])
+        djangoes.connections = ConnectionHandler({
+            'default': {
+                'ENGINE': 'tests.backend.FakeBackend',
+                'HOSTS': ['localhost'],
+                'INDICES': ['index'],
+            },
+        }, {'index': {}})
+        connection = djangoes.connection
+
+        with connection.batch():
+            documents = [connection.get(doc_id) for doc_id in ('1', '2')]
+
+        assert len(FakeConnection.requests) == 1
+        assert [document['_id'] for document in documents] == ['1', '2']
+
+
+def hits(total):
+    return {'hits': {'total': total, 'hits': []}}
+
+
+class TestSearchBatching(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_batch(self):
+        FakeConnection.reset([(200, {'responses': [hits(1), hits(2)]})])
+        backend = make_backend()
+
+        with backend.batch():
+            results = backend.search(body={'query': {'match_all': {}}})
+            facets = backend.search('product', {'size': 0},
+                                    search_type='count')
+            assert FakeConnection.requests == []
+
+        (request,) = FakeConnection.requests
+        assert request[1:3] == ('GET', '/_msearch')
+        lines = [json.loads(line)
+                 for line in request[4].decode('utf-8').splitlines()]
+        assert lines == [
+            {'index': ['index']},
+            {'query': {'match_all': {}}},
+            {'index': ['index'], 'type': 'product', 'search_type': 'count'},
+            {'size': 0},
+        ]
+        assert results['hits']['total'] == 1
+        assert facets['hits']['total'] == 2
+
+    def test_gets_and_searches(self):
+        FakeConnection.reset([mget(found('1')),
+                              (200, {'responses': [hits(3)]})])
+        backend = make_backend()
+
+        with backend.batch():
+            document = backend.get('1')
+            results = backend.search()
+
+        assert [request[2] for request in FakeConnection.requests] == [
+            '/index/_mget', '/_msearch']
+        assert document['found']
+        assert results['hits']['total'] == 3
+        assert json.loads(
+            FakeConnection.requests[1][4].decode('utf-8').splitlines()[1]
+        ) == {}
+
+    def test_first_access(self):
+        FakeConnection.reset([(200, {'responses': [hits(1), hits(2)]})])
+        backend = make_backend()
+
+        with backend.batch():
+            first = backend.search(body={'size': 1})
+            second = backend.search(body={'size': 2})
+            assert first['hits']['total'] == 1
+            assert len(FakeConnection.requests) == 1
+
+        assert second['hits']['total'] == 2
+        assert len(FakeConnection.requests) == 1
+
+    def test_error(self):
+        FakeConnection.reset([(200, {'responses': [
+            {'error': 'SearchPhaseExecutionException[...]'}, hits(2)]})])
+        backend = make_backend()
+
+        with backend.batch():
+            failed = backend.search(body={'query': {'bad': {}}})
+            results = backend.search()
+
+        with self.assertRaises(TransportError):
+            failed['hits']
+        assert results['hits']['total'] == 2
+
+    def test_not_batched(self):
+        FakeConnection.reset([(200, hits(1))])
+        backend = make_backend()
+
+        with backend.batch():
+            results = backend.search(body={}, size=10)
+            assert len(FakeConnection.requests) == 1
+
+        assert results['hits']['total'] == 1
@@ -0,0 +1,260 @@
+import gc
+import json
+import time
+from unittest import mock
+from unittest.case import TestCase
+
+from elasticsearch.exceptions import TransportError
+
+from djangoes.backends.buffering import merge_documents
+
+from .backend import FakeConnection, make_backend
+
+
+def read_body(request):
+    return [json.loads(line)
+            for line in request[4].decode('utf-8').splitlines()]
+
+
+def bulk_response(*statuses):
+    return (200, {'took': 1, 'errors': False,
+                  'items': [{'index': {'status': status}}
+                            for status in statuses]})
+
+
+class TestWriteBuffer(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def tearDown(self):
+        # The buffers of the backends of the test are flushed when they are
+        # garbage collected: not during the next test.
+        gc.collect()
+
+    def make_backend(self, **options):
+        options.setdefault('MAX_DELAY', 60)
+        return make_backend(WRITE_BUFFER=options)
+
+    def test_disabled(self):
+        assert make_backend().write_buffer is None
+        assert make_backend(WRITE_BUFFER=True).write_buffer is not None
+
+    def test_flush(self):
+        backend = self.make_backend()
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        backend.write_buffer.delete('doc', 2, routing='x')
+
+        assert FakeConnection.requests == []
+        assert len(backend.write_buffer) == 2
+
+        FakeConnection.reset([bulk_response(201, 200)])
+        backend.write_buffer.flush()
+
+        (request,) = FakeConnection.requests
+        assert request[2] == '/_bulk'
+        assert read_body(request) == [
+            {'index': {'_index': 'index', '_type': 'doc', '_id': '1'}},
+            {'a': 1},
+            {'delete': {'_index': 'index', '_type': 'doc', '_id': '2',
+                        '_routing': 'x'}},
+        ]
+        assert len(backend.write_buffer) == 0
+        assert backend.write_buffer.flush() is None
+
+    def test_max_actions(self):
+        backend = self.make_backend(MAX_ACTIONS=2)
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        assert FakeConnection.requests == []
+
+        FakeConnection.reset([bulk_response(201, 201)])
+        backend.write_buffer.index('doc', {'a': 2}, 2)
+
+        assert len(FakeConnection.requests) == 1
+        assert len(backend.write_buffer) == 0
+
+    def test_max_bytes(self):
+        backend = self.make_backend(MAX_BYTES=100)
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        assert FakeConnection.requests == []
+
+        FakeConnection.reset([bulk_response(201, 201)])
+        backend.write_buffer.index('doc', {'a': 'x' * 100}, 2)
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_max_delay(self):
+        """Assert the buffer is flushed by the next write after the delay."""
+        backend = self.make_backend(MAX_DELAY=0.01)
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        time.sleep(0.02)
+
+        assert FakeConnection.requests == []
+
+        FakeConnection.reset([bulk_response(201, 201)])
+        backend.write_buffer.index('doc', {'a': 2}, 2)
+
+        (request,) = FakeConnection.requests
+        assert len(read_body(request)) == 4
+        assert len(backend.write_buffer) == 0
+
+    def test_close(self):
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201)])
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+
+        backend.close()
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_garbage_collected(self):
+        """Assert the buffer is flushed when its backend is garbage
+        collected."""
+        backend = self.make_backend()
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        FakeConnection.reset([bulk_response(201)])
+
+        del backend
+        gc.collect()
+
+        (request,) = FakeConnection.requests
+        assert len(read_body(request)) == 2
+
+    def test_merge(self):
+        backend = self.make_backend()
+        buffer = backend.write_buffer
+        buffer.index('doc', {'a': 1, 'b': {'c': 1}}, 1)
+        buffer.update('doc', 1, {'doc': {'b': {'d': 2}}})
+        buffer.update('doc', 2, {'doc': {'a': 1}})
+        buffer.update('doc', 2, {'doc': {'b': 2}})
+        buffer.index('doc', {'a': 1}, 3)
+        buffer.delete('doc', 3)
+        buffer.update('doc', 4, {'script': 'ctx._source.a += 1'})
+        buffer.update('doc', 4, {'doc': {'a': 1}})
+
+        assert len(buffer) == 5
+        FakeConnection.reset([bulk_response(*[200] * 5)])
+        buffer.flush()
+
+        assert read_body(FakeConnection.requests[0]) == [
+            {'index': {'_index': 'index', '_type': 'doc', '_id': '1'}},
+            {'a': 1, 'b': {'c': 1, 'd': 2}},
+            {'update': {'_index': 'index', '_type': 'doc', '_id': '2'}},
+            {'doc': {'a': 1, 'b': 2}},
+            {'delete': {'_index': 'index', '_type': 'doc', '_id': '3'}},
+            {'update': {'_index': 'index', '_type': 'doc', '_id': '4'}},
+            {'script': 'ctx._source.a += 1'},
+            {'update': {'_index': 'index', '_type': 'doc', '_id': '4'}},
+            {'doc': {'a': 1}},
+        ]
+
+    def test_not_merged(self):
+        backend = self.make_backend()
+        buffer = backend.write_buffer
+        buffer.index('doc', {'a': 1})
+        buffer.index('doc', {'a': 1})
+        buffer.index('doc', {'a': 1}, 1, index='other')
+        buffer.index('doc', {'a': 1}, 1)
+        buffer.update('doc', 1, {'doc': {'a': 2}}, version=3)
+
+        assert len(buffer) == 5
+
+    def test_merge_documents(self):
+        assert merge_documents({'a': {'b': 1, 'c': 1}, 'd': 1},
+                               {'a': {'b': 2}, 'd': {'e': 1}}) == {
+                                   'a': {'b': 2, 'c': 1}, 'd': {'e': 1}}
+
+    def test_index_required(self):
+        backend = make_backend(WRITE_BUFFER={'MAX_DELAY': 60}, indices={
+            'a': {'NAME': 'a', 'ALIASES': []},
+            'b': {'NAME': 'b', 'ALIASES': []},
+        })
+
+        with self.assertRaises(ValueError):
+            backend.write_buffer.index('doc', {'a': 1}, 1)
+
+        backend.write_buffer.index('doc', {'a': 1}, 1, index='a')
+        assert len(backend.write_buffer) == 1
+
+    def test_errors_logged(self):
+        backend = self.make_backend()
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        FakeConnection.reset([bulk_response(400)])
+
+        with mock.patch('djangoes.backends.buffering.logger') as logger:
+            backend.write_buffer.flush()
+
+        assert logger.warning.called
+
+    def test_full_errors_logged(self):
+        """Assert the error of a flush by a full buffer is logged, not raised
+        to the caller of the write."""
+        backend = self.make_backend(MAX_ACTIONS=2)
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+
+        with mock.patch('djangoes.backends.buffering.logger') as logger:
+            backend.write_buffer.index('doc', {'a': 2}, 2)
+
+        assert logger.exception.called
+        assert len(FakeConnection.requests) == 1
+        assert len(backend.write_buffer) == 0
+
+    def test_flush_writes(self):
+        """Assert the error of a flush by the backend is logged."""
+        backend = self.make_backend()
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+
+        with mock.patch('djangoes.backends.buffering.logger') as logger:
+            backend.flush_writes()
+
+        assert logger.exception.called
+        assert len(backend.write_buffer) == 0
+
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+        backend.write_buffer.index('doc', {'a': 1}, 1)
+        with self.assertRaises(TransportError):
+            backend.write_buffer.flush()
+
+
+class TestWriteBufferInterceptor(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def tearDown(self):
+        gc.collect()
+
+    def test_disabled(self):
+        backend = make_backend(WRITE_BUFFER=True)
+
+        backend.index('doc', {'a': 1}, 1)
+
+        assert len(FakeConnection.requests) == 1
+        assert len(backend.write_buffer) == 0
+
+    def test_intercept(self):
+        backend = make_backend(WRITE_BUFFER={'INTERCEPT': True,
+                                             'MAX_DELAY': 60})
+
+        assert backend.index('doc', {'a': 1}, 1) is None
+        assert backend.index('doc', {'a': 1}, op_type='create') is None
+        assert backend.update('doc', 1, {'doc': {'b': 2}}) is None
+        assert backend.delete('doc', 2, routing='x') is None
+        assert FakeConnection.requests == []
+        assert len(backend.write_buffer) == 3
+
+        # Other arguments than the metadata of a bulk action.
+        backend.index('doc', {'a': 1}, 3, refresh=True)
+        assert len(FakeConnection.requests) == 1
+
+        FakeConnection.reset([bulk_response(200, 201, 200)])
+        backend.write_buffer.flush()
+
+        assert read_body(FakeConnection.requests[0]) == [
+            {'index': {'_index': 'index', '_type': 'doc', '_id': '1'}},
+            {'a': 1, 'b': 2},
+            {'create': {'_index': 'index', '_type': 'doc'}},
+            {'a': 1},
+            {'delete': {'_index': 'index', '_type': 'doc', '_id': '2',
+                        '_routing': 'x'}},
+        ]
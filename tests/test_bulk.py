@@ -0,0 +1,384 @@
+import json
+import multiprocessing
+import os
+import threading
+from unittest.case import TestCase
+
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.serializer import JSONSerializer
+
+from djangoes.backends.bulk import (chunk_actions, get_failed_items,
+                                    get_mp_context, init_serializer,
+                                    serialize_items)
+
+from djangoes.backends.elasticsearch import BaseElasticsearchBackend
+
+from .backend import FakeConnection, make_backend
+
+
+def bulk_response(*statuses):
+    return (200, {'took': 1, 'errors': any(status >= 300
+                                           for status in statuses),
+                  'items': [{'index': {'_id': str(number), 'status': status}}
+                            for number, status in enumerate(statuses)]})
+
+
+def read_body(request):
+    return [json.loads(line)
+            for line in request[4].decode('utf-8').splitlines()]
+
+
+def get_action(number):
+    """Build the action of `number`, in a worker process."""
+    if number % 3 == 2:
+        return None
+    return {'_id': number, 'pid': os.getpid()}
+
+
+class TestChunkActions(TestCase):
+    def test_chunk_size(self):
+        chunks = list(chunk_actions(({'a': number} for number in range(5)),
+                                    JSONSerializer(), chunk_size=2))
+
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert chunks[0][0] == ('{"index": {}}', '{"a": 0}')
+
+    def test_max_chunk_bytes(self):
+        # Each action is 14 + 9 bytes, with its newlines.
+        actions = [{'a': number} for number in range(5)]
+
+        chunks = list(chunk_actions(actions, JSONSerializer(),
+                                    max_chunk_bytes=50))
+
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+    def test_big_action(self):
+        """Assert an action bigger than the max is sent alone."""
+        actions = [{'a': 1}, {'a': 'x' * 100}, {'a': 2}]
+
+        chunks = list(chunk_actions(actions, JSONSerializer(),
+                                    max_chunk_bytes=50))
+
+        assert [len(chunk) for chunk in chunks] == [1, 1, 1]
+
+    def test_utf8_bytes(self):
+        actions = [{'a': 'é' * 10}, {'a': 'é' * 10}]
+
+        # 14 + 20 characters, but 14 + 30 bytes, with the newlines.
+        chunks = list(chunk_actions(actions, JSONSerializer(),
+                                    max_chunk_bytes=80))
+
+        assert [len(chunk) for chunk in chunks] == [1, 1]
+
+    def test_actions(self):
+        actions = [
+            {'_op_type': 'delete', '_id': '1', '_type': 'doc'},
+            {'_id': '2', '_source': {'a': 1}},
+            '{"a": 2}',
+        ]
+
+        (chunk,) = chunk_actions(actions, JSONSerializer())
+
+        assert [(json.loads(action), data) for action, data in chunk] == [
+            ({'delete': {'_id': '1', '_type': 'doc'}}, None),
+            ({'index': {'_id': '2'}}, '{"a": 1}'),
+            ({'index': {}}, '{"a": 2}'),
+        ]
+
+    def test_lazy(self):
+        """Assert the actions are consumed one chunk at a time."""
+        consumed = []
+
+        def actions():
+            for number in range(10):
+                consumed.append(number)
+                yield {'a': number}
+
+        chunks = chunk_actions(actions(), JSONSerializer(), chunk_size=3)
+        next(chunks)
+
+        assert consumed == [0, 1, 2, 3]
+
+
+class TestStreamingBulk(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_streaming_bulk(self):
+        FakeConnection.reset([bulk_response(201, 201), bulk_response(200)])
+        backend = make_backend()
+
+        results = list(backend.streaming_bulk(
+            ({'_id': number, 'a': number} for number in range(3)),
+            chunk_size=2, doc_type='doc'))
+
+        assert [ok for ok, _ in results] == [True, True, True]
+        assert results[0][1] == {'index': {'_id': '0', 'status': 201}}
+        first, second = FakeConnection.requests
+        assert first[2] == '/index/doc/_bulk'
+        assert read_body(first) == [{'index': {'_id': 0}}, {'a': 0},
+                                    {'index': {'_id': 1}}, {'a': 1}]
+        assert read_body(second) == [{'index': {'_id': 2}}, {'a': 2}]
+
+    def test_item_errors(self):
+        FakeConnection.reset([bulk_response(201, 400, 201),
+                              bulk_response(201)])
+        backend = make_backend()
+
+        results = backend.streaming_bulk([{'a': 1}] * 4, chunk_size=3)
+
+        # The successful actions of the chunk are given first.
+        assert next(results)[0]
+        assert next(results)[0]
+        with self.assertRaises(BulkIndexError) as raised:
+            next(results)
+
+        assert raised.exception.errors == [
+            {'index': {'_id': '1', 'status': 400}}]
+        assert len(FakeConnection.requests) == 1
+
+    def test_item_errors_not_raised(self):
+        FakeConnection.reset([bulk_response(201, 400)])
+        backend = make_backend()
+
+        results = list(backend.streaming_bulk([{'a': 1}] * 2,
+                                              raise_on_error=False))
+
+        assert [ok for ok, _ in results] == [True, False]
+
+    def test_exception(self):
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+        backend = make_backend()
+
+        with self.assertRaises(TransportError):
+            list(backend.streaming_bulk([{'a': 1}]))
+
+    def test_exception_not_raised(self):
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+        backend = make_backend()
+
+        results = list(backend.streaming_bulk(
+            [{'_id': '1', 'a': 1}, {'_op_type': 'delete', '_id': '2'}],
+            raise_on_error=False, raise_on_exception=False))
+
+        assert [ok for ok, _ in results] == [False, False]
+        index, delete = [item for _, item in results]
+        assert index['index']['_id'] == '1'
+        assert index['index']['status'] == 400
+        assert index['index']['data'] == {'a': 1}
+        assert delete['delete']['_id'] == '2'
+        assert 'data' not in delete['delete']
+
+    def test_exception_raised_as_bulk_error(self):
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+        backend = make_backend()
+
+        with self.assertRaises(BulkIndexError) as raised:
+            list(backend.streaming_bulk([{'a': 1}],
+                                        raise_on_exception=False))
+
+        assert len(raised.exception.errors) == 1
+
+    def test_bulk_index(self):
+        assert make_backend().get_bulk_index() == 'index'
+        assert make_backend(indices={
+            'index': {'NAME': 'index_v2', 'ALIASES': ['index']},
+        }).get_bulk_index() == 'index'
+        assert make_backend(indices={
+            'index': {'NAME': 'index_v2', 'ALIASES': ['a', 'b']},
+        }).get_bulk_index() == 'index_v2'
+        assert make_backend(indices={
+            'a': {'NAME': 'a', 'ALIASES': []},
+            'b': {'NAME': 'b', 'ALIASES': []},
+        }).get_bulk_index() is None
+
+    def test_index(self):
+        FakeConnection.reset([bulk_response(201)])
+        backend = make_backend()
+
+        list(backend.streaming_bulk([{'a': 1}], index='other'))
+
+        assert FakeConnection.requests[0][2] == '/other/_bulk'
+
+
+class EchoConnection(FakeConnection):
+    """Connection responding to a bulk request with the ids of its actions.
+
+    The request with the action ``_id`` 0 waits for the ``gate`` event, set
+    by the request with the action ``_id`` ``opener``, if any.
+    """
+    gate = None
+    opener = 2
+    threads = []
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        self.threads.append(threading.current_thread().name)
+        ids = [action['index']['_id']
+               for action in read_body((None, None, None, None, body))
+               if 'index' in action]
+        if 0 in ids:
+            self.gate.wait(5)
+        if self.opener in ids:
+            self.gate.set()
+
+        self.requests.append((self.host, method, url, params, body))
+        data = {'took': 1, 'errors': False,
+                'items': [{'index': {'_id': str(doc_id), 'status': 201}}
+                          for doc_id in ids]}
+        return 200, {'content-type': 'application/json'}, json.dumps(data)
+
+
+class EchoBackend(BaseElasticsearchBackend):
+    connection_class = EchoConnection
+
+
+class TestParallelBulk(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        EchoConnection.gate = threading.Event()
+        EchoConnection.opener = 2
+        EchoConnection.threads = []
+
+    def get_ids(self, results):
+        return [item['index']['_id'] for _, item in results]
+
+    def test_ordered(self):
+        backend = make_backend(EchoBackend)
+
+        results = list(backend.parallel_bulk(
+            ({'_id': number} for number in range(4)), chunk_size=2,
+            thread_count=2))
+
+        # The first chunk is done after the second one.
+        assert self.get_ids(results) == ['0', '1', '2', '3']
+        assert len(FakeConnection.requests) == 2
+        assert all(name.startswith('djangoes-bulk-default')
+                   for name in EchoConnection.threads)
+
+    def test_unordered(self):
+        EchoConnection.opener = None
+        backend = make_backend(EchoBackend)
+
+        results = backend.parallel_bulk(
+            ({'_id': number} for number in range(4)), chunk_size=2,
+            thread_count=2, ordered=False)
+
+        # The first chunk waits until the second one is given.
+        assert self.get_ids([next(results), next(results)]) == ['2', '3']
+        EchoConnection.gate.set()
+        assert self.get_ids(results) == ['0', '1']
+
+    def test_queue_size(self):
+        """Assert the actions are not read faster than they are indexed."""
+        EchoConnection.gate.set()
+        consumed = []
+
+        def actions():
+            for number in range(10):
+                consumed.append(number)
+                yield {'_id': number}
+
+        results = make_backend(EchoBackend).parallel_bulk(
+            actions(), chunk_size=1, thread_count=2, queue_size=2)
+        next(results)
+
+        # Two chunks in flight, and the action read to end the second one.
+        assert consumed == [0, 1, 2]
+        assert len(list(results)) == 9
+
+    def test_item_errors(self):
+        FakeConnection.reset([bulk_response(201, 400)])
+        backend = make_backend()
+
+        results = backend.parallel_bulk([{'a': 1}] * 2)
+
+        assert next(results)[0]
+        with self.assertRaises(BulkIndexError) as raised:
+            next(results)
+        assert raised.exception.errors == [
+            {'index': {'_id': '1', 'status': 400}}]
+
+    def test_exception(self):
+        FakeConnection.reset([(400, {'error': 'bad request'})] * 2)
+        backend = make_backend()
+
+        with self.assertRaises(TransportError):
+            list(backend.parallel_bulk([{'a': 1}]))
+
+        results = list(backend.parallel_bulk([{'a': 1}],
+                                             raise_on_error=False,
+                                             raise_on_exception=False))
+        assert [ok for ok, _ in results] == [False]
+
+
+class TestProcessBulk(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_serialize_items(self):
+        bodies = serialize_items(get_action, range(6), chunk_size=2,
+                                 serializer=JSONSerializer())
+
+        assert len(bodies) == 2
+        assert isinstance(bodies[0], bytes)
+        assert [json.loads(line.decode('utf-8'))
+                for line in bodies[0].splitlines()][::2] == [
+                    {'index': {'_id': 0}}, {'index': {'_id': 1}}]
+
+    def test_worker_serializer(self):
+        init_serializer(JSONSerializer(), 'fork')
+        self.addCleanup(init_serializer, None, 'fork')
+
+        (body,) = serialize_items(get_action, [0])
+
+        assert body.endswith(b'\n')
+
+    def test_get_mp_context(self):
+        assert get_mp_context().get_start_method() == 'fork'
+        assert get_mp_context('spawn').get_start_method() == 'spawn'
+        context = multiprocessing.get_context('forkserver')
+        assert get_mp_context(context) is context
+
+    def test_get_failed_items(self):
+        error = TransportError(400, 'bad request')
+        body = (b'{"delete": {"_id": "1"}}\n'
+                b'{"index": {"_id": "2"}}\n{"a": 1}\n')
+
+        items = get_failed_items(body, error, JSONSerializer())
+
+        assert [list(item) for item in items] == [['delete'], ['index']]
+        assert items[1]['index']['data'] == {'a': 1}
+        assert items[1]['index']['status'] == 400
+
+    def test_process_bulk(self):
+        backend = make_backend(EchoBackend)
+        EchoConnection.gate = threading.Event()
+        EchoConnection.gate.set()
+        EchoConnection.threads = []
+
+        results = list(backend.process_bulk(range(12), get_action,
+                                            processes=2, chunk_size=3))
+
+        assert [item['index']['_id'] for _, item in results] == [
+            str(number) for number in range(12) if number % 3 != 2]
+        assert len(FakeConnection.requests) == 4
+        # The requests are all sent by the calling thread.
+        assert set(EchoConnection.threads) == {
+            threading.current_thread().name}
+        pids = set()
+        for request in FakeConnection.requests:
+            pids.update(line['pid'] for line in read_body(request)
+                        if 'pid' in line)
+        assert os.getpid() not in pids
+
+    def test_item_errors(self):
+        FakeConnection.reset([bulk_response(201, 400)])
+        backend = make_backend()
+
+        results = backend.process_bulk([0, 1], get_action, processes=1)
+
+        assert next(results)[0]
+        with self.assertRaises(BulkIndexError):
+            next(results)
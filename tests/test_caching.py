@@ -0,0 +1,247 @@
+from unittest.case import TestCase
+
+from django.core.cache import caches
+from elasticsearch.exceptions import TransportError
+
+from djangoes.backends.caching import (ALL_INDICES, ResultCacheInterceptor,
+                                       get_bulk_indices, split_indices)
+
+from .backend import FakeConnection, make_backend
+
+
+INDICES = {
+    'catalog': {
+        'NAME': 'catalog_v2',
+        'ALIASES': ['catalog', 'catalog_public'],
+    },
+    'users': {
+        'NAME': 'users',
+        'ALIASES': [],
+    },
+}
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        caches['default'].clear()
+
+    def make_backend(self, indices=INDICES, alias='default', **options):
+        options.setdefault('REFRESH_WINDOW', 0)
+        return make_backend(alias=alias, indices=indices,
+                            RESULT_CACHE=options)
+
+    def get_interceptor(self, backend):
+        (interceptor,) = [interceptor for interceptor in backend.interceptors
+                          if isinstance(interceptor, ResultCacheInterceptor)]
+        return interceptor
+
+    def test_disabled(self):
+        for options in (None, False, {}):
+            backend = make_backend(RESULT_CACHE=options)
+
+            assert not any(isinstance(interceptor, ResultCacheInterceptor)
+                           for interceptor in backend.interceptors)
+
+    def test_cached(self):
+        FakeConnection.reset([(200, {'hits': {'total': 1}}),
+                              (200, {'hits': {'total': 2}})])
+        backend = self.make_backend()
+
+        first = backend.search(body={'query': {'match_all': {}}})
+        second = backend.search(body={'query': {'match_all': {}}})
+
+        assert first == second == {'hits': {'total': 1}}
+        assert len(FakeConnection.requests) == 1
+
+    def test_different_queries(self):
+        backend = self.make_backend()
+
+        backend.search(body={'query': {'match_all': {}}})
+        backend.search(body={'query': {'term': {'a': 1}}})
+        backend.count()
+        backend.get('1')
+        backend.get('2')
+
+        assert len(FakeConnection.requests) == 5
+
+    def test_not_cached_method(self):
+        backend = self.make_backend(METHODS=['count'])
+
+        backend.search()
+        backend.search()
+
+        assert len(FakeConnection.requests) == 2
+
+    def test_timeout(self):
+        backend = self.make_backend(TIMEOUT=0)
+
+        backend.count()
+        backend.count()
+
+        assert len(FakeConnection.requests) == 2
+
+    def test_write_invalidates(self):
+        backend = self.make_backend()
+
+        backend.count()
+        backend.index('doc', {'a': 1}, doc_id='1')
+        backend.count()
+        backend.count()
+
+        assert [request[2] for request in FakeConnection.requests] == [
+            '/%s/_count' % backend.indices_param,
+            '/%s/doc/1' % backend.indices_param,
+            '/%s/_count' % backend.indices_param,
+        ]
+
+    def test_refresh_window(self):
+        """Assert a read before the refresh of the index is not cached under
+        the new generation."""
+        FakeConnection.reset([(200, {'count': 1}), (200, {}),
+                              (200, {'count': 1}), (200, {'count': 2}),
+                              (200, {'count': 3})])
+        backend = self.make_backend(REFRESH_WINDOW=60)
+        interceptor = self.get_interceptor(backend)
+
+        backend.count()
+        backend.index('doc', {'a': 1}, doc_id='1')
+
+        # Not refreshed yet: the old count is not cached.
+        assert backend.count() == {'count': 1}
+        assert backend.count() == {'count': 2}
+
+        # End of the refresh window.
+        caches['default'].delete_many([
+            interceptor.get_refresh_key(name)
+            for name in interceptor.get_index_names(['catalog', 'users'])])
+
+        assert backend.count() == {'count': 3}
+        assert backend.count() == {'count': 3}
+        assert len(FakeConnection.requests) == 5
+
+    def test_write_other_index(self):
+        """Assert a write invalidates only the queries of its indices."""
+        users = self.make_backend({'users': INDICES['users']})
+        catalog = self.make_backend({'catalog': INDICES['catalog']})
+
+        users.count()
+        catalog.count()
+        # The name of the index shares the generation of its aliases.
+        catalog.bulk([{'delete': {'_index': 'catalog_v2', '_id': '1'}}],
+                     index='catalog_v2')
+        users.count()
+        catalog.count()
+
+        assert [request[2] for request in FakeConnection.requests] == [
+            '/users/_count',
+            '/%s/_count' % catalog.indices_param,
+            '/catalog_v2/_bulk',
+            '/%s/_count' % catalog.indices_param,
+        ]
+
+    def test_write_all(self):
+        backend = self.make_backend()
+        users = self.make_backend({'users': INDICES['users']})
+
+        users.count()
+        backend.mget({'docs': []}, index='*')
+        backend.bulk([{'index': {'_index': 'a'}}, {'a': 1}], index='_all')
+        users.count()
+
+        assert len(FakeConnection.requests) == 4
+
+    def test_bulk(self):
+        users = self.make_backend({'users': INDICES['users']})
+
+        users.count()
+        users.bulk([{'index': {'_index': 'users', '_type': 'doc'}},
+                    {'a': 1}], index='catalog')
+        users.count()
+
+        assert len(FakeConnection.requests) == 3
+
+    def test_failed_write_invalidates(self):
+        FakeConnection.reset([(200, {}), (400, {})])
+        backend = self.make_backend()
+
+        backend.count()
+        with self.assertRaises(TransportError):
+            backend.index('doc', {'a': 1})
+        backend.count()
+
+        assert len(FakeConnection.requests) == 3
+
+    def test_other_connection(self):
+        """Assert the writes of a connection invalidate the results cached
+        by the other connections using the same indices."""
+        replica = self.make_backend(alias='replica')
+        primary = self.make_backend()
+
+        replica.count()
+        primary.index('doc', {'a': 1})
+        replica.count()
+
+        assert len(FakeConnection.requests) == 3
+
+    def test_other_connection_not_cached(self):
+        """Assert a connection invalidates the results of the others without
+        caching its own results."""
+        replica = self.make_backend(alias='replica')
+        primary = self.make_backend(METHODS=[])
+
+        replica.count()
+        primary.count()
+        primary.count()
+        primary.index('doc', {'a': 1})
+        replica.count()
+
+        assert len(FakeConnection.requests) == 5
+
+    def test_shared_by_backends(self):
+        """Assert the cache and the generations are shared by backends."""
+        first = self.make_backend()
+        second = self.make_backend()
+
+        first.count()
+        second.count()
+        second.index('doc', {'a': 1})
+        first.count()
+
+        assert len(FakeConnection.requests) == 3
+
+    def test_evicted_generation(self):
+        backend = self.make_backend()
+        interceptor = self.get_interceptor(backend)
+
+        (generation,) = interceptor.get_generations(['users'])
+        caches['default'].delete(interceptor.get_generation_key('users'))
+        interceptor.increment(['users'])
+
+        assert interceptor.get_generations(['users'])[0] >= generation
+
+    def test_get_index_names(self):
+        interceptor = self.get_interceptor(self.make_backend())
+
+        assert interceptor.get_index_names(
+            ['catalog', 'catalog_v2', 'catalog_public', 'other']) == [
+                'catalog', 'other']
+        assert interceptor.get_index_names(['users', 'cat*']) == [
+            ALL_INDICES, 'users']
+
+    def test_split_indices(self):
+        assert split_indices(None) == []
+        assert split_indices('a,b, c') == ['a', 'b', 'c']
+        assert split_indices(['a', 'b']) == ['a', 'b']
+
+    def test_get_bulk_indices(self):
+        assert get_bulk_indices([
+            {'index': {'_index': 'a', '_type': 'doc'}},
+            {'field': 1},
+            {'delete': {'_index': 'b', '_id': '1'}},
+            {'update': {'_id': '2'}},
+            {'doc': {'a': 1}},
+        ]) == ['a', 'b']
+        assert get_bulk_indices(
+            '{"index": {"_index": "a"}}\n{"field": 1}\n') == ['a']
+        assert get_bulk_indices(b'{"delete": {"_index": "b"}}\n') == ['b']
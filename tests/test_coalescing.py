@@ -0,0 +1,177 @@
+from threading import Event, Thread
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from elasticsearch.exceptions import TransportError
+
+from djangoes.backends.coalescing import CoalescingInterceptor, flights
+
+from .backend import FakeBackend, FakeConnection, make_backend
+
+
+class BlockingConnection(FakeConnection):
+    """Connection whose requests wait until ``release`` is set."""
+    release = Event()
+    started = Event()
+
+    def perform_request(self, *args, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return super(BlockingConnection, self).perform_request(
+            *args, **kwargs)
+
+
+class BlockingBackend(FakeBackend):
+    connection_class = BlockingConnection
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class InterruptedConnection(BlockingConnection):
+    """Connection whose first request is interrupted once released."""
+    interrupted = []
+
+    def perform_request(self, *args, **kwargs):
+        if not self.interrupted:
+            self.interrupted.append(self.host)
+            self.started.set()
+            self.release.wait(5)
+            raise Interrupted()
+        return super(InterruptedConnection, self).perform_request(
+            *args, **kwargs)
+
+
+class InterruptedBackend(FakeBackend):
+    connection_class = InterruptedConnection
+
+
+class TestCoalescing(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        flights.reset()
+        BlockingConnection.release = Event()
+        BlockingConnection.started = Event()
+        InterruptedConnection.interrupted = []
+
+    def tearDown(self):
+        BlockingConnection.release.set()
+
+    def perform_concurrently(self, backend, *calls):
+        """Perform the first call, then the others while it is in flight,
+        and return the results (or errors) of all of them."""
+        results = [None] * len(calls)
+
+        def perform(index, call):
+            try:
+                results[index] = call(backend)
+            except BaseException as e:  #pylint: disable=broad-except
+                results[index] = e
+
+        threads = [Thread(target=perform, args=(index, call))
+                   for index, call in enumerate(calls)]
+        threads[0].start()
+        assert BlockingConnection.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # Let the followers join the flight.
+        for _ in range(100):
+            if len(flights._flights) and all(
+                    flight.followers == len(calls) - 1
+                    for flight in flights._flights.values()):
+                break
+            Event().wait(0.01)
+        BlockingConnection.release.set()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, CoalescingInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_coalesced(self):
+        FakeConnection.reset([(200, {'hits': {'total': 3}})])
+        backend = make_backend(BlockingBackend, COALESCE=True)
+
+        def search(backend):
+            return backend.search(body={'query': {'match_all': {}}})
+
+        results = self.perform_concurrently(backend, search, search, search)
+
+        assert len(FakeConnection.requests) == 1
+        assert results == [{'hits': {'total': 3}}] * 3
+        # Each caller has its own result.
+        assert results[0] is not results[1]
+        assert results[1] is not results[2]
+        assert flights._flights == {}
+
+    def test_error(self):
+        FakeConnection.reset([(503, {})])
+        backend = make_backend(BlockingBackend, COALESCE=True,
+                               PARAMS={'max_retries': 0})
+
+        def count(backend):
+            return backend.count()
+
+        results = self.perform_concurrently(backend, count, count)
+
+        assert len(FakeConnection.requests) == 1
+        assert all(isinstance(result, TransportError) for result in results)
+
+    def test_sequential(self):
+        """Assert only concurrent queries are coalesced."""
+        BlockingConnection.release.set()
+        backend = make_backend(BlockingBackend, COALESCE=True)
+
+        backend.search()
+        backend.search()
+
+        assert len(FakeConnection.requests) == 2
+
+    def test_not_coalesced_method(self):
+        BlockingConnection.release.set()
+        backend = make_backend(BlockingBackend,
+                               COALESCE={'METHODS': ['search']})
+
+        backend.count()
+        backend.count()
+
+        assert len(FakeConnection.requests) == 2
+
+    def test_leader_interrupted(self):
+        """Assert the followers perform the query on their own when the
+        leader is interrupted."""
+        FakeConnection.reset([(200, {'count': 1}), (200, {'count': 1})])
+        backend = make_backend(InterruptedBackend, COALESCE=True)
+
+        def count(backend):
+            return backend.count()
+
+        results = self.perform_concurrently(backend, count, count, count)
+
+        assert isinstance(results[0], Interrupted)
+        assert results[1:] == [{'count': 1}] * 2
+        assert len(FakeConnection.requests) == 2
+        assert flights._flights == {}
+
+    def test_timeout(self):
+        """Assert a follower performs the query on its own once it has waited
+        for too long."""
+        backend = make_backend(BlockingBackend, COALESCE={'TIMEOUT': 0.01})
+        leader = Thread(target=backend.count)
+        leader.start()
+        assert BlockingConnection.started.wait(5)
+
+        with patch.object(BlockingConnection, 'perform_request',
+                          FakeConnection.perform_request):
+            result = backend.count()
+
+        BlockingConnection.release.set()
+        leader.join()
+        assert result == {}
+        assert len(FakeConnection.requests) == 2
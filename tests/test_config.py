@@ -0,0 +1,155 @@
+from unittest.case import TestCase
+
+from djangoes import ConnectionHandler
+from djangoes.config import IndexConfig, ServerConfig
+
+from .backend import ConnectionWrapper
+
+
+class TestIndexConfig(TestCase):
+    def test_config(self):
+        index = {
+            'NAME': 'index_name',
+            'ALIASES': ['alias_1', 'alias_2'],
+            'SETTINGS': None,
+        }
+        config = IndexConfig('index', index)
+
+        assert config.alias == 'index'
+        assert config.name == 'index_name'
+        assert config.aliases == ('alias_1', 'alias_2')
+        assert config.usage_names == ('alias_1', 'alias_2')
+        assert config.settings_dict == index
+        # The settings are copied.
+        index['NAME'] = 'other_name'
+        assert config.settings_dict['NAME'] == 'index_name'
+
+    def test_usage_names_without_aliases(self):
+        config = IndexConfig('index', {
+            'NAME': 'index_name',
+            'ALIASES': [],
+            'SETTINGS': None,
+        })
+
+        assert config.usage_names == ('index_name',)
+
+    def test_immutable(self):
+        config = IndexConfig('index', {
+            'NAME': 'index_name',
+            'ALIASES': [],
+            'SETTINGS': None,
+        })
+
+        with self.assertRaises(AttributeError):
+            config.name = 'other_name'
+
+        with self.assertRaises(AttributeError):
+            del config.name
+
+        with self.assertRaises(TypeError):
+            config.settings_dict['NAME'] = 'other_name'
+
+
+class TestServerConfig(TestCase):
+    def test_config(self):
+        server = {
+            'ENGINE': 'tests.backend.ConnectionWrapper',
+            'SHARED': True,
+        }
+        indices = {
+            'index_1': {
+                'NAME': 'index_1',
+                'ALIASES': ['alias_1', 'alias_2'],
+                'SETTINGS': None,
+            },
+            'index_2': {
+                'NAME': 'index_2',
+                'ALIASES': ['alias_2', 'alias_3'],
+                'SETTINGS': None,
+            },
+            'index_3': {
+                'NAME': 'index_3',
+                'ALIASES': [],
+                'SETTINGS': None,
+            },
+        }
+        config = ServerConfig('default', server, indices, ConnectionWrapper)
+
+        assert config.shared is True
+        assert config.backend_class is ConnectionWrapper
+        assert config.indices == ('alias_1', 'alias_2', 'alias_3', 'index_3')
+        assert config.index_names == ('index_1', 'index_2', 'index_3')
+        assert config.alias_names == ('alias_1', 'alias_2', 'alias_3')
+        assert config.indices_param == 'alias_1,alias_2,alias_3,index_3'
+        assert config.server_indices == indices
+
+        with self.assertRaises(AttributeError):
+            config.indices = ('other',)
+
+
+class TestHandlerConfig(TestCase):
+    """Assert how ConnectionHandler compiles the configuration."""
+
+    def get_handler(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'INDICES': ['index'],
+            }
+        }
+        indices = {
+            'index': {
+                'ALIASES': ['alias'],
+            }
+        }
+        return ConnectionHandler(servers, indices)
+
+    def test_get_config(self):
+        handler = self.get_handler()
+
+        config = handler.get_config('default')
+
+        assert config.alias == 'default'
+        assert config.backend_class is ConnectionWrapper
+        assert config.indices == ('alias',)
+        assert handler.get_config('default') is config
+
+    def test_load_backend(self):
+        """Assert backends are built from the compiled configuration."""
+        handler = self.get_handler()
+
+        conn = handler.load_backend('default')
+
+        assert isinstance(conn, ConnectionWrapper)
+        assert conn.indices == ['alias']
+        assert conn.index_names == ['index']
+        assert conn.alias_names == ['alias']
+        assert conn.indices_param == 'alias'
+        # Each backend has its own lists.
+        assert handler.load_backend('default').indices is not conn.indices
+
+    def test_delete_resets_config(self):
+        handler = self.get_handler()
+
+        config = handler.get_config('default')
+        handler['default']
+        del handler['default']
+
+        assert handler.get_config('default') is not config
+
+    def test_set_config(self):
+        handler = self.get_handler()
+        conn = handler['default']
+
+        conn.server_indices = {
+            'index': {
+                'NAME': 'test_index',
+                'ALIASES': ['test_alias'],
+                'SETTINGS': None,
+            }
+        }
+        conn.refresh_indices()
+        handler.set_config(conn)
+
+        assert conn.indices_param == 'test_alias'
+        assert handler.load_backend('default').indices == ['test_alias']
@@ -1,4 +1,7 @@
-from unittest.case import TestCase
+import os
+from threading import Event, Thread
+from unittest.case import TestCase, skipUnless
+from unittest.mock import patch
 
 from django.core.exceptions import ImproperlyConfigured
 from django.test.utils import override_settings
@@ -10,6 +13,8 @@ from djangoes import (ConnectionHandler,
 from djangoes.backends.abstracts import Base
 from djangoes.backends import elasticsearch
 
+from .backend import ConnectionWrapper
+
 
 class TestConnectionHandler(TestCase):
     """Test the ConnectionHandler class.
@@ -623,3 +628,255 @@ class TestProxyConnectionHandler(TestCase):
 
         assert connection == connections['default']
         assert not (connection != connections['default'])
+
+    def get_proxy(self):
+        import djangoes
+
+        djangoes.connections = ConnectionHandler({
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper'
+            }
+        }, {})
+
+        return djangoes.ConnectionProxy('default')
+
+    def test_cached_methods(self):
+        """Assert bound methods are resolved once per connection."""
+        import djangoes
+        proxy = self.get_proxy()
+
+        method = proxy.get_indices
+
+        assert method == djangoes.connections['default'].get_indices
+        assert proxy.get_indices is method
+
+    def test_instance_attribute(self):
+        """Assert an attribute set on the connection overrides the cache."""
+        import djangoes
+        proxy = self.get_proxy()
+        conn = djangoes.connections['default']
+        proxy.get_indices
+
+        with patch.object(conn, 'get_indices', return_value=['patched']):
+            assert proxy.get_indices() == ['patched']
+
+        assert proxy.get_indices() == []
+
+    def test_connection_replaced(self):
+        """Assert the proxy follows the connections of the handler."""
+        import djangoes
+        proxy = self.get_proxy()
+        conn = djangoes.connections['default']
+        method = proxy.get_indices
+
+        del djangoes.connections['default']
+
+        assert proxy != conn
+        assert proxy.get_indices is not method
+
+        other_conn = ConnectionWrapper('default', {}, {})
+        djangoes.connections['default'] = other_conn
+
+        assert proxy == other_conn
+
+        # After a fork, connections are reset.
+        djangoes.connections.reset_connections()
+
+        assert proxy != other_conn
+
+    def test_handler_replaced(self):
+        import djangoes
+        proxy = self.get_proxy()
+        conn = djangoes.connections['default']
+
+        self.get_proxy()
+
+        assert proxy != conn
+        assert proxy == djangoes.connections['default']
+
+    def test_cached_in_proxy(self):
+        """Assert a cached method is an attribute of the proxy, for the
+        current thread only."""
+        proxy = self.get_proxy()
+        method = proxy.get_indices
+        result = []
+
+        assert proxy.__dict__['get_indices'] is method
+
+        thread = Thread(target=lambda: result.append(dict(proxy.__dict__)))
+        thread.start()
+        thread.join()
+
+        assert result == [{'alias': 'default'}]
+
+    def test_other_threads_invalidated(self):
+        """Assert the methods cached by other threads are forgotten when the
+        connections change."""
+        import djangoes
+        proxy = self.get_proxy()
+        cached, changed = Event(), Event()
+        result = []
+
+        def target():
+            result.append(proxy.get_indices.__self__)
+            cached.set()
+            changed.wait()
+            result.append(proxy.get_indices.__self__)
+
+        thread = Thread(target=target)
+        thread.start()
+        cached.wait()
+        djangoes.connections.reset_connections()
+        changed.set()
+        thread.join()
+
+        first, second = result
+        assert first is not second
+
+    def test_threads(self):
+        """Assert each thread gets its own connection through the proxy."""
+        import djangoes
+        proxy = self.get_proxy()
+        result = []
+
+        thread = Thread(target=lambda: result.append(
+            (proxy.get_indices.__self__, djangoes.connections['default'])))
+        thread.start()
+        thread.join()
+
+        (thread_conn, thread_expected), = result
+        assert thread_conn is thread_expected
+        assert thread_conn is not djangoes.connections['default']
+        assert proxy == djangoes.connections['default']
+
+
+class TestWarmUp(TestCase):
+    """Assert how connections are warmed up before being used."""
+
+    def test_warm_up(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'INDICES': ['index'],
+            },
+            'task': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+            }
+        }
+        indices = {
+            'index': {},
+            'unused': {},
+        }
+        handler = ConnectionHandler(servers, indices)
+
+        with patch.object(ConnectionWrapper, 'warm_up') as warm_up:
+            handler.warm_up(sockets=3, sniff=True)
+
+        assert warm_up.call_count == 2
+        warm_up.assert_called_with(sockets=3, sniff=True)
+        # All indices are validated, even the ones not used.
+        assert handler.indices['unused']['TEST']['NAME'] == 'unused_test'
+
+    def test_warm_up_aliases(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+            },
+            'task': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+            }
+        }
+        handler = ConnectionHandler(servers, {})
+
+        with patch.object(ConnectionWrapper, 'warm_up') as warm_up:
+            handler.warm_up(aliases=['task'])
+
+        warm_up.assert_called_once_with(sockets=1, sniff=False)
+
+    def test_warm_up_missing_index(self):
+        """Assert invalid settings raise when warming up."""
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'INDICES': ['missing'],
+            },
+        }
+        handler = ConnectionHandler(servers, {})
+
+        with self.assertRaises(IndexDoesNotExist):
+            handler.warm_up()
+
+    def test_warm_up_invalid_engine(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.DoesNotExist',
+            },
+        }
+        handler = ConnectionHandler(servers, {})
+
+        with self.assertRaises(ImproperlyConfigured):
+            handler.warm_up()
+
+    def test_app_config(self):
+        import djangoes
+        from djangoes.apps import DjangoesConfig
+
+        app_config = DjangoesConfig('djangoes', djangoes)
+
+        with patch.object(djangoes.connections, 'warm_up') as warm_up:
+            with override_settings(ES_WARM_UP=False):
+                app_config.ready()
+
+            assert not warm_up.called
+
+            with override_settings(ES_WARM_UP=True):
+                app_config.ready()
+
+            warm_up.assert_called_once_with(aliases=None, sockets=1,
+                                            sniff=False)
+
+            with override_settings(ES_WARM_UP={'SOCKETS': 4,
+                                               'ALIASES': ['default']}):
+                app_config.ready()
+
+            warm_up.assert_called_with(aliases=['default'], sockets=4,
+                                       sniff=False)
+
+
+class TestFork(TestCase):
+    @skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_reset_after_fork(self):
+        """Assert connections are reset in the child process after a fork."""
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'SHARED': True,
+            },
+            'task': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+            }
+        }
+        handler = ConnectionHandler(servers, {})
+        conn = handler['default']
+        conn_task = handler['task']
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:  # pragma: no cover
+            try:
+                result = (handler['default'] is not conn and
+                          handler['task'] is not conn_task and
+                          handler._pid == os.getpid())
+                os.write(write_fd, b'1' if result else b'0')
+            finally:
+                os._exit(0)
+
+        os.waitpid(pid, 0)
+        assert os.read(read_fd, 1) == b'1'
+        os.close(read_fd)
+        os.close(write_fd)
+
+        # Nothing changed in the parent process.
+        assert handler['default'] is conn
+        assert handler['task'] is conn_task
@@ -0,0 +1,315 @@
+import socket
+from threading import Event, Thread, Timer, current_thread
+import time
+from unittest.case import TestCase
+
+from elasticsearch.exceptions import (ConnectionError, NotFoundError,
+                                      TransportError)
+
+from djangoes.backends.elasticsearch import SimpleHttpBackend
+from djangoes.backends.hedging import HedgingInterceptor, executors
+from djangoes.backends.instrumentation import registry
+from djangoes.backends.transport import (InterruptibleConnectionMixin,
+                                         choose_connection, interruptible)
+
+from .backend import FakeBackend, FakeConnection, make_backend
+
+
+class StallingConnection(FakeConnection):
+    """Connection whose first request waits until ``release`` is set, or
+    until it is aborted."""
+    release = Event()
+    stalled = []
+
+    def perform_request(self, *args, **kwargs):
+        if not self.stalled:
+            self.stalled.append(self.host)
+            aborted = Event()
+            with interruptible(aborted.set):
+                for _ in range(500):
+                    if self.release.is_set() or aborted.is_set():
+                        break
+                    time.sleep(0.01)
+            if aborted.is_set():
+                raise ConnectionError('N/A', 'aborted', None)
+        return super(StallingConnection, self).perform_request(
+            *args, **kwargs)
+
+
+class StallingBackend(FakeBackend):
+    connection_class = StallingConnection
+
+
+class StallingHedgeConnection(FakeConnection):
+    """Connection whose hedged requests wait until they are aborted, and
+    whose primary requests wait until a hedged request is sent."""
+    hedged = Event()
+    aborted = Event()
+
+    def perform_request(self, *args, **kwargs):
+        if current_thread().name.startswith('djangoes-hedging'):
+            self.hedged.set()
+            with interruptible(self.aborted.set):
+                self.aborted.wait(5)
+            raise ConnectionError('N/A', 'aborted', None)
+        self.hedged.wait(5)
+        return super(StallingHedgeConnection, self).perform_request(
+            *args, **kwargs)
+
+
+class StallingHedgeBackend(FakeBackend):
+    connection_class = StallingHedgeConnection
+
+
+class TestHedging(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        registry.reset()
+        StallingConnection.release = Event()
+        StallingConnection.stalled = []
+        executors.reset()
+
+    def tearDown(self):
+        StallingConnection.release.set()
+
+    def make_backend(self, **hedging):
+        hedging.setdefault('DELAY', 10)
+        return make_backend(StallingBackend,
+                            HOSTS=['host_1', 'host_2'],
+                            PARAMS={'max_retries': 0},
+                            HEDGING=hedging)
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, HedgingInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_hedged(self):
+        """Assert a slow query is sent again to the other host."""
+        FakeConnection.reset([(200, {'hits': {'total': 1}}),
+                              (200, {'hits': {'total': 2}})])
+        backend = self.make_backend()
+
+        result = backend.search()
+
+        assert result == {'hits': {'total': 1}}
+        # The primary request has been aborted, and not retried.
+        (stalled,) = StallingConnection.stalled
+        (hedge,) = [request[0] for request in FakeConnection.requests]
+        assert hedge != stalled
+        assert len(backend.client.transport.connection_pool.connections) == 2
+
+    def test_hedge_aborted(self):
+        """Assert the hedged request is aborted when the primary request
+        wins."""
+        StallingHedgeConnection.hedged = Event()
+        StallingHedgeConnection.aborted = Event()
+        FakeConnection.reset([(200, {'count': 1})])
+        backend = make_backend(StallingHedgeBackend,
+                               HOSTS=['host_1', 'host_2'],
+                               PARAMS={'max_retries': 0},
+                               HEDGING={'DELAY': 10})
+
+        result = backend.count()
+
+        assert result == {'count': 1}
+        assert StallingHedgeConnection.aborted.wait(1)
+
+    def test_transfer(self):
+        """Assert the bytes of a hedged query are counted once."""
+        FakeConnection.reset([(200, {'count': 1})])
+        backend = self.make_backend()
+
+        backend.count(body={'query': {}})
+
+        stats = registry.snapshot('default')['count']
+        assert stats['sent'] == len('{"query": {}}')
+        assert stats['received'] == len('{"count": 1}')
+
+    def test_fast(self):
+        """Assert a fast query is not hedged."""
+        StallingConnection.release.set()
+        backend = self.make_backend(DELAY=5000)
+
+        backend.get('1')
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_fast_error(self):
+        StallingConnection.release.set()
+        FakeConnection.reset([(404, {'found': False})])
+        backend = self.make_backend(DELAY=5000)
+
+        with self.assertRaises(NotFoundError):
+            backend.get('1')
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_hedge_failed(self):
+        """Assert the first query is used when the hedged one fails."""
+        FakeConnection.reset([(503, {})])
+        backend = self.make_backend()
+        timer = Timer(0.1, StallingConnection.release.set)
+        timer.start()
+
+        result = backend.count()
+
+        timer.join()
+        assert result == {}
+        assert len(FakeConnection.requests) == 2
+
+    def test_both_failed(self):
+        FakeConnection.reset([(503, {}), (502, {})])
+        backend = self.make_backend()
+        timer = Timer(0.1, StallingConnection.release.set)
+        timer.start()
+
+        with self.assertRaises(TransportError) as context:
+            backend.count()
+
+        timer.join()
+        # The error of the first query is raised.
+        assert context.exception.status_code == 502
+
+    def test_single_host(self):
+        """Assert a query is not hedged to the host it is waiting for."""
+        backend = make_backend(StallingBackend, HEDGING={'DELAY': 10})
+        timer = Timer(0.1, StallingConnection.release.set)
+        timer.start()
+
+        backend.search()
+
+        timer.join()
+        assert len(FakeConnection.requests) == 1
+
+    def test_max_hedges(self):
+        """Assert a query is not hedged when too many hedged requests are in
+        flight."""
+        backend = self.make_backend(WORKERS=1)
+        _, slots = executors.get('default', 1)
+        slots.acquire()
+        timer = Timer(0.1, StallingConnection.release.set)
+        timer.start()
+
+        try:
+            backend.search()
+        finally:
+            slots.release()
+
+        timer.join()
+        assert len(FakeConnection.requests) == 1
+
+    def test_not_hedged_method(self):
+        StallingConnection.release.set()
+        backend = self.make_backend()
+
+        backend.bulk([{'index': {}}, {'a': 1}])
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_percentile_delay(self):
+        backend = self.make_backend(PERCENTILE=50, MIN_CALLS=2)
+        (interceptor,) = [interceptor for interceptor in backend.interceptors
+                          if isinstance(interceptor, HedgingInterceptor)]
+        query = type('Query', (), {'alias': 'default', 'method': 'search'})
+
+        assert interceptor.get_delay(query) == 10
+        registry.record('default', 'search', 4, 0, 0, False)
+        assert interceptor.get_delay(query) == 10
+        registry.record('default', 'search', 4, 0, 0, False)
+        assert interceptor.get_delay(query) == 4
+
+
+class TestChooseConnection(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_excluded(self):
+        backend = make_backend(HOSTS=['host_1', 'host_2'])
+        connections = backend.client.transport.connection_pool.connections
+
+        for connection in connections:
+            with choose_connection([connection]) as choice:
+                backend.ping()
+            assert choice.used is not connection
+            assert FakeConnection.requests[-1][0] == choice.used.host
+
+    def test_no_other(self):
+        backend = make_backend()
+        (connection,) = backend.client.transport.connection_pool.connections
+
+        with choose_connection([connection]) as choice:
+            backend.ping()
+
+        assert choice.used is connection
+
+
+class TestAbortRequest(TestCase):
+    """Assert a hedged request aborts the primary request on its socket."""
+    def setUp(self):
+        registry.reset()
+        executors.reset()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.peers = []
+        self.thread = Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close()
+        for peer in self.peers:
+            peer.close()
+
+    def serve(self):
+        """Never respond to the first request, and respond to the others."""
+        body = b'{"hits": {"total": 1}}'
+        while True:
+            try:
+                peer, _ = self.server.accept()
+            except OSError:
+                return
+            self.peers.append(peer)
+            peer.recv(65536)
+            if len(self.peers) > 1:
+                peer.sendall(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (
+                                 len(body), body))
+
+    def test_interruptible(self):
+        """Assert only the connections of a backend with hedging are made
+        interruptible."""
+        port = self.server.getsockname()[1]
+        for hedging, interruptible_cls in ((None, False),
+                                           ({'DELAY': 10}, True)):
+            backend = SimpleHttpBackend('default', {
+                'HOSTS': ['127.0.0.1:%s' % port, 'localhost:%s' % port],
+                'PARAMS': {},
+                'HEDGING': hedging,
+            }, {})
+            backend.configure_client()
+            for connection in (
+                    backend.client.transport.connection_pool.connections):
+                assert issubclass(connection.pool.ConnectionCls,
+                                  InterruptibleConnectionMixin) == (
+                                      interruptible_cls)
+            backend.close()
+
+    def test_abort(self):
+        port = self.server.getsockname()[1]
+        backend = SimpleHttpBackend('default', {
+            'HOSTS': ['127.0.0.1:%s' % port, 'localhost:%s' % port],
+            'PARAMS': {'timeout': 5},
+            'HEDGING': {'DELAY': 10},
+        }, {})
+        backend.configure_client()
+
+        start = time.monotonic()
+        result = backend.search()
+
+        assert result == {'hits': {'total': 1}}
+        assert time.monotonic() - start < 2
+        # The host of the primary request is not marked as dead.
+        assert len(backend.client.transport.connection_pool.connections) == 2
@@ -0,0 +1,170 @@
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from elasticsearch.exceptions import NotFoundError
+
+import djangoes
+from djangoes.backends.instrumentation import (LATENCY_BUCKETS, MethodStats,
+                                               StatsInterceptor, registry)
+from djangoes.backends.transport import (MeasuredTransport, get_size,
+                                         measure_transfer)
+from djangoes.signals import query_finished
+
+from .backend import FakeConnection, make_backend
+
+
+class TestMethodStats(TestCase):
+    def test_empty(self):
+        stats = MethodStats().as_dict()
+
+        assert stats['calls'] == 0
+        assert stats['mean_time'] is None
+        assert stats['p50'] is None
+        assert sum(stats['histogram'].values()) == 0
+
+    def test_record(self):
+        stats = MethodStats()
+
+        stats.record(0.5, 10, 100, False)
+        stats.record(3, 20, 200, True)
+        stats.record(20000, 0, 0, True)
+
+        result = stats.as_dict()
+        assert result['calls'] == 3
+        assert result['errors'] == 2
+        assert result['sent'] == 30
+        assert result['received'] == 300
+        assert result['max_time'] == 20000
+        assert result['histogram']['1'] == 1
+        assert result['histogram']['5'] == 1
+        assert result['histogram']['+Inf'] == 1
+        assert len(result['histogram']) == len(LATENCY_BUCKETS) + 1
+
+    def test_percentile(self):
+        stats = MethodStats()
+        for _ in range(90):
+            stats.record(4, 0, 0, False)
+        for _ in range(10):
+            stats.record(80, 0, 0, False)
+
+        assert stats.percentile(50) == 5
+        assert stats.percentile(90) == 5
+        assert stats.percentile(95) == 80
+        assert stats.percentile(100) == 80
+
+
+class TestTransfer(TestCase):
+    def test_get_size(self):
+        assert get_size('abc') == 3
+        assert get_size('é') == 2
+        assert get_size(b'abc') == 3
+
+    def test_measured_transport(self):
+        FakeConnection.reset([(200, {'hits': {}})])
+        transport = MeasuredTransport([{}], connection_class=FakeConnection)
+
+        with measure_transfer() as transfer:
+            transport.perform_request('GET', '/_search', body={'a': 1})
+
+        assert transfer.sent == len('{"a": 1}')
+        assert transfer.received == len('{"hits": {}}')
+
+    def test_without_measure(self):
+        FakeConnection.reset()
+        transport = MeasuredTransport([{}], connection_class=FakeConnection)
+
+        assert transport.perform_request('GET', '/') == (200, {})
+
+
+class TestStatsInterceptor(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        registry.reset()
+
+    def test_enabled(self):
+        backend = make_backend(STATS=True)
+
+        assert any(isinstance(interceptor, StatsInterceptor)
+                   for interceptor in backend.interceptors)
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, StatsInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_enabled_with_hedging(self):
+        backend = make_backend(HEDGING={'DELAY': 10})
+
+        assert any(isinstance(interceptor, StatsInterceptor)
+                   for interceptor in backend.interceptors)
+
+        backend = make_backend(HEDGING={'DELAY': 10}, STATS=False)
+
+        assert not any(isinstance(interceptor, StatsInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_stats(self):
+        FakeConnection.reset([(200, {'count': 4}), (200, {'count': 5}),
+                              (404, {'found': False})])
+        backend = make_backend(STATS=True)
+
+        backend.count(body={'query': {}})
+        backend.count()
+        with self.assertRaises(NotFoundError):
+            backend.get('42')
+
+        stats = djangoes.connections.stats()
+        count_stats = stats['default']['count']
+        assert count_stats['calls'] == 2
+        assert count_stats['errors'] == 0
+        assert count_stats['sent'] == len('{"query": {}}')
+        assert count_stats['received'] == (len('{"count": 4}') +
+                                           len('{"count": 5}'))
+        assert stats['default']['get']['errors'] == 1
+        assert djangoes.connections.stats('default') == stats['default']
+        assert djangoes.connections.stats('other') == {}
+
+        djangoes.connections.reset_stats()
+
+        assert djangoes.connections.stats() == {}
+
+    def test_latency(self):
+        backend = make_backend(STATS=True)
+
+        with patch('djangoes.backends.instrumentation.time.perf_counter',
+                   side_effect=[10.0, 10.042]):
+            backend.search()
+
+        stats = djangoes.connections.stats('default')['search']
+        assert round(stats['total_time']) == 42
+        assert stats['histogram']['50'] == 1
+
+    def test_signal(self):
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+
+        FakeConnection.reset([(200, {'count': 1})])
+        backend = make_backend(STATS=True)
+        query_finished.connect(receiver)
+        self.addCleanup(query_finished.disconnect, receiver)
+
+        backend.count()
+
+        (kwargs,) = received
+        assert kwargs['alias'] == 'default'
+        assert kwargs['method'] == 'count'
+        assert kwargs['received'] == len('{"count": 1}')
+        assert kwargs['exception'] is None
+        assert kwargs['duration'] >= 0
+
+    def test_signal_without_receivers(self):
+        backend = make_backend(STATS=True)
+
+        with patch.object(query_finished, 'send') as send:
+            backend.count()
+
+        assert not send.called
+        assert djangoes.connections.stats('default')['count']['calls'] == 1
@@ -0,0 +1,158 @@
+from unittest.case import TestCase
+
+from djangoes.backends.interceptors import (Interceptor, Query,
+                                            build_interceptors)
+
+from .backend import FakeBackend, FakeConnection, make_backend
+
+
+class RecordInterceptor(Interceptor):
+    """Record the queries it intercepts in the class attribute ``seen``."""
+    seen = []
+
+    def intercept(self, query):
+        self.seen.append((self.__class__.__name__, query.method))
+        return query.proceed()
+
+
+class OuterInterceptor(RecordInterceptor):
+    pass
+
+
+class InnerInterceptor(RecordInterceptor):
+    pass
+
+
+class DisabledInterceptor(Interceptor):
+    @classmethod
+    def from_backend(cls, backend):
+        return None
+
+
+class TwiceInterceptor(Interceptor):
+    """Proceed twice with each query, and return both results."""
+    def intercept(self, query):
+        return [query.proceed(), query.proceed()]
+
+
+class ShortcutInterceptor(Interceptor):
+    """Answer without calling the client."""
+    def intercept(self, query):
+        return 'shortcut'
+
+
+class InterceptedBackend(FakeBackend):
+    interceptor_classes = [OuterInterceptor, DisabledInterceptor,
+                           'tests.test_interceptors.InnerInterceptor']
+
+
+class TestInterceptors(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        RecordInterceptor.seen = []
+
+    def test_build_interceptors(self):
+        backend = make_backend(InterceptedBackend)
+
+        interceptors = build_interceptors(
+            backend, InterceptedBackend.interceptor_classes)
+
+        assert [type(i) for i in interceptors] == [OuterInterceptor,
+                                                   InnerInterceptor]
+        assert all(i.backend is backend for i in interceptors)
+        assert [type(i) for i in backend.interceptors] == [OuterInterceptor,
+                                                           InnerInterceptor]
+
+    def test_order(self):
+        FakeConnection.reset([(200, {'count': 4})])
+        backend = make_backend(InterceptedBackend)
+
+        assert backend.count() == {'count': 4}
+        assert RecordInterceptor.seen == [('OuterInterceptor', 'count'),
+                                          ('InnerInterceptor', 'count')]
+        assert len(FakeConnection.requests) == 1
+
+    def test_proceed_twice(self):
+        """Assert the next interceptors are called again by each proceed."""
+        FakeConnection.reset([(200, {'count': 1}), (200, {'count': 2})])
+        backend = make_backend(InterceptedBackend)
+        backend.interceptors = (TwiceInterceptor(backend),
+                                InnerInterceptor(backend))
+
+        assert backend.count() == [{'count': 1}, {'count': 2}]
+        assert RecordInterceptor.seen == [('InnerInterceptor', 'count'),
+                                          ('InnerInterceptor', 'count')]
+
+    def test_shortcut(self):
+        backend = make_backend(InterceptedBackend)
+        backend.interceptors = (ShortcutInterceptor(backend),
+                                InnerInterceptor(backend))
+
+        assert backend.search() == 'shortcut'
+        assert RecordInterceptor.seen == []
+        assert FakeConnection.requests == []
+
+    def test_no_interceptor(self):
+        backend = make_backend()
+        backend.interceptors = ()
+
+        assert backend.count() == {}
+        assert len(FakeConnection.requests) == 1
+
+
+class TestQuery(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def get_query(self, *args, **kwargs):
+        backend = make_backend()
+        return Query(backend, 'search', FakeBackend.search.__wrapped__,
+                     args, kwargs, ())
+
+    def test_arguments(self):
+        query = self.get_query('doc', {'query': {}}, size=10)
+
+        assert query.alias == 'default'
+        assert query.arguments == {
+            'doc_type': 'doc',
+            'body': {'query': {}},
+            'size': 10,
+        }
+
+    def test_copy(self):
+        query = self.get_query(body={'query': {}})
+        query.position = 1
+
+        copy = query.copy()
+
+        assert copy.position == 1
+        assert copy.kwargs == query.kwargs
+        assert copy.kwargs is not query.kwargs
+
+    def test_indices(self):
+        assert self.get_query().indices == 'index'
+        assert self.get_query(index='other').indices == 'other'
+
+    def test_fingerprint(self):
+        fingerprint = self.get_query(
+            'doc', {'query': {'term': {'a': 1}}, 'size': 10}).fingerprint()
+
+        # Same query, with the keys in another order.
+        assert self.get_query(
+            doc_type='doc',
+            body={'size': 10, 'query': {'term': {'a': 1}}},
+        ).fingerprint() == fingerprint
+        # Same indices, given explicitly.
+        assert self.get_query(
+            'doc', {'query': {'term': {'a': 1}}, 'size': 10},
+            index='index').fingerprint() == fingerprint
+
+        assert self.get_query(
+            'doc', {'query': {'term': {'a': 2}}, 'size': 10},
+        ).fingerprint() != fingerprint
+        assert self.get_query(
+            'doc', {'query': {'term': {'a': 1}}, 'size': 10},
+            index='other').fingerprint() != fingerprint
+        assert self.get_query(
+            'doc', {'query': {'term': {'a': 1}}, 'size': 10},
+            routing='1').fingerprint() != fingerprint
@@ -0,0 +1,214 @@
+import gc
+import os
+import socket
+from unittest import skipUnless
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from django.core.signals import request_finished, request_started
+
+import djangoes
+from djangoes import ConnectionHandler
+from djangoes.backends.elasticsearch import (PooledHttpBackend,
+                                             SimpleHttpBackend)
+
+from .backend import ConnectionWrapper
+
+
+class ClosingWrapper(ConnectionWrapper):
+    def __init__(self, *args, **kwargs):
+        super(ClosingWrapper, self).__init__(*args, **kwargs)
+        self.closed = False
+        self.flushed = 0
+
+    def close(self):
+        self.closed = True
+
+    def flush_writes(self):
+        self.flushed += 1
+
+
+def get_handler(**options):
+    server = {
+        'ENGINE': 'tests.test_lifecycle.ClosingWrapper',
+    }
+    server.update(options)
+    return ConnectionHandler({'default': server, 'other': dict(server)}, {})
+
+
+class TestMaxAge(TestCase):
+    def test_no_max_age(self):
+        conn = ConnectionWrapper('default', {}, {})
+
+        assert conn.close_at is None
+        assert not conn.is_obsolete()
+
+    def test_max_age(self):
+        with patch('djangoes.backends.abstracts.time.monotonic',
+                   return_value=100):
+            conn = ConnectionWrapper('default', {'CONN_MAX_AGE': 60}, {})
+
+        assert conn.close_at == 160
+
+        with patch('djangoes.backends.abstracts.time.monotonic',
+                   return_value=159):
+            assert not conn.is_obsolete()
+
+        with patch('djangoes.backends.abstracts.time.monotonic',
+                   return_value=160):
+            assert conn.is_obsolete()
+
+    def test_max_age_zero(self):
+        conn = ConnectionWrapper('default', {'CONN_MAX_AGE': 0}, {})
+
+        assert conn.is_obsolete()
+
+
+class TestCloseConnections(TestCase):
+    """Assert how ConnectionHandler closes connections."""
+
+    def test_close_all(self):
+        handler = get_handler()
+        conn = handler['default']
+        other = handler['other']
+
+        handler.close_all()
+
+        assert conn.closed
+        assert other.closed
+        assert handler['default'] is not conn
+
+    def test_close_all_shared(self):
+        """Assert shared connections are discarded but not closed."""
+        handler = get_handler(SHARED=True)
+        conn = handler['default']
+
+        handler.close_all()
+
+        assert not conn.closed
+        assert handler['default'] is not conn
+
+    def test_close_obsolete(self):
+        handler = get_handler()
+        handler.servers['other']['CONN_MAX_AGE'] = 0
+        conn = handler['default']
+        other = handler['other']
+
+        handler.close_obsolete()
+
+        assert not conn.closed
+        assert other.closed
+        assert handler['default'] is conn
+        assert handler['other'] is not other
+
+    def test_close_obsolete_shared(self):
+        handler = get_handler(SHARED=True, CONN_MAX_AGE=0)
+        conn = handler['default']
+
+        handler.close_obsolete()
+
+        assert not conn.closed
+        assert handler['default'] is not conn
+
+    def test_request_signals(self):
+        """Assert obsolete connections are closed around each request."""
+        djangoes.connections = get_handler(CONN_MAX_AGE=0)
+        conn = djangoes.connections['default']
+
+        request_finished.send(sender=self.__class__)
+
+        assert conn.closed
+
+        conn = djangoes.connections['default']
+        request_started.send(sender=self.__class__)
+
+        assert conn.closed
+
+    def test_flush_writes(self):
+        """Assert buffered writes are flushed at the end of each request."""
+        djangoes.connections = get_handler()
+        conn = djangoes.connections['default']
+
+        request_started.send(sender=self.__class__)
+        assert conn.flushed == 0
+
+        request_finished.send(sender=self.__class__)
+        assert conn.flushed == 1
+        assert not conn.closed
+
+
+class TestCloseBackend(TestCase):
+    def get_backend(self):
+        server = {
+            'HOSTS': ['host_1', 'host_2'],
+            'PARAMS': {},
+        }
+        backend = SimpleHttpBackend('default', server, {})
+        backend.configure_client()
+        return backend
+
+    def get_pools(self, backend):
+        pool = backend.client.transport.connection_pool
+        return [connection.pool for connection in pool.connections]
+
+    def test_close(self):
+        backend = self.get_backend()
+        pools = self.get_pools(backend)
+
+        backend.close()
+        # Closing twice does nothing.
+        backend.close()
+
+        assert all(pool.pool is None for pool in pools)
+
+    def test_garbage_collected(self):
+        """Assert sockets are closed when the backend is garbage collected."""
+        backend = self.get_backend()
+        pools = self.get_pools(backend)
+
+        del backend
+        gc.collect()
+
+        assert all(pool.pool is None for pool in pools)
+
+    @skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_not_closed_after_fork(self):
+        """Assert a child process never closes the sockets of its parent."""
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+
+        backend = PooledHttpBackend('default', {
+            'HOSTS': ['127.0.0.1:%s' % server.getsockname()[1]],
+            'PARAMS': {},
+        }, {})
+        backend.configure_client()
+        backend.warm_up(sockets=1)
+        peer, _ = server.accept()
+        self.addCleanup(peer.close)
+        pools = self.get_pools(backend)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:  # pragma: no cover
+            try:
+                backend.close()
+                result = all(pool.pool is not None for pool in pools)
+                os.write(write_fd, b'1' if result else b'0')
+            finally:
+                os._exit(0)
+
+        os.waitpid(pid, 0)
+        assert os.read(read_fd, 1) == b'1'
+        os.close(read_fd)
+        os.close(write_fd)
+
+        # The socket of the parent process is still open.
+        peer.setblocking(False)
+        with self.assertRaises(BlockingIOError):
+            peer.recv(1, socket.MSG_PEEK)
+        assert [stats['idle'] for stats in backend.pool_stats().values()] == [
+            1]
+        backend.close()
@@ -0,0 +1,188 @@
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from elasticsearch.exceptions import NotFoundError
+
+from djangoes.backends.lru import (DocumentCache, Entry,
+                                   HotDocumentInterceptor, document_caches,
+                                   get_bulk_ids)
+
+from .backend import FakeConnection, make_backend
+
+
+def clock(*values):
+    return patch('djangoes.backends.lru.time.monotonic',
+                 side_effect=values)
+
+
+def document(doc_id, version=1, **source):
+    return (200, {'_id': doc_id, '_version': version, 'found': True,
+                  '_source': source})
+
+
+class TestDocumentCache(TestCase):
+    def test_lru(self):
+        cache = DocumentCache(max_entries=2)
+        cache.set('a', Entry('1', '{}', 0))
+        cache.set('b', Entry('2', '{}', 0))
+        # "a" is now the most recently used.
+        cache.get('a')
+        cache.set('c', Entry('3', '{}', 0))
+
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+        assert cache.get('c') is not None
+        assert len(cache) == 2
+
+    def test_max_bytes(self):
+        cache = DocumentCache(max_bytes=10)
+        cache.set('a', Entry('1', '1234', 0))
+        cache.set('b', Entry('2', '1234', 0))
+        cache.set('c', Entry('3', '1234', 0))
+        # Too big to be stored.
+        cache.set('d', Entry('4', '12345678901', 0))
+
+        assert cache.get('a') is None
+        assert cache.get('d') is None
+        assert cache.size == 8
+        assert len(cache) == 2
+
+    def test_discard(self):
+        cache = DocumentCache()
+        cache.set('a', Entry('1', '{}', 0))
+        cache.set('b', Entry('1', '{"a": 1}', 0))
+        cache.set('c', Entry('2', '{}', 0))
+
+        cache.discard('1')
+
+        assert len(cache) == 1
+        assert cache.size == 2
+
+    def test_outdated(self):
+        """Assert a document fetched before a removal is not stored."""
+        cache = DocumentCache()
+        generation = cache.generation
+        cache.discard('2')
+
+        cache.set('a', Entry('1', '{}', 0), generation)
+
+        assert cache.get('a') is None
+
+    def test_get_bulk_ids(self):
+        assert get_bulk_ids([
+            {'index': {'_index': 'a', '_id': 1}},
+            {'field': 1},
+            {'delete': {'_id': '2'}},
+            {'create': {}},
+            {'a': 1},
+        ]) == ['1', '2']
+
+
+class TestHotDocuments(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        document_caches.reset()
+
+    def make_backend(self, **options):
+        return make_backend(STATS=False, HOT_DOCUMENTS=options or True)
+
+    def test_disabled(self):
+        for options in (None, False, {}):
+            backend = make_backend(HOT_DOCUMENTS=options)
+
+            assert not any(isinstance(interceptor, HotDocumentInterceptor)
+                           for interceptor in backend.interceptors)
+
+    def test_cached(self):
+        FakeConnection.reset([document('1', a=1), (200, {'a': 2})])
+        backend = self.make_backend()
+
+        first = backend.get('1')
+        first['_source']['a'] = 'changed'
+
+        assert backend.get('1')['_source'] == {'a': 1}
+        assert backend.get_source('1') == {'a': 2}
+        assert backend.get_source('1') == {'a': 2}
+        assert len(FakeConnection.requests) == 2
+
+    def test_shared_by_alias(self):
+        FakeConnection.reset([document('1', a=1)])
+        first = self.make_backend()
+        second = self.make_backend()
+
+        first.get('1')
+        second.get('1')
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_ttl(self):
+        FakeConnection.reset([document('1', a=1), document('1', a=2)])
+        backend = self.make_backend(TTL=10)
+
+        with clock(0, 5, 10, 10):
+            assert backend.get('1')['_source'] == {'a': 1}
+            assert backend.get('1')['_source'] == {'a': 1}
+            assert backend.get('1')['_source'] == {'a': 2}
+
+        assert len(FakeConnection.requests) == 2
+
+    def test_validate(self):
+        FakeConnection.reset([document('1', version=3, a=1),
+                              (200, {'_id': '1', '_version': 3}),
+                              (200, {'_id': '1', '_version': 4}),
+                              document('1', version=4, a=2)])
+        backend = self.make_backend(TTL=10, VALIDATE=True)
+
+        with clock(0, 10, 10, 20, 30):
+            assert backend.get('1')['_source'] == {'a': 1}
+            # Same version: no need to fetch it again.
+            assert backend.get('1')['_source'] == {'a': 1}
+            # Another version.
+            assert backend.get('1')['_source'] == {'a': 2}
+
+        params = [request[3] for request in FakeConnection.requests]
+        assert params == [{}, {'_source': b'false'}, {'_source': b'false'},
+                          {}]
+
+    def test_write(self):
+        FakeConnection.reset([document('1', a=1), (200, {}),
+                              document('1', a=2)])
+        backend = self.make_backend()
+        other = make_backend(alias='other', STATS=False, HOT_DOCUMENTS=True)
+
+        backend.get('1')
+        other.update('doc', '1', {'doc': {'a': 2}})
+
+        assert backend.get('1')['_source'] == {'a': 2}
+
+    def test_bulk(self):
+        FakeConnection.reset([document('1', a=1), document('2', a=1),
+                              (200, {}), document('1', a=2)])
+        backend = self.make_backend()
+
+        backend.get('1')
+        backend.get('2')
+        backend.bulk([{'delete': {'_id': '1'}}])
+
+        assert backend.get('1')['_source'] == {'a': 2}
+        assert backend.get('2')['_source'] == {'a': 1}
+
+    def test_delete_by_query(self):
+        backend = self.make_backend()
+        backend.get('1')
+
+        backend.delete_by_query({'query': {}})
+        backend.get('1')
+
+        assert len(FakeConnection.requests) == 3
+
+    def test_not_found(self):
+        FakeConnection.reset([(404, {'found': False}),
+                              (404, {'found': False})])
+        backend = self.make_backend()
+
+        for _ in range(2):
+            with self.assertRaises(NotFoundError):
+                backend.get('1')
+
+        assert len(FakeConnection.requests) == 2
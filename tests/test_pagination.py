@@ -0,0 +1,151 @@
+import json
+from unittest.case import TestCase
+
+from django.core.paginator import EmptyPage
+
+from djangoes.backends.pagination import (InvalidCursor, get_sort,
+                                          reverse_sort)
+
+from .backend import FakeConnection, make_backend
+
+
+def hits(*prices):
+    return (200, {
+        '_shards': {'total': 1, 'failed': 0},
+        'hits': {'total': 10, 'hits': [
+            {'_id': str(price), '_source': {'price': price},
+             'sort': [price, 'doc#%d' % price]}
+            for price in prices]},
+    })
+
+
+def read_body(request):
+    return json.loads(request[4].decode('utf-8'))
+
+
+class TestSort(TestCase):
+    def test_get_sort(self):
+        assert get_sort(None, 'id') == [{'id': {'order': 'asc'}}]
+        assert get_sort('_score', 'id') == [
+            {'_score': {'order': 'desc'}}, {'id': {'order': 'asc'}}]
+        assert get_sort([{'price': 'desc'}, 'name'], 'id') == [
+            {'price': {'order': 'desc'}},
+            {'name': {'order': 'asc'}},
+            {'id': {'order': 'asc'}},
+        ]
+        assert get_sort({'id': 'desc'}, 'id') == [{'id': {'order': 'desc'}}]
+
+    def test_reverse_sort(self):
+        assert reverse_sort([
+            {'price': {'order': 'desc', 'missing': '_last'}},
+            {'id': {'order': 'asc'}},
+        ]) == [
+            {'price': {'order': 'asc', 'missing': '_last'}},
+            {'id': {'order': 'desc'}},
+        ]
+
+
+class TestCursorPaginator(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def paginate(self, **kwargs):
+        backend = make_backend()
+        return backend.paginate(body={'query': {'match_all': {}}},
+                                sort=[{'price': 'asc'}], tiebreaker='id',
+                                per_page=2, doc_type='doc', **kwargs)
+
+    def test_pages(self):
+        paginator = self.paginate()
+
+        FakeConnection.reset([hits(1, 2, 3)])
+        first = paginator.page()
+
+        assert [hit['_id'] for hit in first] == ['1', '2']
+        assert first.number is None
+        assert first.has_next()
+        assert not first.has_previous()
+        (request,) = FakeConnection.requests
+        assert request[2] == '/index/doc/_search'
+        assert read_body(request) == {
+            'query': {'match_all': {}},
+            'size': 3,
+            'sort': [{'price': {'order': 'asc'}}, {'id': {'order': 'asc'}}],
+        }
+
+        FakeConnection.reset([hits(3, 4)])
+        second = paginator.page(first.next_page_number())
+
+        assert [hit['_id'] for hit in second] == ['3', '4']
+        assert not second.has_next()
+        assert second.has_previous()
+        assert read_body(FakeConnection.requests[0])['search_after'] == [
+            2, 'doc#2']
+        with self.assertRaises(EmptyPage):
+            second.next_page_number()
+
+        # The previous page is searched in reverse, from the first hit.
+        FakeConnection.reset([hits(2, 1)])
+        previous = paginator.page(second.previous_page_number())
+
+        assert [hit['_id'] for hit in previous] == ['1', '2']
+        assert previous.has_next()
+        assert not previous.has_previous()
+        body = read_body(FakeConnection.requests[0])
+        assert body['search_after'] == [3, 'doc#3']
+        assert body['sort'] == [
+            {'price': {'order': 'desc'}}, {'id': {'order': 'desc'}}]
+
+    def test_sort_from_body(self):
+        backend = make_backend()
+        paginator = backend.paginate(body={'sort': 'price', 'size': 50},
+                                     tiebreaker='id')
+
+        FakeConnection.reset([hits()])
+        page = paginator.page()
+
+        assert len(page) == 0
+        assert not page.has_other_pages()
+        assert read_body(FakeConnection.requests[0]) == {
+            'size': 21,
+            'sort': [{'price': {'order': 'asc'}}, {'id': {'order': 'asc'}}],
+        }
+
+    def test_invalid_body(self):
+        backend = make_backend()
+
+        with self.assertRaises(ValueError):
+            backend.paginate(body={'from': 20}, tiebreaker='id')
+        with self.assertRaises(ValueError):
+            backend.paginate(body={'search_after': [1]}, tiebreaker='id')
+
+    def test_tiebreaker_required(self):
+        backend = make_backend()
+
+        with self.assertRaises(ValueError):
+            backend.paginate(body={'sort': 'price'})
+
+    def test_invalid_cursor(self):
+        paginator = self.paginate()
+        FakeConnection.reset([hits(1, 2, 3)])
+        cursor = paginator.page().next_page_number()
+
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+        with self.assertRaises(InvalidCursor):
+            paginator.page(cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'))
+        with self.assertRaises(InvalidCursor):
+            self.paginate(routing='x').page(cursor)
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_get_page(self):
+        """Assert an invalid cursor gives the first page."""
+        paginator = self.paginate()
+
+        FakeConnection.reset([hits(1, 2)])
+        page = paginator.get_page('not-a-cursor')
+
+        assert [hit['_id'] for hit in page] == ['1', '2']
+        assert not page.has_next()
+        assert 'search_after' not in read_body(FakeConnection.requests[0])
@@ -0,0 +1,273 @@
+import socket
+from threading import Thread
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from djangoes import ConnectionHandler
+from djangoes.backends.elasticsearch import PooledHttpBackend
+from djangoes.backends.pooling import (PooledHttpConnection,
+                                       ReapingHTTPConnectionPool,
+                                       ReapingHTTPSConnectionPool,
+                                       open_sockets)
+
+
+def open_connection(pool):
+    """Get a connection from `pool` and pretend its socket is open."""
+    conn = pool._get_conn()
+    conn.sock, peer = socket.socketpair()
+    conn.peer = peer
+    return conn
+
+
+class TestReapingPool(TestCase):
+    """Assert how the reaping pools track and close idle sockets."""
+
+    def test_stats_empty(self):
+        pool = ReapingHTTPConnectionPool('localhost', maxsize=4)
+
+        assert pool.stats() == {
+            'maxsize': 4,
+            'in_use': 0,
+            'idle': 0,
+            'opened': 0,
+            'requests': 0,
+        }
+
+    def test_stats(self):
+        """Assert borrowed and idle sockets are counted."""
+        pool = ReapingHTTPConnectionPool('localhost', maxsize=4)
+
+        conn_1 = open_connection(pool)
+        conn_2 = open_connection(pool)
+
+        stats = pool.stats()
+        assert stats['in_use'] == 2
+        assert stats['idle'] == 0
+        assert stats['opened'] == 2
+
+        pool._put_conn(conn_1)
+
+        stats = pool.stats()
+        assert stats['in_use'] == 1
+        assert stats['idle'] == 1
+
+        pool._put_conn(conn_2)
+
+        stats = pool.stats()
+        assert stats['in_use'] == 0
+        assert stats['idle'] == 2
+
+    def test_reap(self):
+        """Assert only sockets idle for too long are closed."""
+        pool = ReapingHTTPConnectionPool('localhost', maxsize=4,
+                                         idle_timeout=10)
+        conn_1 = open_connection(pool)
+        conn_2 = open_connection(pool)
+
+        with patch('djangoes.backends.pooling.time.monotonic',
+                   return_value=100):
+            pool._put_conn(conn_1)
+
+        with patch('djangoes.backends.pooling.time.monotonic',
+                   return_value=105):
+            pool._put_conn(conn_2)
+
+        with patch('djangoes.backends.pooling.time.monotonic',
+                   return_value=112):
+            assert pool.reap() == 1
+
+        assert conn_1.sock is None
+        assert conn_2.sock is not None
+        assert pool.stats()['idle'] == 1
+
+    def test_reap_without_idle_timeout(self):
+        """Assert nothing is closed when there is no idle timeout."""
+        pool = ReapingHTTPConnectionPool('localhost', maxsize=4)
+        conn = open_connection(pool)
+        pool._put_conn(conn)
+
+        assert pool.reap() == 0
+        assert conn.sock is not None
+
+    def test_get_conn_idle(self):
+        """Assert an idle socket is closed instead of being reused."""
+        pool = ReapingHTTPConnectionPool('localhost', maxsize=1,
+                                         idle_timeout=10)
+        conn = open_connection(pool)
+
+        with patch('djangoes.backends.pooling.time.monotonic',
+                   return_value=100):
+            pool._put_conn(conn)
+
+        with patch('djangoes.backends.pooling.time.monotonic',
+                   return_value=120):
+            conn_again = pool._get_conn()
+
+        assert conn_again is conn
+        assert conn_again.sock is None
+
+
+class TestPooledHttpConnection(TestCase):
+    def test_pool(self):
+        connection = PooledHttpConnection(maxsize=3, block=True,
+                                          idle_timeout=30)
+
+        assert isinstance(connection.pool, ReapingHTTPConnectionPool)
+        assert connection.pool.maxsize == 3
+        assert connection.pool.block is True
+        assert connection.pool.idle_timeout == 30
+        assert connection.stats()['maxsize'] == 3
+
+    def test_pool_ssl(self):
+        connection = PooledHttpConnection(use_ssl=True, verify_certs=True,
+                                          ca_certs='/path/to/ca')
+
+        assert isinstance(connection.pool, ReapingHTTPSConnectionPool)
+        assert connection.pool.ca_certs == '/path/to/ca'
+        assert connection.pool.cert_reqs == 'CERT_REQUIRED'
+
+
+class TestPooledHttpBackend(TestCase):
+    def test_client_params(self):
+        server = {
+            'HOSTS': [],
+            'PARAMS': {'timeout': 5},
+            'POOL': {
+                'MAXSIZE': 25,
+                'BLOCK': True,
+                'IDLE_TIMEOUT': 60,
+            }
+        }
+        backend = PooledHttpBackend('default', server, {})
+
+        assert backend.get_client_params() == {
+            'timeout': 5,
+            'maxsize': 25,
+            'block': True,
+            'pool_timeout': None,
+            'idle_timeout': 60,
+        }
+        # The settings are not modified.
+        assert server['PARAMS'] == {'timeout': 5}
+
+    def test_pool_stats(self):
+        server = {
+            'HOSTS': ['host_1', 'host_2'],
+            'PARAMS': {},
+            'POOL': {'MAXSIZE': 2},
+        }
+        backend = PooledHttpBackend('default', server, {})
+        backend.configure_client()
+
+        stats = backend.pool_stats()
+
+        assert sorted(stats) == ['http://host_1:9200', 'http://host_2:9200']
+        assert stats['http://host_1:9200']['maxsize'] == 2
+        assert backend.reap() == 0
+
+
+class TestSharedConnection(TestCase):
+    """Assert how shared connections are handled by ConnectionHandler."""
+
+    def get_from_thread(self, handler, alias):
+        result = []
+        thread = Thread(target=lambda: result.append(handler[alias]))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_not_shared(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+            }
+        }
+        handler = ConnectionHandler(servers, {})
+
+        assert not handler.is_shared('default')
+        assert handler['default'] is not self.get_from_thread(handler,
+                                                              'default')
+
+    def test_shared(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'SHARED': True,
+            }
+        }
+        handler = ConnectionHandler(servers, {})
+
+        assert handler.is_shared('default')
+        assert handler['default'] is self.get_from_thread(handler, 'default')
+
+    def test_shared_delete(self):
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'SHARED': True,
+            }
+        }
+        handler = ConnectionHandler(servers, {})
+
+        conn = handler['default']
+        del handler['default']
+
+        assert handler['default'] is not conn
+
+    def test_shared_multiprocess(self):
+        """Assert shared connections are reset when the PID changes."""
+        servers = {
+            'default': {
+                'ENGINE': 'tests.backend.ConnectionWrapper',
+                'SHARED': True,
+            }
+        }
+        handler = ConnectionHandler(servers, {})
+
+        conn = handler['default']
+        handler._pid = 1
+
+        assert handler['default'] is not conn
+
+
+class TestOpenSockets(TestCase):
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_open_sockets(self):
+        pool = ReapingHTTPConnectionPool('127.0.0.1', port=self.port,
+                                         maxsize=4)
+
+        assert open_sockets(pool, 3) == 3
+        assert pool.stats()['idle'] == 3
+
+        # Sockets already opened are reused.
+        assert open_sockets(pool, 3) == 0
+        assert pool.stats()['idle'] == 3
+
+    def test_open_sockets_maxsize(self):
+        pool = ReapingHTTPConnectionPool('127.0.0.1', port=self.port,
+                                         maxsize=2)
+
+        assert open_sockets(pool, 5) == 2
+        assert pool.stats()['idle'] == 2
+
+    def test_backend_warm_up(self):
+        server = {
+            'HOSTS': ['127.0.0.1:%s' % self.port],
+            'PARAMS': {},
+            'POOL': {'MAXSIZE': 4},
+        }
+        backend = PooledHttpBackend('default', server, {})
+        backend.configure_client()
+
+        backend.warm_up(sockets=2)
+
+        stats = backend.pool_stats()['http://127.0.0.1:%s' % self.port]
+        assert stats['idle'] == 2
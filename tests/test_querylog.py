@@ -0,0 +1,254 @@
+from threading import Thread
+from unittest.case import TestCase
+
+from django.core.signals import request_started
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from elasticsearch.exceptions import NotFoundError
+
+import djangoes
+from djangoes import ConnectionHandler
+from djangoes.backends.batching import LazyResult
+from djangoes.backends.querylog import (QueryLogInterceptor, format_body,
+                                        get_took)
+from djangoes.middleware import QueryLogMiddleware, summarize_queries
+
+from .backend import FakeConnection, make_backend
+
+
+def enabled(**options):
+    options.setdefault('ENABLED', True)
+    return {'QUERY_LOG': options}
+
+
+class TestQueryLog(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_disabled(self):
+        """Assert the query log is disabled by default without DEBUG."""
+        backend = make_backend()
+        backend.search()
+
+        assert not any(isinstance(interceptor, QueryLogInterceptor)
+                       for interceptor in backend.interceptors)
+        assert backend.queries == []
+        # Does nothing.
+        backend.reset_queries()
+
+    def test_debug(self):
+        with override_settings(DEBUG=True):
+            backend = make_backend()
+
+        backend.search()
+
+        assert len(backend.queries) == 1
+
+    def test_entries(self):
+        FakeConnection.reset([(200, {'took': 12, 'hits': {}}),
+                              (404, {'found': False})])
+        backend = make_backend(**enabled())
+
+        backend.search('doc', {'query': {'match_all': {}}})
+        with self.assertRaises(NotFoundError):
+            backend.get('42')
+
+        search, get = backend.queries
+        assert search['alias'] == 'default'
+        assert search['method'] == 'search'
+        assert search['indices'] == 'index'
+        assert search['body'] == '{"query": {"match_all": {}}}'
+        assert search['took'] == 12
+        assert search['time'] >= 0
+        assert search['error'] is None
+        assert search['arguments'] == '{"doc_type": "doc"}'
+        assert get['method'] == 'get'
+        assert get['body'] is None
+        assert get['arguments'] == '{"doc_id": "42"}'
+        assert get['took'] is None
+        assert get['error'] == 'NotFoundError'
+
+    def test_explicit_index(self):
+        backend = make_backend(**enabled())
+
+        backend.mget({'docs': []}, index='other')
+
+        assert backend.queries[0]['indices'] == 'other'
+
+    def test_bounded(self):
+        backend = make_backend(**enabled(SIZE=3))
+
+        for size in range(5):
+            backend.search(body={'size': size})
+
+        assert [query['body'] for query in backend.queries] == [
+            '{"size": 2}', '{"size": 3}', '{"size": 4}']
+
+    def test_body_length(self):
+        backend = make_backend(**enabled(BODY_LENGTH=10))
+
+        backend.search(body={'query': {'match_all': {}}})
+
+        assert backend.queries[0]['body'] == '{"query": ...'
+
+    def test_reset_queries(self):
+        backend = make_backend(**enabled())
+        backend.search()
+
+        backend.reset_queries()
+
+        assert backend.queries == []
+
+    def test_threads(self):
+        """Assert each thread has its own log, even for a shared backend."""
+        backend = make_backend(**enabled())
+        backend.count()
+
+        thread = Thread(target=backend.search)
+        thread.start()
+        thread.join()
+
+        assert [query['method'] for query in backend.queries] == ['count']
+
+    def test_format_body(self):
+        assert format_body(None, 10) is None
+        assert format_body('{"a": 1}', 10) == '{"a": 1}'
+        assert format_body(b'{"a": 1}', 10) == '{"a": 1}'
+        assert format_body({'b': 1, 'a': 2}, 100) == '{"a": 2, "b": 1}'
+
+    def test_get_took(self):
+        assert get_took(None) is None
+        assert get_took({'took': 3}) == 3
+        assert get_took({'responses': [{'took': 3}, {'took': 5}, {}]}) == 5
+
+        lazy = LazyResult(None)
+        assert get_took(lazy) is None
+        lazy.resolve({'took': 4})
+        assert get_took(lazy) == 4
+
+    def test_batch(self):
+        """Assert the msearch of a batch is logged with its took."""
+        FakeConnection.reset([(200, {'responses': [{'took': 2},
+                                                   {'took': 7}]})])
+        backend = make_backend(**enabled())
+
+        with backend.batch():
+            backend.search(body={'query': {}})
+            backend.search(body={'size': 0})
+
+        (entry,) = backend.queries
+        assert entry['method'] == 'msearch'
+        assert entry['took'] == 7
+
+
+class TestHandlerQueries(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        server = {
+            'ENGINE': 'tests.backend.FakeBackend',
+            'HOSTS': ['localhost'],
+            'QUERY_LOG': {'ENABLED': True},
+        }
+        djangoes.connections = ConnectionHandler({
+            'default': server,
+            'other': dict(server),
+        }, {})
+
+    def test_get_queries(self):
+        connections = djangoes.connections
+        connections['default'].search()
+        connections['other'].count()
+
+        queries = connections.get_queries()
+
+        assert sorted((query['alias'], query['method'])
+                      for query in queries) == [('default', 'search'),
+                                                ('other', 'count')]
+
+    def test_request_started(self):
+        connections = djangoes.connections
+        connections['default'].search()
+
+        request_started.send(sender=self.__class__)
+
+        assert connections.get_queries() == []
+
+
+class TestQueryLogMiddleware(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        djangoes.connections = ConnectionHandler({
+            'default': {
+                'ENGINE': 'tests.backend.FakeBackend',
+                'HOSTS': ['localhost'],
+                'INDICES': ['index'],
+                'QUERY_LOG': {'ENABLED': True},
+            },
+        }, {'index': {}})
+
+    def test_summarize_queries(self):
+        queries = [
+            {'alias': 'default', 'method': 'get', 'indices': 'index',
+             'body': None, 'arguments': '{"doc_id": 1}', 'took': None,
+             'time': 1.5, 'error': None},
+            {'alias': 'default', 'method': 'get', 'indices': 'index',
+             'body': None, 'arguments': '{"doc_id": 1}', 'took': None,
+             'time': 2.5, 'error': 'Error'},
+            {'alias': 'default', 'method': 'get', 'indices': 'index',
+             'body': None, 'arguments': '{"doc_id": 2}', 'took': None,
+             'time': 1.0, 'error': None},
+            {'alias': 'default', 'method': 'search', 'indices': 'index',
+             'body': '{}', 'arguments': '{}', 'took': 3, 'time': 4.0,
+             'error': None},
+        ]
+
+        summary = summarize_queries(queries)
+
+        assert summary == {
+            'count': 4,
+            'errors': 1,
+            'time': 9.0,
+            'took': 3,
+            'methods': {'get': 3, 'search': 1},
+            'duplicates': [{
+                'alias': 'default',
+                'method': 'get',
+                'indices': 'index',
+                'body': None,
+                'arguments': '{"doc_id": 1}',
+                'count': 2,
+            }],
+        }
+
+    def test_middleware(self):
+        def view(request):
+            conn = djangoes.connections['default']
+            conn.get('1')
+            conn.get('1')
+            conn.get('2')
+            conn.search()
+            return HttpResponse()
+
+        # Queries of a previous request are forgotten.
+        djangoes.connections['default'].count()
+        middleware = QueryLogMiddleware(view)
+        request = RequestFactory().get('/entries/')
+
+        with self.assertLogs('djangoes.queries', 'WARNING') as logs:
+            middleware(request)
+
+        assert request.es_queries['count'] == 4
+        assert request.es_queries['methods'] == {'get': 3, 'search': 1}
+        (duplicate,) = request.es_queries['duplicates']
+        assert duplicate['count'] == 2
+        assert logs.output[0].startswith(
+            'WARNING:djangoes.queries:GET /entries/: 4 ElasticSearch queries')
+
+    def test_middleware_without_queries(self):
+        middleware = QueryLogMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/')
+
+        middleware(request)
+
+        assert request.es_queries['count'] == 0
@@ -0,0 +1,241 @@
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from elasticsearch.exceptions import (ConnectionError, ConnectionTimeout,
+                                      NotFoundError, TransportError)
+
+from djangoes.backends.resilience import (CircuitBreaker,
+                                          CircuitBreakerInterceptor,
+                                          CircuitOpenError, RetryInterceptor,
+                                          breakers, is_transient)
+
+from .backend import FakeConnection, make_backend
+
+
+def timeout():
+    return ConnectionTimeout('TIMEOUT', 'timed out', None)
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class TestRetry(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        # The transport does not retry by itself.
+        self.params = {'max_retries': 0}
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, RetryInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_is_transient(self):
+        assert is_transient(timeout())
+        assert is_transient(TransportError(429, 'too many requests'))
+        assert is_transient(TransportError(503, 'unavailable'))
+        assert not is_transient(TransportError(400, 'bad request'))
+        assert not is_transient(NotFoundError(404, 'not found'))
+        assert not is_transient(ValueError())
+
+    def test_retry(self):
+        FakeConnection.reset([(429, {}), timeout(), (200, {'hits': {}})])
+        backend = make_backend(PARAMS=self.params, RETRY={'BACKOFF': 0.1})
+
+        with patch('djangoes.backends.resilience.time.sleep') as sleep:
+            assert backend.search() == {'hits': {}}
+
+        assert len(FakeConnection.requests) == 3
+        assert sleep.call_count == 2
+        first, second = [call[0][0] for call in sleep.call_args_list]
+        assert 0 <= first <= 0.1
+        assert 0 <= second <= 0.2
+
+    def test_max_retries(self):
+        FakeConnection.reset([(503, {})] * 5)
+        backend = make_backend(PARAMS=self.params,
+                               RETRY={'MAX_RETRIES': 2})
+
+        with patch('djangoes.backends.resilience.time.sleep'):
+            with self.assertRaises(TransportError):
+                backend.get('1')
+
+        assert len(FakeConnection.requests) == 3
+
+    def test_max_backoff(self):
+        backend = make_backend(RETRY={'BACKOFF': 1, 'MAX_BACKOFF': 2})
+        (interceptor,) = [interceptor for interceptor in backend.interceptors
+                          if isinstance(interceptor, RetryInterceptor)]
+
+        with patch('djangoes.backends.resilience.random.uniform',
+                   side_effect=lambda low, high: high):
+            assert [interceptor.get_delay(retry)
+                    for retry in range(4)] == [1, 2, 2, 2]
+
+    def test_budget(self):
+        """Assert no retry starts once the budget is spent."""
+        FakeConnection.reset([(503, {})] * 5)
+        backend = make_backend(PARAMS=self.params,
+                               RETRY={'BACKOFF': 10, 'MAX_BACKOFF': 10,
+                                      'BUDGET': 1})
+
+        with patch('djangoes.backends.resilience.random.uniform',
+                   return_value=5):
+            with self.assertRaises(TransportError):
+                backend.search()
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_not_transient(self):
+        FakeConnection.reset([(404, {'found': False})])
+        backend = make_backend(PARAMS=self.params, RETRY={'BUDGET': 1})
+
+        with self.assertRaises(NotFoundError):
+            backend.get('1')
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_not_idempotent(self):
+        FakeConnection.reset([(429, {}), (200, {})])
+        backend = make_backend(PARAMS=self.params, RETRY={'BUDGET': 1})
+
+        with self.assertRaises(TransportError):
+            backend.bulk([{'index': {}}, {'a': 1}])
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_methods(self):
+        FakeConnection.reset([(429, {}), (200, {'created': True})])
+        backend = make_backend(PARAMS=self.params,
+                               RETRY={'METHODS': ['index']})
+
+        with patch('djangoes.backends.resilience.time.sleep'):
+            backend.index('doc', {'a': 1}, doc_id='1')
+
+        assert len(FakeConnection.requests) == 2
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        breakers.reset()
+        self.params = {'max_retries': 0}
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, CircuitBreakerInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_open(self):
+        FakeConnection.reset([timeout(), (503, {}), (200, {})])
+        backend = make_backend(PARAMS=self.params,
+                               BREAKER={'THRESHOLD': 2})
+
+        for _ in range(2):
+            with self.assertRaises(TransportError):
+                backend.search()
+
+        with self.assertRaises(CircuitOpenError):
+            backend.search()
+
+        # Writes fail fast too.
+        with self.assertRaises(ConnectionError):
+            backend.bulk([{'index': {}}, {'a': 1}])
+
+        assert len(FakeConnection.requests) == 2
+
+    def test_success_resets(self):
+        FakeConnection.reset([timeout(), (200, {}), timeout(), (200, {})])
+        backend = make_backend(PARAMS=self.params,
+                               BREAKER={'THRESHOLD': 2})
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                backend.search()
+            backend.search()
+
+        assert breakers.get('default', 2, 30).state == CircuitBreaker.CLOSED
+
+    def test_shared_by_alias(self):
+        """Assert the connections of an alias share the same circuit."""
+        FakeConnection.reset([timeout()])
+        first = make_backend(PARAMS=self.params, BREAKER={'THRESHOLD': 1})
+        second = make_backend(PARAMS=self.params, BREAKER={'THRESHOLD': 1})
+        other = make_backend(alias='other', PARAMS=self.params,
+                             BREAKER={'THRESHOLD': 1})
+
+        with self.assertRaises(ConnectionError):
+            first.search()
+
+        with self.assertRaises(CircuitOpenError):
+            second.search()
+
+        other.search()
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=30)
+
+        with patch('djangoes.backends.resilience.time.monotonic',
+                   return_value=100):
+            breaker.failure()
+            assert breaker.state == CircuitBreaker.OPEN
+            assert not breaker.allow()
+
+        with patch('djangoes.backends.resilience.time.monotonic',
+                   return_value=130):
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            # Only one trial at a time.
+            assert breaker.allow()
+            assert not breaker.allow()
+            # The trial failed: open again.
+            breaker.failure()
+            assert breaker.state == CircuitBreaker.OPEN
+
+        with patch('djangoes.backends.resilience.time.monotonic',
+                   return_value=160):
+            assert breaker.allow()
+            breaker.success()
+            assert breaker.state == CircuitBreaker.CLOSED
+            assert breaker.allow()
+
+    def test_interrupted_trial(self):
+        """Assert an interrupted trial opens the circuit again."""
+        backend = make_backend(PARAMS=self.params, BREAKER={'THRESHOLD': 1})
+        breaker = breakers.get('default', 1, 30)
+
+        with patch('djangoes.backends.resilience.time.monotonic',
+                   return_value=100):
+            breaker.failure()
+
+        with patch('djangoes.backends.resilience.time.monotonic',
+                   return_value=130):
+            with patch.object(FakeConnection, 'perform_request',
+                              side_effect=Interrupted):
+                with self.assertRaises(Interrupted):
+                    backend.search()
+
+            assert not breaker.trial
+            assert breaker.state == CircuitBreaker.OPEN
+
+        with patch('djangoes.backends.resilience.time.monotonic',
+                   return_value=160):
+            backend.search()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_not_retried(self):
+        """Assert the retries stop once the circuit is open."""
+        FakeConnection.reset([timeout()])
+        backend = make_backend(PARAMS=self.params,
+                               BREAKER={'THRESHOLD': 1},
+                               RETRY={'BUDGET': 1})
+
+        with patch('djangoes.backends.resilience.time.sleep') as sleep:
+            with self.assertRaises(CircuitOpenError):
+                backend.search()
+
+        assert sleep.call_count == 1
+        assert len(FakeConnection.requests) == 1
@@ -0,0 +1,166 @@
+import os
+import subprocess
+import sys
+from unittest.case import TestCase
+from unittest.mock import Mock, patch
+
+from django.test.utils import override_settings
+
+import djangoes
+from djangoes import ConnectionHandler, ConnectionProxy, ConnectionRouter
+
+from .backend import ConnectionWrapper
+
+
+class QueryWrapper(ConnectionWrapper):
+    """Backend whose query methods return the alias of the connection."""
+    def search(self, *args, **kwargs):
+        return self.alias
+
+    def index(self, *args, **kwargs):
+        return self.alias
+
+
+class ReplicaRouter(object):
+    """Send reads of `default` to `replica`."""
+    def es_for_read(self, alias, **hints):
+        if alias == 'default':
+            return 'replica'
+        return None
+
+
+class WriteRouter(object):
+    """Send writes to `primary`."""
+    def es_for_write(self, alias, **hints):
+        return 'primary'
+
+
+class NoneRouter(object):
+    def es_for_read(self, alias, **hints):
+        return None
+
+    def es_for_write(self, alias, **hints):
+        return None
+
+
+def get_handler():
+    server = {
+        'ENGINE': 'tests.test_routers.QueryWrapper',
+    }
+    return ConnectionHandler({
+        'default': dict(server),
+        'replica': dict(server),
+        'primary': dict(server),
+    }, {})
+
+
+class TestConnectionRouter(TestCase):
+    def test_no_routers(self):
+        router = ConnectionRouter([])
+
+        assert router.for_read('default') == 'default'
+        assert router.for_write('default') == 'default'
+
+    def test_routers(self):
+        router = ConnectionRouter([NoneRouter(), ReplicaRouter(),
+                                   WriteRouter()])
+
+        assert router.for_read('default') == 'replica'
+        assert router.for_read('other') == 'other'
+        assert router.for_write('default') == 'primary'
+
+    def test_routers_order(self):
+        """Assert the first router to return an alias wins."""
+        router = ConnectionRouter([WriteRouter(), NoneRouter()])
+
+        assert router.for_write('default') == 'primary'
+
+    def test_router_path(self):
+        router = ConnectionRouter(['tests.test_routers.ReplicaRouter'])
+
+        assert isinstance(router.routers[0], ReplicaRouter)
+        assert router.for_read('default') == 'replica'
+
+    def test_hints(self):
+        hinted = []
+
+        class HintRouter(object):
+            def es_for_read(self, alias, **hints):
+                hinted.append(hints)
+
+        router = ConnectionRouter([HintRouter()])
+
+        assert router.for_method('default', 'search') == 'default'
+        assert router.for_method('default', 'info') == 'default'
+        assert hinted == [{'method': 'search'}]
+
+    def test_for_method(self):
+        router = ConnectionRouter([ReplicaRouter(), WriteRouter()])
+
+        assert router.for_method('default', 'search') == 'replica'
+        assert router.for_method('default', 'count') == 'replica'
+        assert router.for_method('default', 'index') == 'primary'
+        assert router.for_method('default', 'bulk') == 'primary'
+        assert router.for_method('default', 'ping') == 'default'
+
+    def test_settings_not_configured(self):
+        """Assert there is no router until the settings are configured."""
+        router = ConnectionRouter()
+
+        with patch('djangoes.settings', Mock(configured=False)):
+            assert router.routers == []
+
+        with override_settings(ES_ROUTERS=[ReplicaRouter()]):
+            assert router.for_read('default') == 'replica'
+
+    def test_benchmark_without_settings(self):
+        """Assert the proxy benchmark runs without Django's settings."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+
+        subprocess.run(
+            [sys.executable, os.path.join(root, 'benchmarks',
+                                          'connection_proxy.py'),
+             '--number', '10', '--repeat', '1'],
+            env=env, check=True, stdout=subprocess.DEVNULL)
+
+    def test_setting(self):
+        with override_settings(ES_ROUTERS=[ReplicaRouter()]):
+            assert djangoes.router.for_read('default') == 'replica'
+
+        assert djangoes.router.for_read('default') == 'default'
+
+
+class TestRouting(TestCase):
+    """Assert how connections are routed by the handler and the proxy."""
+
+    def setUp(self):
+        djangoes.connections = get_handler()
+        patcher = patch('djangoes.router', ConnectionRouter([
+            ReplicaRouter(), WriteRouter()]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_handler(self):
+        connections = djangoes.connections
+
+        assert connections.for_read() is connections['replica']
+        assert connections.for_write() is connections['primary']
+        assert connections.for_read('primary') is connections['primary']
+
+    def test_proxy(self):
+        proxy = ConnectionProxy('default')
+
+        assert proxy.search() == 'replica'
+        assert proxy.index() == 'primary'
+        # Other methods and attributes are not routed.
+        assert proxy.get_indices.__self__ is djangoes.connections['default']
+        assert proxy.alias == 'default'
+
+    def test_proxy_without_routers(self):
+        proxy = ConnectionProxy('default')
+
+        with patch('djangoes.router', ConnectionRouter([])):
+            assert proxy.search() == 'default'
+            assert proxy.index() == 'default'
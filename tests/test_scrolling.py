@@ -0,0 +1,275 @@
+import json
+from unittest.case import TestCase
+
+from elasticsearch.connection.base import Connection
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import ScanError
+
+import djangoes
+from djangoes import ConnectionHandler
+from djangoes.backends.elasticsearch import BaseElasticsearchBackend
+from djangoes.backends.scrolling import get_slices
+
+from .backend import FakeConnection, make_backend
+
+
+def page(scroll_id, *ids, **shards):
+    shards.setdefault('total', 2)
+    shards.setdefault('failed', 0)
+    return (200, {
+        '_scroll_id': scroll_id,
+        '_shards': shards,
+        'hits': {'total': 3, 'hits': [{'_id': doc_id} for doc_id in ids]},
+    })
+
+
+class TestScan(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_scan(self):
+        FakeConnection.reset([
+            page('s1', '1', '2'), page('s2', '3'), page('s3'),
+        ])
+        backend = make_backend()
+
+        hits = list(backend.scan(body={'query': {'match_all': {}},
+                                       'sort': ['name']},
+                                 size=2, scroll='1m', _source_include='name'))
+
+        assert [hit['_id'] for hit in hits] == ['1', '2', '3']
+        search, first, second, clear = FakeConnection.requests
+        assert search[2] == '/index/_search'
+        assert search[3] == {'scroll': b'1m', 'size': '2',
+                             '_source_include': b'name'}
+        assert json.loads(search[4].decode('utf-8')) == {
+            'query': {'match_all': {}}, 'sort': ['_doc']}
+        assert first[2] == '/_search/scroll'
+        assert first[3] == {'scroll': b'1m'}
+        assert first[4] == b's1'
+        assert second[4] == b's2'
+        assert clear[1] == 'DELETE'
+        assert clear[2] == '/_search/scroll/s3'
+
+    def test_preserve_order(self):
+        FakeConnection.reset([page('s1', '1', '2'), page('s2', '3'),
+                              page('s3')])
+        backend = make_backend()
+
+        hits = list(backend.scan(body={'sort': ['name']},
+                                 preserve_order=True))
+
+        assert [hit['_id'] for hit in hits] == ['1', '2', '3']
+        assert json.loads(FakeConnection.requests[0][4].decode('utf-8')) == {
+            'sort': ['name']}
+        assert len(FakeConnection.requests) == 4
+
+    def test_stop_early(self):
+        """Assert the scroll is cleared when the consumer stops early."""
+        FakeConnection.reset([page('s1', '1', '2')])
+        backend = make_backend()
+
+        hits = backend.scan()
+        assert next(hits)['_id'] == '1'
+        hits.close()
+
+        assert FakeConnection.requests[-1][1:3] == (
+            'DELETE', '/_search/scroll/s1')
+        assert len(FakeConnection.requests) == 2
+
+    def test_error(self):
+        FakeConnection.reset([page('s1', '1'),
+                              (400, {'error': 'bad request'})])
+        backend = make_backend()
+
+        with self.assertRaises(TransportError):
+            list(backend.scan())
+
+        assert FakeConnection.requests[-1][1:3] == (
+            'DELETE', '/_search/scroll/s1')
+
+    def test_failed_shards(self):
+        FakeConnection.reset([page('s1', '1', failed=1),
+                              page('s2', '2', failed=1), page('s3')])
+        backend = make_backend()
+
+        hits = backend.scan()
+        assert next(hits)['_id'] == '1'
+        with self.assertRaises(ScanError):
+            next(hits)
+
+        assert FakeConnection.requests[-1][1] == 'DELETE'
+
+        FakeConnection.reset([page('s1', '1', failed=1), page('s2')])
+        hits = list(backend.scan(raise_on_error=False))
+        assert [hit['_id'] for hit in hits] == ['1']
+
+    def test_no_scroll(self):
+        FakeConnection.reset([(200, {'_shards': {'total': 1, 'failed': 0},
+                                     'hits': {'hits': []}})])
+        backend = make_backend()
+
+        assert list(backend.scan()) == []
+        assert len(FakeConnection.requests) == 1
+
+    def test_clear_error(self):
+        """Assert an error clearing the scroll is not raised."""
+        FakeConnection.reset([page('s1'),
+                              (400, {'error': 'bad request'})])
+        backend = make_backend()
+
+        assert list(backend.scan()) == []
+
+
+class SliceConnection(Connection):
+    """Connection scanning three shards, with two pages of two hits each.
+
+    The hits of a slice are named after its shards, such as ``0,2-1-0`` for
+    the first hit of the second page of the slice of shards 0 and 2.
+    """
+    requests = []
+    failing = None
+    used = set()
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        self.requests.append((method, url, params, body))
+        self.used.add(self)
+        data = {}
+
+        if url.endswith('/_search_shards'):
+            data = {'shards': [[{'shard': number, 'index': 'index'}] * 2
+                               for number in range(3)]}
+        elif url.endswith('/_search'):
+            shards = params['preference'].decode('utf-8').split(':')[1]
+            data = self.get_page(shards, 1, self.get_ids(shards, 0))
+        elif method == 'DELETE':
+            pass
+        else:
+            shards, number = body.decode('utf-8').split('_')
+            if shards == self.failing:
+                self._raise_error(400, json.dumps({'error': 'failed'}))
+            data = self.get_page(shards, int(number) + 1,
+                                 self.get_ids(shards, int(number)))
+
+        return 200, {'content-type': 'application/json'}, json.dumps(data)
+
+    def get_ids(self, shards, number):
+        if number >= 2:
+            return []
+        return ['%s-%s-%s' % (shards, number, hit) for hit in (0, 1)]
+
+    def get_page(self, shards, number, ids):
+        return {
+            '_scroll_id': '%s_%s' % (shards, number),
+            '_shards': {'total': 1, 'failed': 0},
+            'hits': {'hits': [{'_id': doc_id} for doc_id in ids]},
+        }
+
+
+class SliceBackend(BaseElasticsearchBackend):
+    connection_class = SliceConnection
+
+
+def get_ids(hits):
+    return sorted(hit['_id'] for hit in hits)
+
+
+class TestSlicedScan(TestCase):
+    def setUp(self):
+        SliceConnection.requests = []
+        SliceConnection.failing = None
+        SliceConnection.used = set()
+
+    def get_cleared(self):
+        return sorted(url.rsplit('/', 1)[1]
+                      for method, url, _, _ in SliceConnection.requests
+                      if method == 'DELETE')
+
+    def test_get_slices(self):
+        backend = make_backend(SliceBackend)
+
+        assert get_slices(backend) == [
+            '_shards:0', '_shards:1', '_shards:2']
+        assert get_slices(backend, 2) == ['_shards:0,2', '_shards:1']
+        assert get_slices(backend, 5) == [
+            '_shards:0', '_shards:1', '_shards:2']
+
+    def test_scan_slices(self):
+        backend = make_backend(SliceBackend)
+
+        first, second = backend.scan_slices(slices=2, size=2)
+
+        assert get_ids(first) == ['0,2-0-0', '0,2-0-1', '0,2-1-0', '0,2-1-1']
+        assert get_ids(second) == ['1-0-0', '1-0-1', '1-1-0', '1-1-1']
+
+    def test_sliced_scan(self):
+        backend = make_backend(SliceBackend)
+
+        hits = list(backend.sliced_scan(slices=2, size=2))
+
+        assert get_ids(hits) == [
+            '0,2-0-0', '0,2-0-1', '0,2-1-0', '0,2-1-1',
+            '1-0-0', '1-0-1', '1-1-0', '1-1-1',
+        ]
+        assert self.get_cleared() == ['0,2_3', '1_3']
+
+    def test_worker_connections(self):
+        """Assert each worker thread uses its own connection."""
+        backend = make_backend(SliceBackend)
+
+        list(backend.sliced_scan(slices=2, size=2))
+
+        assert len(SliceConnection.used) == 3
+
+    def test_stop_early(self):
+        """Assert the workers stop, and clear their scroll contexts."""
+        backend = make_backend(SliceBackend)
+
+        hits = backend.sliced_scan(size=2, queue_size=1)
+        next(hits)
+        hits.close()
+
+        assert len(self.get_cleared()) == 3
+
+    def test_error(self):
+        SliceConnection.failing = '1'
+        backend = make_backend(SliceBackend)
+
+        with self.assertRaises(TransportError):
+            list(backend.sliced_scan(size=2))
+
+        assert len(self.get_cleared()) == 3
+
+    def test_preference(self):
+        backend = make_backend(SliceBackend)
+
+        with self.assertRaises(ValueError):
+            list(backend.sliced_scan(preference='_local'))
+
+    def test_processes(self):
+        djangoes.connections = ConnectionHandler({
+            'default': {
+                'ENGINE': 'tests.test_scrolling.SliceBackend',
+                'HOSTS': ['localhost'],
+                'INDICES': ['index'],
+            },
+        }, {'index': {}})
+
+        hits = list(djangoes.connections['default'].sliced_scan(
+            size=2, processes=True))
+
+        assert len(hits) == 12
+        assert get_ids(hits)[:4] == [
+            '0-0-0', '0-0-1', '0-1-0', '0-1-1']
+
+    def test_processes_configuration(self):
+        """Assert the worker processes use the configuration of the backend,
+        not the one of its alias in the settings."""
+        backend = make_backend(SliceBackend, indices={
+            'other': {'NAME': 'other', 'ALIASES': []},
+        })
+
+        hits = list(backend.sliced_scan(slices=2, size=2, processes=True))
+
+        assert len(hits) == 8
@@ -0,0 +1,150 @@
+from unittest.case import TestCase
+from unittest.mock import patch
+
+from elasticsearch.exceptions import TransportError
+
+from djangoes.backends.slowlog import SlowQueryInterceptor, get_took
+
+from .backend import FakeConnection, make_backend
+
+
+def timer(*durations):
+    """Patch perf_counter so each query lasts the given milliseconds."""
+    values = []
+    for duration in durations:
+        values.extend([0.0, duration / 1000.0])
+    # Stats must be disabled, as they use the same clock.
+    return patch('djangoes.backends.slowlog.time.perf_counter',
+                 side_effect=values)
+
+
+class TestSlowQueryLog(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, SlowQueryInterceptor)
+                       for interceptor in backend.interceptors)
+
+    def test_fast_query(self):
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100)
+
+        with self.assertNoLogs('djangoes.slow_queries'):
+            with timer(99):
+                backend.search(body={'query': {}})
+
+    def test_slow_query(self):
+        FakeConnection.reset([(200, {'took': 120, 'hits': {}})])
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100)
+
+        with self.assertLogs('djangoes.slow_queries', 'WARNING') as logs:
+            with timer(150):
+                backend.search(body={'query': {}})
+
+        (record,) = logs.records
+        assert record.slow_query == {
+            'alias': 'default',
+            'method': 'search',
+            'indices': ['index'],
+            'body': {'query': {}},
+            'took': 120,
+            'time': 150,
+            'overhead': 30,
+            'profile': None,
+            'error': None,
+        }
+        assert record.getMessage() == (
+            "Slow query default.search on index: 150.0 ms (took 120 ms): "
+            "{'query': {}}")
+        # Not profiled by default.
+        assert len(FakeConnection.requests) == 1
+
+    def test_failed_query(self):
+        """Assert a query failing after the threshold is logged."""
+        FakeConnection.reset([(400, {'error': 'bad request'}),
+                              (400, {'error': 'bad request'})])
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100,
+                               SLOW_QUERY_PROFILE=1)
+
+        with self.assertLogs('djangoes.slow_queries', 'WARNING') as logs:
+            with timer(150, 50):
+                with self.assertRaises(TransportError):
+                    backend.search(body={'query': {}})
+                with self.assertRaises(TransportError):
+                    backend.search(body={'query': {}})
+
+        (record,) = logs.records
+        assert record.slow_query['error'] == 'RequestError'
+        assert record.slow_query['took'] is None
+        assert record.getMessage() == (
+            "Slow query default.search on index: failed after 150.0 ms "
+            "(RequestError): {'query': {}}")
+        # Failed queries are not profiled.
+        assert len(FakeConnection.requests) == 2
+
+    def test_other_methods(self):
+        """Assert only some methods are logged."""
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100)
+
+        with self.assertNoLogs('djangoes.slow_queries'):
+            backend.get('42')
+
+        with self.assertLogs('djangoes.slow_queries', 'WARNING') as logs:
+            with timer(150, 150):
+                backend.count()
+                backend.msearch([{}, {'query': {}}])
+
+        assert [record.slow_query['method'] for record in logs.records] == [
+            'count', 'msearch']
+
+    def test_profile(self):
+        FakeConnection.reset([
+            (200, {'took': 120, 'hits': {}}),
+            (200, {'took': 130, 'hits': {}, 'profile': {'shards': []}}),
+        ])
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100,
+                               SLOW_QUERY_PROFILE=0.5)
+
+        with self.assertLogs('djangoes.slow_queries', 'WARNING') as logs:
+            with timer(150), patch('djangoes.backends.slowlog.random.random',
+                                   return_value=0.4):
+                backend.search('doc', '{"query": {}}')
+
+        (record,) = logs.records
+        assert record.slow_query['profile'] == {'shards': []}
+        (_, _, url, _, body) = FakeConnection.requests[1]
+        assert url == '/index/doc/_search'
+        assert body == b'{"query": {}, "profile": true}'
+
+    def test_profile_not_sampled(self):
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100,
+                               SLOW_QUERY_PROFILE=0.5)
+
+        with self.assertLogs('djangoes.slow_queries', 'WARNING'):
+            with timer(150), patch('djangoes.backends.slowlog.random.random',
+                                   return_value=0.6):
+                backend.search(body={'query': {}})
+
+        assert len(FakeConnection.requests) == 1
+
+    def test_profile_error(self):
+        FakeConnection.reset([(200, {'took': 120}), (400, {'error': 'no'})])
+        backend = make_backend(STATS=False, SLOW_QUERY_MS=100,
+                               SLOW_QUERY_PROFILE=1)
+
+        with self.assertLogs('djangoes.slow_queries', 'WARNING') as logs:
+            with timer(150):
+                result = backend.search(body={'query': {}})
+
+        assert result == {'took': 120}
+        assert logs.records[0].getMessage().startswith(
+            'Unable to profile slow query default.search')
+        assert logs.records[1].slow_query['profile'] is None
+
+    def test_get_took(self):
+        assert get_took(None) is None
+        assert get_took({'took': 3}) == 3
+        assert get_took({'responses': [{'took': 3}, {'took': 5}, {}]}) == 5
+        assert get_took({'responses': []}) is None
@@ -0,0 +1,229 @@
+import json
+from unittest import mock
+from unittest.case import TestCase
+
+from django.db import transaction
+
+from djangoes.backends.transactions import OnCommitInterceptor
+
+from .backend import FakeConnection, make_backend
+
+
+def read_body(request):
+    return [json.loads(line)
+            for line in request[4].decode('utf-8').splitlines()]
+
+
+def bulk_response(*statuses):
+    return (200, {'took': 1, 'errors': False,
+                  'items': [{'index': {'status': status}}
+                            for status in statuses]})
+
+
+class Rollback(Exception):
+    pass
+
+
+class TestOnCommit(TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+
+    def make_backend(self, **options):
+        return make_backend(ON_COMMIT=options or True)
+
+    def test_disabled(self):
+        backend = make_backend()
+
+        assert not any(isinstance(interceptor, OnCommitInterceptor)
+                       for interceptor in backend.interceptors)
+
+        with transaction.atomic():
+            backend.index('doc', {'a': 1}, 1)
+            assert len(FakeConnection.requests) == 1
+
+    def test_not_atomic(self):
+        backend = self.make_backend()
+
+        backend.index('doc', {'a': 1}, 1)
+
+        (request,) = FakeConnection.requests
+        assert request[2] == '/index/doc/1'
+
+    def test_commit(self):
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201, 200, 200)])
+
+        with transaction.atomic():
+            assert backend.index('doc', {'a': 1}, 1) is None
+            backend.update('doc', 1, {'doc': {'b': 2}}, retry_on_conflict=3)
+            backend.delete('doc', 2, routing='x')
+            assert FakeConnection.requests == []
+
+        (request,) = FakeConnection.requests
+        assert request[2] == '/_bulk'
+        assert read_body(request) == [
+            {'index': {'_index': 'index', '_type': 'doc', '_id': '1'}},
+            {'a': 1},
+            {'update': {'_index': 'index', '_type': 'doc', '_id': '1',
+                        '_retry_on_conflict': 3}},
+            {'doc': {'b': 2}},
+            {'delete': {'_index': 'index', '_type': 'doc', '_id': '2',
+                        '_routing': 'x'}},
+        ]
+
+    def test_create(self):
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201, 201)])
+
+        with transaction.atomic():
+            backend.create('doc', {'a': 1}, 1)
+            backend.index('doc', {'a': 2}, 2, op_type='create')
+
+        assert [list(line) for line in read_body(
+            FakeConnection.requests[0])[::2]] == [['create'], ['create']]
+
+    def test_rollback(self):
+        backend = self.make_backend()
+
+        with self.assertRaises(Rollback):
+            with transaction.atomic():
+                backend.index('doc', {'a': 1}, 1)
+                raise Rollback()
+
+        assert FakeConnection.requests == []
+
+        FakeConnection.reset([bulk_response(201)])
+        with transaction.atomic():
+            backend.index('doc', {'a': 2}, 2)
+
+        (request,) = FakeConnection.requests
+        assert read_body(request)[1] == {'a': 2}
+
+    def test_rollback_clears(self):
+        """Assert the writes of a rolled back transaction are dropped by the
+        rollback, not by the next write."""
+        backend = self.make_backend()
+        (interceptor,) = [interceptor for interceptor in backend.interceptors
+                          if isinstance(interceptor, OnCommitInterceptor)]
+
+        with self.assertRaises(Rollback):
+            with transaction.atomic():
+                backend.index('doc', {'a': 1}, 1)
+                assert len(interceptor.pending.operations) == 1
+                raise Rollback()
+
+        assert interceptor.pending.operations == []
+        assert interceptor.pending.callback is None
+
+    def test_savepoint_rollback(self):
+        """Assert the writes of a rolled back savepoint are dropped, even
+        when they are the last ones of the transaction."""
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201, 201)])
+
+        with transaction.atomic():
+            backend.index('doc', {'a': 1}, 1)
+            try:
+                with transaction.atomic():
+                    backend.index('doc', {'a': 2}, 2)
+                    raise Rollback()
+            except Rollback:
+                pass
+            with transaction.atomic():
+                backend.index('doc', {'a': 3}, 3)
+            try:
+                with transaction.atomic():
+                    backend.index('doc', {'a': 4}, 4)
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        (request,) = FakeConnection.requests
+        assert read_body(request)[1::2] == [{'a': 1}, {'a': 3}]
+
+    def test_callbacks_referenced(self):
+        """Assert the dropped callbacks do not need to be collected."""
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201)])
+
+        with transaction.atomic():
+            backend.index('doc', {'a': 1}, 1)
+            try:
+                with transaction.atomic():
+                    backend.index('doc', {'a': 2}, 2)
+                    callbacks = list(
+                        transaction.get_connection().run_on_commit)
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        (request,) = FakeConnection.requests
+        assert read_body(request)[1::2] == [{'a': 1}]
+        assert callbacks
+
+    def test_first_savepoint_rollback(self):
+        """Assert the flush is registered again when it is dropped with the
+        savepoint of the first write."""
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201)])
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    backend.index('doc', {'a': 1}, 1)
+                    raise Rollback()
+            except Rollback:
+                pass
+            backend.index('doc', {'a': 2}, 2)
+
+        (request,) = FakeConnection.requests
+        assert read_body(request)[1::2] == [{'a': 2}]
+
+    def test_nested_savepoints(self):
+        backend = self.make_backend()
+        FakeConnection.reset([bulk_response(201, 201)])
+
+        with transaction.atomic():
+            with transaction.atomic():
+                backend.index('doc', {'a': 1}, 1)
+                calls = []
+                transaction.on_commit(lambda: calls.append(
+                    len(FakeConnection.requests)))
+                try:
+                    with transaction.atomic():
+                        backend.index('doc', {'a': 2}, 2)
+                        raise Rollback()
+                except Rollback:
+                    pass
+                with transaction.atomic():
+                    backend.index('doc', {'a': 3}, 3)
+
+        (request,) = FakeConnection.requests
+        assert read_body(request)[1::2] == [{'a': 1}, {'a': 3}]
+        # The flush runs after the callbacks registered before the writes.
+        assert calls == [0]
+
+    def test_performed_at_once(self):
+        """Assert writes with other arguments are not deferred."""
+        backend = self.make_backend()
+
+        with transaction.atomic():
+            backend.index('doc', {'a': 1}, 1, refresh=True)
+            assert len(FakeConnection.requests) == 1
+
+    def test_errors_logged(self):
+        backend = self.make_backend()
+        FakeConnection.reset([(400, {'error': 'bad request'})])
+
+        with mock.patch('djangoes.backends.transactions.logger') as logger:
+            with transaction.atomic():
+                backend.index('doc', {'a': 1}, 1)
+
+        assert logger.exception.called
+
+        FakeConnection.reset([bulk_response(400)])
+        with mock.patch('djangoes.backends.transactions.logger') as logger:
+            with transaction.atomic():
+                backend.index('doc', {'a': 1}, 1)
+
+        assert logger.warning.called